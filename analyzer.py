@@ -18,8 +18,58 @@ import sys
 import datetime
 import time
 
-# Funcion reduce
-from functools import reduce
+# Busqueda binaria y copias superficiales
+import bisect
+import copy
+
+# Arreglos tipados para el almacen de eventos
+import array
+import math
+
+# Formato binario compilado
+import struct
+import mmap
+
+# Analisis por lotes
+import argparse
+import concurrent.futures
+import glob
+import os
+
+# Salida estructurada
+import json
+from contextlib import redirect_stdout
+
+# Perfilado
+import cProfile
+import tracemalloc
+
+# Cache de resultados
+import hashlib
+import io
+import functools
+
+# Scripts comprimidos y archivos
+import gzip
+import bz2
+import lzma
+import tarfile
+import zipfile
+import collections
+import itertools
+from contextlib import contextmanager, ExitStack
+
+# Base de datos de resultados
+import sqlite3
+
+# Servidor de analisis
+import http.server
+import socketserver
+import threading
+import signal
+import urllib.parse
+import multiprocessing
+import queue
 
 # Aniadir en este bloque
 
@@ -57,6 +107,9 @@ AGGIR_CONST = {
 # Constantes varias             #
 #################################
 
+# Version del analizador, forma parte de la clave de la cache de resultados
+ANALYZER_VERSION = '1.2'
+
 # Maximo tiempo encendido de una luz (10 horas)
 MAX_TIME_LIGHT_ON = datetime.timedelta(hours = 10)
 
@@ -115,25 +168,44 @@ MAX_MAIN_DOOR_OPEN_TIME = datetime.timedelta(minutes=30)
 # Cantidad maxima de tiempo a estar fuera de la cocina mientras se prepara algo
 MAX_TIME_OUT_COOKING = datetime.timedelta(minutes=45)
 
+# Propiedad que enciende/apaga cada tipo de device con tiempo max on
+POWER_PROPERTIES = {
+	'iCasa.BinaryLight': 'binaryLight.powerStatus',
+	'iCasa.DimmerLight': 'dimmerLight.powerLevel',
+	'iCasa.Heater': 'heater.powerLevel',
+	'iCasa.Cooler': 'cooler.powerLevel',
+}
+
+# Umbrales de las reglas; sus valores forman parte de la clave de la cache
+THRESHOLDS = [
+	'MAX_TIME_LIGHT_ON', 'MAX_TIME_HEAT_COOL_ON', 'MAX_CO2_CONCENTRATION',
+	'MAX_CO_CONCENTRATION', 'MIN_TEMPERATURE', 'MAX_TEMPERATURE',
+	'MIN_SLEEPING_TIME', 'DAYTIME_MIN', 'DAYTIME_MAX', 'NIGHTTIME_MIN',
+	'NIGHTTIME_MAX', 'MAX_STILL_TIME_BEDROOM', 'MAX_STILL_TIME_KITCHEN',
+	'MAX_STILL_TIME_BATHROOM', 'MAX_STILL_TIME_LIVINGROOM',
+	'MAX_STILL_TIME_HALLWAY', 'IDEAL_TIME_BW_MICTURITION',
+	'AVERAGE_MICTURITION_FREQ', 'MAX_MAIN_DOOR_OPEN_TIME',
+	'MAX_TIME_OUT_COOKING', 'POWER_PROPERTIES',
+]
+
+# Tamanio maximo por defecto de la cache de resultados (MB)
+DEFAULT_CACHE_SIZE = 256
+
+# Fraccion del tamanio maximo a la que se reduce la cache al superarlo, para
+# no recorrerla de nuevo en cada escritura
+CACHE_EVICT_TO = 0.9
+
+# Espera maxima (s) por el lock de escritura de la base de resultados
+DEFAULT_DB_TIMEOUT = 60.0
+
+# Servidor de analisis: puerto por defecto y tiempo maximo por pedido (s)
+DEFAULT_SERVE_PORT = 8765
+DEFAULT_SERVE_TIMEOUT = 30.0
+
 #################################
 # Funciones utiles              #
 #################################
 
-# Funcion varsInList
-# Retorna true si el key 'key' esta presente en algun elemento
-# de la lista 'list'.
-# @args
-#    key: clave a buscar
-#    list: lista
-# @returns
-#    Boolean
-
-def varsInList(key, list):
-	results = []
-	for e in list:
-		results.append(key in e)
-	return (True in results)
-
 # Funcion errorInList
 # Retorna true si el error 'error' esta presente en algun elemento
 # de la lista 'list', false en otro caso
@@ -149,247 +221,223 @@ def errorInList(value, list):
 		results.append(e['error'])
 	return (value in results)
 
-# Procedimiento numerador
-# Numera las acciones en el xml
+# Funcion normalizeZone
+# Normaliza el identificador de una zona tal como aparece en el script
 # @args
-#    root: raiz del xml
+#    zone_id: identificador de la zona
+# @returns
+#    String, identificador en minusculas y sin espacios
 
-def numerador(root):
-	i = 0
-	for child in root:
-		child.set('orden', i)
-		i += 1
+def normalizeZone(zone_id):
+	return zone_id.lower().replace(' ','')
 
-# Procedimiento update_dict_zones
-# Actualiza zonas de dicts existentes a sus instancias
-# correspondientes
+# Funcion delayValue
+# Convierte el valor y la unidad de un delay en un timedelta
 # @args
-#    d_list: lista de dicts
-#    i_list: lista de instancias
-
-def update_dict_zones(d_list, i_list):
-	for elem in d_list:
-		for e in elem['zone']:
-			for z in i_list:
-				if (e['zone'] == z.name):
-					e['zone'] = z
+#    value: cantidad de unidades de tiempo
+#    unit: unidad de tiempo ('s', 'm' u 'h')
+# @returns
+#    timedelta equivalente
+
+def delayValue(value, unit):
+	value = int(value)
+	if (unit == 's'):
+		return datetime.timedelta(seconds=value)
+	elif (unit == 'm'):
+		return datetime.timedelta(minutes=value)
+	else:
+		return datetime.timedelta(hours=value)
 
-# Procedimiento event_generator
-# Genera eventos a partir de listas y comparaciones
+# Funcion decodeValue
+# Decodifica una sola vez el valor de una propiedad o variable
+# @args
+#    value: valor tal como aparece en el script
+# @returns
+#    Float: 1.0/0.0 para 'true'/'false', el numero, o NaN si no es numerico
+
+def decodeValue(value):
+	if (value == 'true'):
+		return 1.0
+	elif (value == 'false'):
+		return 0.0
+	try:
+		return float(value)
+	except (TypeError, ValueError):
+		return float('nan')
+
+# Funcion parseStartDate
+# Obtiene fecha y hora de inicio a partir del atributo startdate
+# @args
+#    starttime: string con formato dd/mm/yyyy-hh:mm:ss
+# @returns
+#    Tupla (fecha como string, hora como timedelta)
+
+def parseStartDate(starttime):
+	# Obtengo fecha
+	date_sim = starttime.split('-')[0]
+	# Obtengo hora
+	time_sim = starttime.split('-')[1]
+	hrs = int(time_sim.split(':')[0])
+	mins = int(time_sim.split(':')[1])
+	secs = int(time_sim.split(':')[2])
+	return date_sim, datetime.timedelta(hours=hrs, minutes=mins, seconds=secs)
+
+# Funcion parseStartDay
 # @args
-#	d_list: lista de dicts con eventos
-#	e_list: lista de instancias de eventos
+#    date_sim: fecha de inicio de parseStartDate ('dd/mm/aaaa'), o None
+# @returns
+#    datetime.date, o None si no hay fecha valida
 
-def event_generator(d_list, e_list):
-	for d in d_list:
-		prev_events = [x for x in e_list if x.position < d['orden']]
-		# Si hay eventos previos a la accion
-		try:
-			min_distance = min([x.position for x in prev_events])
-			closest_event = [x for x in prev_events if x.position == min_distance][0]
-			executer = closest_event.executer
-			if (d['unit'] == 's'):
-				value = int(d['value'])
-				time_unit = datetime.timedelta(seconds=value)
-			elif (d['unit'] == 'm'):
-				value = int(d['value'])
-				time_unit = datetime.timedelta(minutes=value)
-			else:
-				value = int(d['value'])
-				time_unit = datetime.timedelta(hours=value)
-			e_list.append(TimeEvent(executer, d['orden'], d['unit'], \
-				time_unit, d['expr']))
-		# Si no hay nada antes del delay
-		except:
-			if (d['unit'] == 's'):
-				value = int(d['value'])
-				time_unit = datetime.timedelta(seconds=value)
-			elif (d['unit'] == 'm'):
-				value = int(d['value'])
-				time_unit = datetime.timedelta(minutes=value)
-			else:
-				value = int(d['value'])
-				time_unit = datetime.timedelta(hours=value)
-			e_list.append(TimeEvent(None, d['orden'], d['unit'], \
-				time_unit, d['expr']))
-
-# Procedimiento setPropertyEventsGenerator
-# Genera eventos property changing a partir de set-device-property
-# @args
-#    sim: resultado de lectura de xml 
-#    sim_child: linea de la simulacion con set-device-property
-#    zone: instancia de clase zone donde se ubica el device
-#    device: dispositivo modificado por set-device-property
-#    changes: dict property/value del device
-#    elist: lista de eventos
-
-def changePropertyEventGenerator(sim, sim_child, zone, device, changes, elist):
-	last_move = [x for x in sim if x.attrib['orden'] < sim_child.attrib['orden'] \
-				and x.tag == 'move-person-zone' and \
-				x.attrib['zoneId'].lower().replace(' ','') == zone.name]
-	if (last_move):
-		executer = last_move[len(last_move) - 1].attrib['personId']
-		executer = [p for p in pclass if p.name == executer]
-		# Creo instancias
-		elist.append(PropertyChangingEvent(executer, sim_child.attrib['orden'], \
-			device, changes))
-	else:
-		# No puedo inferir por el ultimo movimiento a la zona del device
-		# porque no hay
-		elist.append(PropertyChangingEvent(None, sim_child.attrib['orden'], \
-			device, changes))
+def parseStartDay(date_sim):
+	try:
+		return datetime.datetime.strptime(date_sim, '%d/%m/%Y').date()
+	except (TypeError, ValueError):
+		return None
+
+# Funcion powerState
+# Indica si el valor de la propiedad de encendido de un device lo enciende
+# @args
+#    value: valor de la propiedad ('true'/'false' o nivel de potencia)
+# @returns
+#    Boolean
 
+def powerState(value):
+	return decodeValue(value) > 0
 
-# Funcion positionOrdering
-# Funciona de key para el sort()
+# Funcion deviceIntervals
+# Recorre una vez los eventos de una situacion llevando el estado de cada
+# device con propiedad de encendido (POWER_PROPERTIES), y arma un intervalo
+# por cada encendido hasta el siguiente apagado del mismo device
 # @args
-#    event: evento de la lista de eventos
+#    events: lista de eventos de la situacion, en orden
+#    clock: timeline acotado a la situacion
 # @returns
-#    Int, posicion en la simulacion de un evento
+#    Dict posicion del encendido -> Interval
+
+def deviceIntervals(events, clock):
+	intervals = {}
+	# Encendidos sin apagado aun, por device
+	opened = {}
+	for x in events:
+		if (not isinstance(x, PropertyChangingEvent) or \
+			POWER_PROPERTIES.get(x.device.type_name) != x.changedProperty['property']):
+			continue
+		if (x.number > 0):
+			opened.setdefault(x.device.name, []).append(x)
+		else:
+			for on in opened.pop(x.device.name, []):
+				intervals[on.position] = Interval(on, x.position, clock)
+	# Los que nunca se apagaron duran hasta el final de la situacion
+	for name in opened:
+		for on in opened[name]:
+			intervals[on.position] = Interval(on, None, clock)
+	return intervals
+
+# Funcion parseDoors
+# Interpreta la configuracion de puertas exteriores: nombres separados por
+# comas, cada uno de una zona (todas sus puertas son exteriores) o del id
+# de un DoorWindowSensor
+# @args
+#    spec: texto de configuracion ('livingroom' o 'livingroom,garage,Door-3')
+# @returns
+#    Frozenset de nombres
 
-def positionOrdering(event):
-	return event.position
+@functools.lru_cache(maxsize=64)
+def parseDoors(spec):
+	return frozenset([x.strip() for x in str(spec).split(',') if x.strip()])
+
+# Funcion isExteriorDoor
+# @args
+#    device: device
+#    doors: frozenset de parseDoors
+# @returns
+#    Boolean, si el device es un sensor de una puerta exterior
+
+def isExteriorDoor(device, doors):
+	if (device.type_name != 'iCasa.DoorWindowSensor'):
+		return False
+	if (device.name in doors):
+		return True
+	return bool(device.zones) and getattr(device.zones[0]['zone'], 'name', None) in doors
+
+# Funcion doorIntervals
+# Recorre una vez los eventos de una situacion llevando el estado de cada
+# puerta exterior, y arma un intervalo por cada apertura hasta el siguiente
+# cierre de la misma puerta
+# @args
+#    events: lista de eventos de la situacion, en orden
+#    clock: timeline acotado a la situacion
+#    doors: frozenset de parseDoors
+# @returns
+#    Dict posicion de la apertura -> Interval, en orden de apertura
+
+def doorIntervals(events, clock, doors):
+	intervals = {}
+	# Aperturas sin cierre aun, por puerta
+	opened = {}
+	for x in events:
+		if (not isinstance(x, PropertyChangingEvent) or not isExteriorDoor(x.device, doors)):
+			continue
+		value = x.changedProperty['value']
+		if (value == 'true'):
+			intervals[x.position] = None
+			opened.setdefault(x.device.name, []).append(x)
+		elif (value == 'false'):
+			for on in opened.pop(x.device.name, []):
+				intervals[on.position] = Interval(on, x.position, clock)
+	# Las que nunca se cerraron quedan abiertas hasta el final de la situacion
+	for name in opened:
+		for on in opened[name]:
+			intervals[on.position] = Interval(on, None, clock)
+	return intervals
 
 # Procedimiento deviceTimeOn
-# Aniade a lista de errores aquellos eventos que excedieron tiempo max de device on
+# Aniade a lista de errores los problemas de un intervalo de encendido:
+# luces encendidas de madrugada y devices que excedieron su tiempo max on
 # @args
-#    events: lista de eventos a revisar en busca de turn off
-#    e: evento puntual de turn on
+#    interval: intervalo de encendido de un device
 #    error_list: lista de errores al cual aniadir nuevos
-#    time_sim: hora de inicio de la simulacion
-
-def deviceTimeOn(events, e, error_list, time_sim):
-	# Depende del tipo de device, tendremos diferentes chequeos a realizar
-	if (e.device.type_name == 'iCasa.DimmerLight'):
-		# Si es una dimmer light
-		device_off = [x for x in events if isinstance(x, PropertyChangingEvent) and \
-				x.position > e.position and \
-				x.changedProperty['property'] == 'dimmerLight.powerLevel' and \
-				float(e.changedProperty['value']) == 0 and \
-				e.device.name == x.device.name]
-	elif (e.device.type_name == 'iCasa.Heater'):
-		# Si  es un heater
-		device_off = [x for x in events if isinstance(x, PropertyChangingEvent) and \
-				x.position > e.position and \
-				x.changedProperty['property'] == 'heater.powerLevel' and \
-				float(e.changedProperty['value']) == 0 and \
-				e.device.name == x.device.name]
-	elif (e.device.type_name == 'iCasa.Cooler'):
-		# Si es un cooler
-		device_off = [x for x in events if isinstance(x, PropertyChangingEvent) and \
-				x.position > e.position and \
-				x.changedProperty['property'] == 'cooler.powerLevel' and \
-				float(e.changedProperty['value']) == 0 and \
-				e.device.name == x.device.name]
-	else:
-		# Si es binary light
-		device_off = [x for x in events if isinstance(x, PropertyChangingEvent) and \
-				x.position > e.position and \
-				x.changedProperty['property'] == 'binaryLight.powerStatus' and \
-				e.changedProperty['value'] == 'false' and \
-				e.device.name == x.device.name]
-
-	# Si fue apagado
-	if (device_off):
-		if (e.device.type_name == 'iCasa.DimmerLight' or e.device.type_name == 'iCasa.BinaryLight'):
-			# Primero chequeo horario de encendido
-			day_time_light_on = [x.value for x in events if isinstance(x, TimeEvent) and \
-								x.position < e.position]
-			if (day_time_light_on):
-				current_time = time_sim + reduce((lambda x, y: x + y), day_time_light_on)
-				current_time = (datetime.datetime.min + current_time).time()
-				if (NIGHTTIME_MAX > current_time and current_time > datetime.time(0, 0, 0)):
-					# Problema, luz encendida a horas inadecuadas
-					error_list.append({'position': e.position, 'executer': e.executer, \
-						'error': 'Lights on at wrong time'})
-		device_off_position == device_off[0].position
-		delays = [x.value for x in events if isinstance(x, TimeEvent) and \
-		x.position > e.position and x.position < device_off_position]
-		# Tiempo que se mantuvo encendido
-		#time_since_on = (datetime.datetime.min + reduce((lambda x, y: x + y), delays)).time()
-		time_since_on = reduce((lambda x, y: x + y), delays)
-		# Si excede tiempo maximo, hay problemas
-		if (e.device.type_name == 'iCasa.DimmerLight'):
-			# Si es dimmer light
-			if (time_since_on > MAX_TIME_LIGHT_ON):
-				error_list.append({'position': e.position, 'executer': e.executer, \
-					'error': 'DimmerLight exceeded MAX time ON'})
-		elif (e.device.type_name == 'iCasa.Heater'):
-			# Si es heater
-			if (time_since_on > MAX_TIME_HEAT_COOL_ON):
+#    clock: timeline acotado a la situacion
+
+def deviceTimeOn(interval, error_list, clock):
+	e = interval.on_event
+	type_name = interval.device.type_name
+
+	if (type_name == 'iCasa.DimmerLight' or type_name == 'iCasa.BinaryLight'):
+		# Primero chequeo horario de encendido
+		if (clock.count(None, e.position)):
+			current_time = interval.start_time
+			if (NIGHTTIME_MAX > current_time and current_time > datetime.time(0, 0, 0)):
+				# Problema, luz encendida a horas inadecuadas
 				error_list.append({'position': e.position, 'executer': e.executer, \
-					'error': 'Heater exceeded MAX time ON'})
-		elif (e.device.type_name == 'iCasa.Cooler'):
-			# Si es cooler
-			if (time_since_on > MAX_TIME_HEAT_COOL_ON):
-				error_list.append({'position': e.position, 'executer': e.executer, \
-					'error': 'Cooler exceeded MAX time ON'})
-		else:
-			# Si es binary light
-			if (time_since_on > MAX_TIME_LIGHT_ON):
-				error_list.append({'position': e.position, 'executer': e.executer, \
-					'error': 'BinaryLight exceeded MAX time ON'})
+					'error': 'Lights on at wrong time'})
 
-	# Si no apagaron el device, revisamos el tiempo que estuvo encendido en la sim
+	# Tiempo maximo segun el tipo de device
+	if (type_name == 'iCasa.Heater' or type_name == 'iCasa.Cooler'):
+		max_time = MAX_TIME_HEAT_COOL_ON
 	else:
-		if (e.device.type_name == 'iCasa.DimmerLight' or e.device.type_name == 'iCasa.BinaryLight'):
-			# Primero chequeo horario de encendido
-			day_time_light_on = [x.value for x in events if isinstance(x, TimeEvent) and \
-								x.position < e.position]
-			if (day_time_light_on):
-				current_time = time_sim + reduce((lambda x, y: x + y), day_time_light_on)
-				current_time = (datetime.datetime.min + current_time).time()
-				if (NIGHTTIME_MAX > current_time and current_time > datetime.time(0, 0, 0)):
-					# Problema, luz encendida a horas inadecuadas
-					error_list.append({'position': e.position, 'executer': e.executer, \
-						'error': 'Lights on at wrong time'})
-		delays = [x.value for x in events if isinstance(x, TimeEvent) and \
-		x.position > e.position]
-		if (delays):
-			# Tiempo que se mantuvo encendido
-			#time_since_on = (datetime.datetime.min + reduce((lambda x, y: x + y), delays)).time()
-			time_since_on = reduce((lambda x, y: x + y), delays)
-		else:
-			#time_since_on = (datetime.datetime.min).time()
-			time_since_on = datetime.timedelta(seconds=0)
-		# Si excede tiempo maximo, hay problemas
-		if (e.device.type_name == 'iCasa.DimmerLight'):
-			# Si es dimmer light
-			if (time_since_on > MAX_TIME_LIGHT_ON):
-				error_list.append({'position': e.position, 'executer': e.executer, \
-					'error': 'DimmerLight exceeded MAX time ON'})
-		elif (e.device.type_name == 'iCasa.Heater'):
-			# Si es heater
-			if (time_since_on > MAX_TIME_HEAT_COOL_ON):
-				error_list.append({'position': e.position, 'executer': e.executer, \
-					'error': 'Heater exceeded MAX time ON'})
-		elif (e.device.type_name == 'iCasa.Cooler'):
-			# Si es cooler
-			if (time_since_on > MAX_TIME_HEAT_COOL_ON):
-				error_list.append({'position': e.position, 'executer': e.executer, \
-					'error': 'Cooler exceeded MAX time ON'})
-		else:
-			# Si es binary light
-			if (time_since_on > MAX_TIME_LIGHT_ON):
-				error_list.append({'position': e.position, 'executer': e.executer, \
-					'error': 'BinaryLight exceeded MAX time ON'})
+		max_time = MAX_TIME_LIGHT_ON
+
+	# Si excede tiempo maximo, hay problemas
+	if (interval.duration > max_time):
+		error_list.append({'position': e.position, 'executer': e.executer, \
+			'error': '%s exceeded MAX time ON' % type_name.split('.')[1]})
 
 # Procedimiento possibleSedentarism
 # Analiza patrones de tiempo para hallar problemas con no salir de la habitacion
 # pues no hay moves futuros
 # @args
-#    events: lista de eventos a recorrer para comparaciones
+#    clock: timeline acotado a la situacion
 #    e: evento move inicial
-#    current_time: tiempo actual de la simulacion
 #    error_list: lista de errores al cual aniadir nuevos
 
-def possibleSedentarism(events, e, current_time, error_list):
+def possibleSedentarism(clock, e, error_list):
+	# Tiempo actual de la simulacion
+	current_time = clock.time_at(e.position)
 	start_stuck_time = (datetime.datetime.min + current_time).time()
 	# Hallamos tiempo en reposo
-	delays_post_move = [x.value for x in events if isinstance(x, TimeEvent) and \
-			x.position > e.position]
-	if (delays_post_move):
-		time_post_move = reduce((lambda x, y: x + y), delays_post_move)
+	if (clock.count(e.position, None)):
+		time_post_move = clock.elapsed(e.position, None)
 		# Tiempo en habitacion sin moverme a otro lado contando tiempo actual
 		lazy_time = current_time + time_post_move
 		lazy_time = (datetime.datetime.min + lazy_time).time()
@@ -403,43 +451,40 @@ def possibleSedentarism(events, e, current_time, error_list):
 # Analiza patrones de tiempo para hallar problemas con no salir de la habitacion
 # cuando hay moves tiempo despues
 # @args
-#    events: lista de eventos a recorrer para comparaciones
+#    clock: timeline acotado a la situacion
 #    e: evento move inicial
-#    current_time: tiempo actual de la simulacion
 #    next_moves: lista de proximos movimientos del mismo executer
 #    error_list: lista de errores al cual aniadir nuevos
 
-def possibleSedentarismBM(events, e, current_time, next_moves, error_list):
+def possibleSedentarismBM(clock, e, next_moves, error_list):
+	# Tiempo actual de la simulacion
+	current_time = clock.time_at(e.position)
 	# En formato time
-	start_stuck_time = (datetime.datetime.min + current_time).time()								
+	start_stuck_time = (datetime.datetime.min + current_time).time()
 	# Se debe hallar la distancia en tiempo entre cada move
-	delays_bw_moves = [x.value for x in events if isinstance(x, TimeEvent) and \
-				x.position > e.position and x.position < next_moves[0].position]
-	if (delays_bw_moves):
-		time_between_moves = reduce((lambda x, y: x + y), delays_bw_moves)
+	if (clock.count(e.position, next_moves[0].position)):
+		time_between_moves = clock.elapsed(e.position, next_moves[0].position)
 		# Tiempo entre moves considerando tiempo actual de la sim
 		finish_stuck_time = current_time + time_between_moves
-		finish_stuck_time = (datetime.datetime.min + current_time).time()
+		finish_stuck_time = (datetime.datetime.min + finish_stuck_time).time()
 		if (DAYTIME_MIN < finish_stuck_time and DAYTIME_MAX > finish_stuck_time and \
 			NIGHTTIME_MIN > start_stuck_time and time_between_moves > MAX_STILL_TIME_BEDROOM):
-			elist.append({'position': e.position, 'executer': e.executer, \
+			error_list.append({'position': e.position, 'executer': e.executer, \
 				'error': 'Not getting out of room for much time'})
 
 # Procedimiento possibleAccident
 # Analiza patrones de tiempo para hallar problemas con no salir de alguna habitacion
 # puntual a excepcion de bedroom
 # @args
-#    events: lista de eventos a recorrer para comparaciones
+#    clock: timeline acotado a la situacion
 #    e: evento move inicial
 #    e_zone: nombre zona pre-procesado
 #    error_list: lista de errores al cual aniadir nuevos
 
-def possibleAccident(events, e, e_zone, error_list):
+def possibleAccident(clock, e, e_zone, error_list):
 	# Determinamos tiempo post movimiento
-	delays_post_move = [x.value for x in events if isinstance(x, TimeEvent) and \
-				x.position > e.position]
-	if (delays_post_move):
-		time_post_move = reduce((lambda x, y: x + y), delays_post_move)
+	if (clock.count(e.position, None)):
+		time_post_move = clock.elapsed(e.position, None)
 		# Identificamos problemas
 		if (e_zone == 'bathroom' and time_post_move > MAX_STILL_TIME_BATHROOM):
 			error_list.append({'position': e.position, 'executer': e.executer, \
@@ -458,18 +503,16 @@ def possibleAccident(events, e, e_zone, error_list):
 # Analiza patrones de tiempo para hallar problemas con no salir de alguna habitacion
 # puntual a excepcion de bedroom
 # @args
-#    events: lista de eventos a recorrer para comparaciones
+#    clock: timeline acotado a la situacion
 #    e: evento move inicial
 #    e_zone: nombre de zona pre-procesado
 #    next_moves: lista de proximos movimientos del mismo executer
 #    error_list: lista de errores al cual aniadir nuevos
 
-def possibleAccidentBM(events, e, e_zone, next_moves, error_list):
+def possibleAccidentBM(clock, e, e_zone, next_moves, error_list):
 	# Determinamos tiempo entre movimientos
-	delays_bw_moves = [x.value for x in events if isinstance(x, TimeEvent) and \
-				x.position > e.position and x.position < next_moves[0].position]
-	if (delays_bw_moves):
-		time_between_moves = reduce((lambda x, y: x + y), delays_bw_moves)
+	if (clock.count(e.position, next_moves[0].position)):
+		time_between_moves = clock.elapsed(e.position, next_moves[0].position)
 		# Identificamos problemas
 		if (e_zone == 'bathroom' and time_between_moves > MAX_STILL_TIME_BATHROOM):
 			error_list.append({'position': e.position, 'executer': e.executer, \
@@ -484,6 +527,126 @@ def possibleAccidentBM(events, e, e_zone, next_moves, error_list):
 			error_list.append({'position': e.position, 'executer': e.executer, \
 				'error': 'Possible accident in HALLWAY'})
 
+# Funcion abandonedCooking
+# Detecta en una sola pasada las veces que se dejo cocinando la cocina.
+# Cada cambio de temperatura de la cocina abre un candidato con su valor;
+# un cambio posterior mayor lo descarta, y se guardan el primer cambio
+# menor (de quien cocina y de cualquiera) y la primera salida de la cocina,
+# vuelta y nueva salida de quien cocina. Los candidatos vivos forman una
+# pila de valores no crecientes, asi cada cambio solo toca los candidatos
+# que descarta o baja.
+# Al final, un candidato no descartado es abandono si:
+#   - quien cocina bajo el calor: salio y volvio antes de bajarlo, y estuvo
+#     afuera mas de MAX_TIME_OUT_COOKING
+#   - otro bajo el calor: quien cocina salio antes y paso mas de
+#     MAX_TIME_OUT_COOKING hasta que lo bajaron
+#   - nadie lo bajo: quien cocina salio, volvio y salio de nuevo por mas de
+#     MAX_TIME_OUT_COOKING hasta el final, o salio sin volver (y el calor
+#     no era menor que su ultimo cambio de temperatura) y paso mas de
+#     MAX_TIME_OUT_COOKING desde el cambio hasta el final
+# @args
+#    events: lista de eventos de la situacion, en orden
+#    clock: timeline acotado a la situacion
+# @returns
+#    Set de posiciones de los cambios de temperatura abandonados
+
+def abandonedCooking(events, clock):
+	# Candidatos no descartados, con valores no crecientes
+	alive = collections.deque()
+	# Candidatos sin cambio menor de cualquiera / de quien cocina
+	waiting_any = collections.deque()
+	waiting_own = {}
+	# Por persona, candidatos esperando salida, vuelta y nueva salida
+	phases = {}
+	# Por persona, ultimo valor de temperatura que cambio, en cualquier zona
+	last_temp = {}
+	candidates = []
+
+	# Los descartados quedan al final de cada cola
+	def discard(pending):
+		while (pending and pending[-1]['killed']):
+			pending.pop()
+
+	for x in events:
+		if (isinstance(x, MoveEvent)):
+			lists = phases.get(x.executer)
+			if (lists is None):
+				continue
+			if (x.zone.name == 'kitchen'):
+				for c in lists[1]:
+					c['back'] = x
+				lists[2] += lists[1]
+				lists[1] = []
+			else:
+				for c in lists[2]:
+					c['leave_again'] = x
+				for c in lists[0]:
+					c['leave'] = x
+				lists[2] = []
+				lists[1] += lists[0]
+				lists[0] = []
+		elif (isinstance(x, VarChangingEvent) and x.change['variable'] == 'Temperature'):
+			value = x.number
+			previous = last_temp.get(x.executer)
+			last_temp[x.executer] = value
+			if (x.change['zone'].name != 'kitchen' or math.isnan(value)):
+				continue
+			# Un valor mayor descarta los candidatos menores
+			while (alive and alive[-1]['value'] < value):
+				alive.pop()['killed'] = True
+			# Un valor menor es el primer cambio menor de los mayores
+			discard(waiting_any)
+			while (waiting_any and waiting_any[0]['value'] > value):
+				waiting_any.popleft()['lower_any'] = x
+			own = waiting_own.setdefault(x.executer, collections.deque())
+			discard(own)
+			while (own and own[0]['value'] > value):
+				own.popleft()['lower_own'] = x
+			# Nuevo candidato
+			c = {'event': x, 'value': value, 'previous': previous, 'killed': False, \
+				'lower_any': None, 'lower_own': None, 'leave': None, 'back': None, 'leave_again': None}
+			candidates.append(c)
+			alive.append(c)
+			waiting_any.append(c)
+			own.append(c)
+			phases.setdefault(x.executer, [[], [], []])[0].append(c)
+
+	abandoned = set()
+	for c in candidates:
+		if (c['killed']):
+			continue
+		e = c['event']
+		leave = c['leave']
+		back = c['back']
+		if (c['lower_own'] is not None):
+			# Quien cocina bajo el calor: tiempo afuera antes de bajarlo
+			down = c['lower_own'].position
+			if (leave is None or leave.position > down or back is None or back.position > down):
+				continue
+			start, end = leave.position, back.position
+		elif (c['lower_any'] is not None):
+			# Otro bajo el calor: tiempo desde que quien cocina salio
+			down = c['lower_any'].position
+			if (leave is None or leave.position > down):
+				continue
+			start, end = leave.position, down
+		elif (leave is None):
+			# Nadie lo bajo y quien cocina no salio, no hay inferencia posible
+			continue
+		elif (back is not None):
+			# Volvio y se fue de nuevo sin apagar
+			if (c['leave_again'] is None):
+				continue
+			start, end = c['leave_again'].position, None
+		else:
+			# Nunca volvio
+			if (c['previous'] is None or c['value'] < c['previous']):
+				continue
+			start, end = e.position, None
+		if (clock.count(start, end) and clock.elapsed(start, end) > MAX_TIME_OUT_COOKING):
+			abandoned.add(e.position)
+	return abandoned
+
 #################################
 # Clases                        #
 #################################
@@ -495,19 +658,81 @@ def possibleAccidentBM(events, e, e_zone, next_moves, error_list):
 #    position: posicion de aparicion en script
 #    name: nombre de la zona
 #    variables: dict de variables asociadas a zona
+#    related_events: lista de cambios de variables de esa zona, en orden
+#    series: dict variable -> VariableSeries con sus valores en el tiempo
 
 class Zone:
 
 	# Inicializador
-	def __init__(self, position, name, variables):
+	def __init__(self, position, name, variables, related_events):
 		self.position = position
 		self.name = name
 		self.variables = variables
+		self.related_events = related_events
+		self.series = {}
 
 	# Representacion en string
 	def __str__(self):
 		return self.name
 
+	# Valor de la variable 'variable' vigente en la posicion 'position',
+	# None si aun no tenia valor
+	def valueAt(self, variable, position):
+		series = self.series.get(variable)
+		if (series is None):
+			return None
+		return series.at(position)
+
+# Clase VariableSeries
+# Serie de tiempo de una variable de zona: cada valor que toma, en orden de
+# posicion, con el tiempo simulado del cambio. Permite consultar en O(log n)
+# el valor vigente en una posicion
+#
+# @attrs
+#    positions: posiciones de los cambios
+#    seconds: segundos simulados desde el inicio hasta cada cambio
+#    values: valores (NaN si no son numericos)
+
+class VariableSeries:
+
+	__slots__ = ('positions', 'seconds', 'values')
+
+	# Inicializador
+	def __init__(self):
+		self.positions = array.array('q')
+		self.seconds = array.array('q')
+		self.values = array.array('d')
+
+	def __len__(self):
+		return len(self.positions)
+
+	# Aniade un cambio, posterior a los ya guardados
+	def append(self, position, seconds, value):
+		self.positions.append(position)
+		self.seconds.append(seconds)
+		self.values.append(value)
+
+	# Indice del ultimo cambio anterior a la posicion 'position', -1 si no hay
+	def index(self, position):
+		return bisect.bisect_right(self.positions, position) - 1
+
+	# Valor vigente en la posicion 'position', None si no hay
+	def at(self, position):
+		i = self.index(position)
+		return None if i < 0 else self.values[i]
+
+	# Segundos simulados desde el inicio hasta el cambio vigente en la
+	# posicion 'position', None si no hay
+	def time_at(self, position):
+		i = self.index(position)
+		return None if i < 0 else self.seconds[i]
+
+	# Descarta los cambios anteriores al ultimo
+	def keepLast(self):
+		del self.positions[:-1]
+		del self.seconds[:-1]
+		del self.values[:-1]
+
 # Clase Device
 # Modela los dispositivos del simulador
 #
@@ -538,7 +763,7 @@ class Device:
 #    name: nombre de la persona
 #    type: tipo de persona
 #    zones: lista de zonas donde se ubico la persona
-#    aggir_const: dict de variables AGGIR
+#    aggir_const: dict de variables AGGIR de esta persona
 
 class Person:
 
@@ -562,6 +787,8 @@ class Person:
 
 class Event:
 
+	__slots__ = ('executer', 'position', 'event')
+
 	# Inicializador
 	def __init__(self, executer, position, event):
 		self.executer = executer
@@ -580,6 +807,8 @@ class Event:
 
 class MoveEvent(Event):
 
+	__slots__ = ('zone',)
+
 	# Inicializador
 	def __init__(self, executer, position, event, zone):
 		self.executer = executer
@@ -596,886 +825,1645 @@ class MoveEvent(Event):
 #
 # @attrs
 #    change: dict de variable/value modificado
+#    number: valor decodificado (decodeValue)
 
 class VarChangingEvent(Event):
 
+	__slots__ = ('change', 'number')
+
 	# Inicializador
-	def __init__(self, executer, position, event, change):
+	def __init__(self, executer, position, event, change, number=None):
 		self.executer = executer
 		self.position = position
 		self.event = event
 		self.change = change
+		if (number is None):
+			number = decodeValue(change['value'])
+		self.number = number
 
 # Clase TimeEvent - Subclase de Event
 # Modela los delays del simulador
 #
 # @attrs
 #    unit: unidad de tiempo
-#    value: cantidad de unidades de tiempo
+#    seconds: duracion del delay en segundos (entero)
+#    value: duracion como timedelta, calculada al consultarla
 
 class TimeEvent(Event):
 
+	__slots__ = ('unit', 'seconds')
+
 	# Inicializador
 	def __init__(self, executer, position, unit, value, event):
 		self.executer = executer
 		self.position = position
 		self.unit = unit
-		self.value = value
+		self.seconds = int(value.total_seconds())
 		self.event = event
 
+	@property
+	def value(self):
+		return datetime.timedelta(seconds=self.seconds)
+
 	def __str__(self):
 		return '{self.event} relacionado con persona {self.executer}'.format(self=self)
 
-# Clase PropertyChangingEvent
+# Clase PropertyChangingEvent - Subclase de Event
 # Modela eventos que cambian propiedades de devices
 #
 # @attrs
-#    executer: sujeto involucrado en la accion
-#    position: posicion del evento
 #    device: dispositivo modificado
-#    changedProperty: dict de prop(s) modificada(s) con value
+#    changedProperty: dict de prop(s) modificada(s) con value, compartido
+#                     por los eventos con el mismo cambio: no modificar
+#    number: valor decodificado (decodeValue)
+
+class PropertyChangingEvent(Event):
 
-class PropertyChangingEvent:
+	__slots__ = ('device', 'changedProperty', 'number')
 
 	# Inicializador
-	def __init__(self, executer, position, device, changedProperty):
+	def __init__(self, executer, position, device, changedProperty, number=None):
 		self.executer = executer
 		self.position = position
+		self.event = 'set-device-property'
 		self.device = device
 		self.changedProperty = changedProperty
+		if (number is None):
+			number = decodeValue(changedProperty['value'])
+		self.number = number
 
 	def __str__(self):
 		return 'Cambio en {self.device.name} de tipo {self.device.type_name}'.format(self=self) \
 		+ ' causado por {self.executer}'.format(self=self)
 
+# Clase Interval
+# Modela un periodo de encendido de un device
+#
+# @attrs
+#    device: dispositivo encendido
+#    on_event: evento que lo encendio
+#    on_position: posicion del encendido
+#    off_position: posicion del apagado, None si no se apago en la situacion
+#    start_time: hora del dia del encendido
+#    duration: tiempo que estuvo encendido
+
+class Interval:
+
+	# Inicializador
+	def __init__(self, on_event, off_position, clock):
+		self.device = on_event.device
+		self.on_event = on_event
+		self.on_position = on_event.position
+		self.off_position = off_position
+		self.start_time = clock.time_of_day(on_event.position)
+		self.duration = clock.elapsed(on_event.position, off_position)
+
+	def __str__(self):
+		return '{self.device.name} encendido de {self.on_position} a {self.off_position}'.format(self=self)
+
 # Clase Situation
-# Modela una situacion en el simulador, posee un
-# inicio, acciones dentro de ella, y un final
+# Modela una situacion en el simulador, posee un inicio, acciones dentro
+# de ella, y un final. Es una vista sobre la lista de eventos de la
+# situacion, que se arma una sola vez; los eventos de cada tipo y de cada
+# device se agrupan en una pasada la primera vez que se piden
 #
 # @attrs
-#    first_act: accion inicial de una situacion
-#    events: lista de eventos ocurridos luego del inicio
-#    last_act: ultimo evento de una situacion
+#    events: eventos de la situacion, en orden
+#    by_type: dict clase -> eventos de esa clase, None hasta pedirlo
+#    by_device: dict nombre -> cambios de propiedad de ese device, None
+#               hasta pedirlo
+#    by_person: dict (clase, persona) -> eventos de esa clase ejecutados
+#               por esa persona, None hasta pedirlo
 
 class Situation:
 
 	# Inicializador
-	def __init__(self, first_act, events, last_act):
-		self.first_act = first_act
+	def __init__(self, events):
 		self.events = events
-		self.last_act = last_act
+		self.by_type = None
+		self.by_device = None
+		self.by_person = None
 
 	# Retorna accion inicial
 	def get_first_event(self):
-		return self.first_act
-
-	# Retorna lista de acciones
-	def get_mid_events(self):
-		return self.events
+		return self.events[0]
 
 	# Retorna accion final
 	def get_last_event(self):
-		return self.last_act
+		return self.events[-1]
+
+	# Retorna los eventos cuya clase es 'cls', en orden. No modificar
+	def of_type(self, cls):
+		if (self.by_type is None):
+			self.by_type = {}
+			for e in self.events:
+				self.by_type.setdefault(type(e), []).append(e)
+		return self.by_type.get(cls, [])
+
+	# Retorna los cambios de propiedad del device 'name', en orden. No modificar
+	def of_device(self, name):
+		if (self.by_device is None):
+			self.by_device = {}
+			for e in self.of_type(PropertyChangingEvent):
+				self.by_device.setdefault(e.device.name, []).append(e)
+		return self.by_device.get(name, [])
+
+	# Retorna los eventos de clase 'cls' ejecutados por 'person', en orden.
+	# No modificar
+	def of_person(self, cls, person):
+		if (self.by_person is None):
+			self.by_person = {}
+			for e in self.events:
+				self.by_person.setdefault((type(e), e.executer), []).append(e)
+		return self.by_person.get((cls, person), [])
+
+# Clase Timeline
+# Indice de tiempo simulado acumulado (suma de prefijos) sobre los delays
+# de la lista de eventos ordenada. Permite consultar en O(log n) el tiempo
+# transcurrido entre dos posiciones del script
+#
+# @attrs
+#    start: hora de inicio de la simulacion
+#    positions: posiciones de los delays, en orden
+#    cumulative: segundos acumulados antes de cada delay (y total al final)
+#    lower: cota inferior exclusiva de la ventana, None si no hay
+#    upper: cota superior exclusiva de la ventana, None si no hay
+
+class Timeline:
+
+	# Inicializador
+	def __init__(self, events, start):
+		self.start = start
+		self.positions = []
+		self.cumulative = [0]
+		for e in events:
+			if (isinstance(e, TimeEvent)):
+				self.positions.append(e.position)
+				self.cumulative.append(self.cumulative[-1] + e.seconds)
+		self.lower = None
+		self.upper = None
+
+	# Retorna una vista del timeline acotada a las posiciones [first, last],
+	# por ejemplo, las de una situacion. Comparte los indices, no los copia
+	def window(self, first, last):
+		view = copy.copy(self)
+		view.lower = first - 1
+		view.upper = last + 1
+		return view
+
+	# Rango de indices de los delays con posicion estrictamente entre a y b.
+	# None indica el extremo correspondiente de la ventana
+	def span(self, a, b):
+		if (a is None):
+			a = self.lower
+		if (b is None):
+			b = self.upper
+		i = 0 if a is None else bisect.bisect_right(self.positions, a)
+		j = len(self.positions) if b is None else bisect.bisect_left(self.positions, b)
+		return i, max(i, j)
+
+	# Tiempo transcurrido entre las posiciones a y b (exclusivas)
+	def elapsed(self, a=None, b=None):
+		i, j = self.span(a, b)
+		return datetime.timedelta(seconds=self.cumulative[j] - self.cumulative[i])
+
+	# Cantidad de delays entre las posiciones a y b (exclusivas)
+	def count(self, a=None, b=None):
+		i, j = self.span(a, b)
+		return j - i
+
+	# Tiempo simulado al llegar a la posicion 'position'
+	def time_at(self, position):
+		return self.start + self.elapsed(None, position)
+
+	# Hora del dia al llegar a la posicion 'position'
+	def time_of_day(self, position):
+		return (datetime.datetime.min + self.time_at(position)).time()
+
+# Clase DayBuckets
+# Contadores por dia calendario de la simulacion y por persona. Los dias
+# se numeran desde el de inicio (0), a partir de la hora de inicio y del
+# tiempo simulado de cada ocurrencia
+#
+# @attrs
+#    start_date: fecha de inicio (datetime.date), None si no fue dada
+#    start: segundos desde la medianoche hasta el inicio
+#    days: dict dia -> dict contador -> dict persona -> cantidad
+#    totals: dict (contador, persona) -> cantidad en toda la simulacion
+#    times: dict (contador, persona) -> segundos de cada ocurrencia, en
+#           orden, para ventanas moviles (rolling) y para sumarlas en otros
+#           DayBuckets (ver situationTotals)
+
+class DayBuckets:
+
+	# Inicializador
+	def __init__(self, start_date=None, start=datetime.timedelta(0)):
+		self.start_date = start_date
+		self.start = int(start.total_seconds())
+		self.days = {}
+		self.totals = {}
+		self.times = {}
+
+	# Dia de la simulacion 'seconds' segundos despues del inicio
+	def day(self, seconds):
+		return (self.start + int(seconds)) // 86400
+
+	# Fecha del dia 'day', None si no hay fecha de inicio
+	def date(self, day):
+		if (self.start_date is None):
+			return None
+		return self.start_date + datetime.timedelta(days=day)
+
+	# Cuenta una ocurrencia de 'counter' de 'person' a los 'seconds' segundos.
+	# Las ocurrencias se agregan en orden de tiempo
+	def add(self, counter, person, seconds):
+		by_person = self.days.setdefault(self.day(seconds), {}).setdefault(counter, {})
+		by_person[person] = by_person.get(person, 0) + 1
+		key = (counter, person)
+		self.totals[key] = self.totals.get(key, 0) + 1
+		self.times.setdefault(key, []).append(seconds)
+
+	# Ocurrencias de 'counter' de 'person' en el dia 'day'
+	def count(self, day, counter, person):
+		return self.days.get(day, {}).get(counter, {}).get(person, 0)
+
+	# Ocurrencias de 'counter' de 'person' en toda la simulacion
+	def total(self, counter, person):
+		return self.totals.get((counter, person), 0)
+
+	# Ocurrencias de 'counter' de 'person' en las 'window' segundos que
+	# terminan a los 'seconds' segundos
+	def rolling(self, counter, person, seconds, window=86400):
+		times = self.times.get((counter, person), [])
+		return bisect.bisect_right(times, seconds) - bisect.bisect_right(times, seconds - window)
+
+	# Maximo de ocurrencias de 'counter' de 'person' en 'window' segundos
+	def maxRolling(self, counter, person, window=86400):
+		times = self.times.get((counter, person), [])
+		best = 0
+		i = 0
+		for j in range(len(times)):
+			while (times[j] - times[i] >= window):
+				i += 1
+			best = max(best, j - i + 1)
+		return best
+
+# Clase Occupancy
+# Lleva, a medida que se consumen los move-person-zone, quienes ocupan
+# cada zona, para atribuir acciones a una persona sin revisar el script
+#
+# @attrs
+#    occupants: dict zona -> lista de ocupantes, en orden de entrada
+#    location: dict persona -> zona actual
+#    first_entrant: dict zona -> primera persona en entrar
+#    last_entrant: dict zona -> ultima persona en entrar
+
+class Occupancy:
+
+	# Inicializador
+	def __init__(self):
+		self.occupants = {}
+		self.location = {}
+		self.first_entrant = {}
+		self.last_entrant = {}
+
+	# Registra el movimiento de la persona 'person' a la zona 'zone'
+	def move(self, person, zone):
+		previous = self.location.get(person)
+		if (previous is not None):
+			self.occupants[previous].remove(person)
+		self.occupants.setdefault(zone, []).append(person)
+		self.location[person] = zone
+		self.first_entrant.setdefault(zone, person)
+		self.last_entrant[zone] = person
+
+	# Retorna la persona a la cual atribuir una accion en la zona 'zone':
+	# el ultimo en entrar que sigue ahi o, si esta vacia, el ultimo que
+	# estuvo. None si nadie ha entrado
+	def attribute(self, zone):
+		present = self.occupants.get(zone)
+		if (present):
+			return present[-1]
+		return self.last_entrant.get(zone)
+
+# Tipos de evento del almacen de eventos
+EVENT_PLAIN = 0
+EVENT_MOVE = 1
+EVENT_VAR = 2
+EVENT_TIME = 3
+EVENT_PROPERTY = 4
+
+# Clase EventStore
+# Almacen columnar de los eventos de un script: un arreglo tipado por
+# atributo en vez de un objeto por evento. Las personas, devices y zonas
+# se guardan como indices a 'refs', y los textos repetidos (etiquetas,
+# unidades, pares propiedad/valor) como indices a 'symbols'. Los objetos
+# evento (con __slots__) se arman a pedido con view/views
+#
+# @attrs
+#    position: posicion de cada evento
+#    kind: tipo de cada evento (EVENT_*)
+#    executer: indice en refs de quien ejecuta, -1 si nadie
+#    device: indice en refs del device, -1 si no aplica
+#    zone: indice en refs de la zona, -1 si no aplica
+#    value: valor decodificado (decodeValue), NaN si no aplica
+#    seconds: segundos de los delays, 0 para el resto
+#    symbol: indice en symbols de la etiqueta, unidad o cambio
+#    refs: personas, devices y zonas referenciadas
+#    symbols: textos, tuplas y dicts de cambios compartidos
+
+class EventStore:
+
+	# Inicializador
+	def __init__(self):
+		self.refs = []
+		self.refIds = {}
+		self.symbols = []
+		self.symbolIds = {}
+		self.clear()
+
+	# Vacia el almacen, conservando las tablas de refs y symbols
+	def clear(self):
+		self.position = array.array('q')
+		self.kind = array.array('b')
+		self.executer = array.array('i')
+		self.device = array.array('i')
+		self.zone = array.array('i')
+		self.value = array.array('d')
+		self.seconds = array.array('q')
+		self.symbol = array.array('i')
+
+	def __len__(self):
+		return len(self.position)
+
+	# Indice en refs de 'obj', -1 para None
+	def ref(self, obj):
+		if (obj is None):
+			return -1
+		index = self.refIds.get(id(obj))
+		if (index is None):
+			index = len(self.refs)
+			self.refIds[id(obj)] = index
+			self.refs.append(obj)
+		return index
+
+	# Indice en symbols de 'key'. 'make' arma el valor a guardar la
+	# primera vez, por defecto la clave misma
+	def intern(self, key, make=None):
+		index = self.symbolIds.get(key)
+		if (index is None):
+			index = len(self.symbols)
+			self.symbolIds[key] = index
+			self.symbols.append(key if make is None else make())
+		return index
+
+	# Aniade un evento al final del almacen
+	def append(self, e):
+		device = -1
+		zone = -1
+		value = math.nan
+		seconds = 0
+		if (isinstance(e, PropertyChangingEvent)):
+			kind = EVENT_PROPERTY
+			device = self.ref(e.device)
+			value = e.number
+			change = e.changedProperty
+			symbol = self.intern((change['property'], change['value']), lambda: change)
+		elif (isinstance(e, TimeEvent)):
+			kind = EVENT_TIME
+			seconds = e.seconds
+			symbol = self.intern((e.event, e.unit))
+		elif (isinstance(e, VarChangingEvent)):
+			kind = EVENT_VAR
+			zone = self.ref(e.change['zone'])
+			value = e.number
+			symbol = self.intern((e.event, e.change['variable'], e.change['value']))
+		elif (isinstance(e, MoveEvent)):
+			kind = EVENT_MOVE
+			zone = self.ref(e.zone)
+			symbol = self.intern(e.event)
+		else:
+			kind = EVENT_PLAIN
+			symbol = self.intern(e.event)
+		self.position.append(e.position)
+		self.kind.append(kind)
+		self.executer.append(self.ref(e.executer))
+		self.device.append(device)
+		self.zone.append(zone)
+		self.value.append(value)
+		self.seconds.append(seconds)
+		self.symbol.append(symbol)
+
+	# Cambia quien ejecuta el evento de indice 'i'
+	def setExecuter(self, i, person):
+		self.executer[i] = self.ref(person)
+
+	# Conserva solo los eventos de tipo 'kind'
+	def retain(self, kind):
+		keep = [i for i in range(len(self)) if self.kind[i] == kind]
+		columns = (self.position, self.kind, self.executer, self.device, self.zone, \
+			self.value, self.seconds, self.symbol)
+		self.clear()
+		for old, new in zip(columns, (self.position, self.kind, self.executer, self.device, \
+			self.zone, self.value, self.seconds, self.symbol)):
+			new.extend([old[i] for i in keep])
+
+	# Arma el objeto evento de indice 'i'
+	def view(self, i):
+		kind = self.kind[i]
+		executer = self.executer[i]
+		executer = self.refs[executer] if executer >= 0 else None
+		position = self.position[i]
+		symbol = self.symbols[self.symbol[i]]
+		if (kind == EVENT_PROPERTY):
+			return PropertyChangingEvent(executer, position, self.refs[self.device[i]], \
+				symbol, self.value[i])
+		elif (kind == EVENT_TIME):
+			return TimeEvent(executer, position, symbol[1], \
+				datetime.timedelta(seconds=self.seconds[i]), symbol[0])
+		elif (kind == EVENT_VAR):
+			return VarChangingEvent(executer, position, symbol[0], {'variable': symbol[1], \
+				'value': symbol[2], 'zone': self.refs[self.zone[i]]}, self.value[i])
+		elif (kind == EVENT_MOVE):
+			return MoveEvent(executer, position, symbol, self.refs[self.zone[i]])
+		return Event(executer, position, symbol)
+
+	# Lista con los objetos evento de indices [start, end), en orden
+	def views(self, start=0, end=None):
+		if (end is None):
+			end = len(self)
+		return [self.view(i) for i in range(start, end)]
+
+	# Indica si el evento de indice 'i' es un delay de cero segundos, que
+	# marca el fin de una situacion
+	def closes(self, i):
+		return self.kind[i] == EVENT_TIME and self.seconds[i] == 0 and \
+			self.symbols[self.symbol[i]][1] == 's'
+
+	# Timeline de todo el almacen, leido de las columnas sin armar eventos
+	def timeline(self, start):
+		clock = Timeline([], start)
+		total = 0
+		for i in range(len(self)):
+			if (self.kind[i] == EVENT_TIME):
+				total += self.seconds[i]
+				clock.positions.append(self.position[i])
+				clock.cumulative.append(total)
+		return clock
 
 #################################
-# Codigo                        #
+# Perfilado                     #
 #################################
 
-# Funcion principal
-def main(argv):
-	# Si pasaron menos de tres argumentos
-	if (len(argv) < 3):
-		print('Usage: analyzer.py input_file.bhv main_door_room')
-		sys.exit(1)
-	# Si pasaron mas de tres argumentos
-	elif (len(argv) > 3):
-		print('Usage: analyzer.py input_file.bhv main_door_room')
-		sys.exit(2)
-	# Pasaron los tres argumentos necesarios
-	else:
-		# Genero ElementTree a partir del archivo
-		simulacion = ET.parse(argv[1])
-		behavior = simulacion.getroot()
-		main_door_room = argv[2]
+# Clase Profiler
+# Acumula, por fase del analizador, tiempo de reloj, cantidad de llamadas
+# y memoria pico (tracemalloc). Las fases pueden anidarse; la memoria pico
+# solo se mide en las de primer nivel
+#
+# @attrs
+#    phases: dict fase -> [segundos, llamadas, pico en bytes o None]
+#    stack: fases abiertas, con su instante de inicio
+#    memory: si se mide la memoria con tracemalloc
+
+class Profiler:
+
+	# Inicializador
+	def __init__(self, memory=True):
+		self.phases = {}
+		self.stack = []
+		self.memory = memory
+
+	# Abre la fase 'name'
+	def start(self, name):
+		if (self.memory and not self.stack):
+			if (not tracemalloc.is_tracing()):
+				tracemalloc.start()
+			# reset_peak no existe antes de python 3.9, el pico queda acumulado
+			if (hasattr(tracemalloc, 'reset_peak')):
+				tracemalloc.reset_peak()
+		# Las fases se listan en orden de inicio
+		self.phases.setdefault(name, [0.0, 0, None])
+		self.stack.append((name, time.perf_counter()))
+
+	# Cierra la fase 'name', que debe ser la ultima abierta
+	def stop(self, name):
+		opened, started = self.stack.pop()
+		assert opened == name, 'phase %s closed while %s is open' % (name, opened)
+		entry = self.phases[name]
+		entry[0] += time.perf_counter() - started
+		entry[1] += 1
+		if (self.memory and not self.stack):
+			peak = tracemalloc.get_traced_memory()[1]
+			entry[2] = peak if entry[2] is None else max(entry[2], peak)
+
+	# Deja de medir memoria
+	def close(self):
+		if (self.memory and tracemalloc.is_tracing()):
+			tracemalloc.stop()
+
+	# Imprime la tabla de fases en 'stream'
+	def report(self, stream):
+		stream.write('%-32s %10s %10s %12s\n' % ('phase', 'seconds', 'calls', 'peak MB'))
+		for name in self.phases:
+			seconds, calls, peak = self.phases[name]
+			peak = '-' if peak is None else '%.2f' % (peak / 1e6)
+			stream.write('%-32s %10.4f %10d %12s\n' % (name, seconds, calls, peak))
+
+# Perfilador activo, None si no se esta perfilando
+PROFILER = None
+
+# Procedimientos phaseStart/phaseStop
+# Marcan el inicio y fin de una fase en el perfilador activo, si lo hay
+# @args
+#    name: nombre de la fase
+
+def phaseStart(name):
+	if (PROFILER is not None):
+		PROFILER.start(name)
+
+def phaseStop(name):
+	if (PROFILER is not None):
+		PROFILER.stop(name)
+
+# Fase de ingesta a la que pertenece cada accion; el resto son eventos
+INGEST_PHASES = {
+	'create-zone': 'ingest: zones',
+	'add-zone-variable': 'ingest: zones',
+	'create-device': 'ingest: devices',
+	'move-device-zone': 'ingest: devices',
+	'create-person': 'ingest: people',
+	'delay': 'ingest: delays',
+}
+
+#################################
+# Ingesta                       #
+#################################
+
+# Clase Ingestor
+# Consume las acciones de un script una a una, en orden, numerandolas
+# y alimentando la construccion de zonas, devices, personas y eventos
+# en una sola pasada, sin conservar el arbol xml
+#
+# @attrs
+#    date_sim: fecha de inicio de la simulacion (None si no fue dada)
+#    time_sim: hora de inicio de la simulacion
+#    position: posicion (orden) de la proxima accion
+#    zclass: lista de instancias de zonas
+#    dclass: lista de instancias de devices
+#    pclass: lista de instancias de personas
+#    zones: registro nombre -> zona
+#    devices: registro id -> device
+#    persons: registro id -> persona
+#    events: EventStore con los eventos, ordenados por posicion
+#    elapsed: segundos simulados de los delays ya consumidos
+#    history: si se guarda el historial completo de cada entidad. Sin el,
+#             solo se guardan la primera y la ultima zona de devices y
+#             personas, que es lo que usan las reglas
+#    exterior_doors: puertas exteriores dadas por el script (atributo
+#                    exteriorDoors de la raiz, ver parseDoors), o None
+
+class Ingestor:
 
+	# Inicializador
+	def __init__(self, history=True):
+		self.history = history
+		self.date_sim = None
+		self.time_sim = None
+		# Segundos simulados de los delays ya consumidos
+		self.elapsed = 0
+		self.exterior_doors = None
+		self.position = 0
+		self.zclass = []
+		self.dclass = []
+		self.pclass = []
+		self.zones = {}
+		self.devices = {}
+		self.persons = {}
+		self.events = EventStore()
+		# Tag y persona de las dos ultimas acciones consumidas
+		self.prev = (None, None)
+		self.prev2 = (None, None)
+		# Ocupantes de cada zona
+		self.occupancy = Occupancy()
+		# Indices en events de los set-device-property sin ocupante, se
+		# resuelven al terminar
+		self.pending = []
+
+	# Lee los atributos de la raiz (behavior) del script
+	def start(self, attrib):
 		try:
 			# Si hay fecha/hora
-			starttime = behavior.attrib['startdate']
-			# Obtengo fecha
-			date_sim = starttime.split('-')[0]
-			# Obtengo hora
-			time_sim = starttime.split('-')[1]
-			hrs = int(time_sim.split(':')[0])
-			mins = int(time_sim.split(':')[1])
-			secs = int(time_sim.split(':')[2])
-			time_sim = datetime.timedelta(hours=hrs, minutes=mins, seconds=secs)
+			self.date_sim, self.time_sim = parseStartDate(attrib['startdate'])
 		except:
-			print('No starting time given. Setting default: 00:00:00')
-			time_sim = datetime.timedelta(hours=0, minutes=0, seconds=0)
-
-		# Numerando acciones
-		numerador(behavior)
-
-		# Listas para almacenar objetos de cada tipo descrito
-		zones = []
-		devices = []
-		people = []
-		delay = []
-
-		# Lista de dics para zones, devices, people, eventos de tiempo,
-		# situaciones y errores
-		zlist = []
-		dlist = []
-		plist = []
-		tlist = []
-		slist = []
-		elist = []
+			self.time_sim = None
+		self.exterior_doors = attrib.get('exteriorDoors') or None
 
-		# Listas de instancias de clases para personas, devices, zonas, eventos
-		# y situaciones
-		pclass = []
-		dclass = []
-		zclass = []
-		eclass = []
-		sclass = []
-
-		# Lista de tiempo total para una simulacion
-		total_time = []
-
-		# Veces que se fue al banio en toda la sim
-		bathroom_times = []
-
-		# Veces que sali
-		times_out = []
-
-		# Veces que abri el closet
-		times_wd_opened = []
-
-		# Lleno listas de todas las zones, devices, people y delays
-		for child in behavior:
-			if (child.tag == 'create-zone'):
-				zones.append(child)
-			elif (child.tag == 'create-device'):
-				devices.append(child)
-			elif (child.tag == 'create-person'):
-				people.append(child)
-			elif (child.tag == 'delay'):
-				delay.append(child)
-
-		# Obtengo variables asociadas a cada zona
-		if (zones):
-			for zone in zones:
-				zdic = {}
-				zdic['zone'] = zone.attrib['id'].lower().replace(' ','')
-				zdic['orden'] = zone.attrib['orden']
-				for child in behavior:
-					if (child.tag == 'add-zone-variable' and \
-						child.attrib['zoneId'].lower().replace(' ','') == zdic['zone']):
-						# Si el dic ya fue creado, actualizo
-						if ('vars' in zdic):
-							tmp = zdic['vars']
-							tmp.update({child.attrib['variable']: None})
-							zdic['vars'] = tmp
-						# Creo el dic en otro caso
-						else:
-							zdic['vars'] = {child.attrib['variable']: None}
-				# Lleno lista de dics
-				zlist.append(zdic)
-
-			# Coloco valores a las variables, reviso si las hay
-			if (varsInList('vars', zlist)):
-				for z in zlist:
-					for child in behavior:
-						if (child.tag == 'modify-zone-variable' and \
-							child.attrib['zoneId'].lower().replace(' ','') == z['zone']):
-							tmp = z['vars']
-							tmp[child.attrib['variable']] = child.attrib['value']
-							z['vars'] = tmp
-
-		# TENGO TODO DE LAS ZONAS
-
-		if (devices):
-			# Obtengo devices y sus zonas
-			for device in devices:
-				ddic = {}
-				ddic['device'] = device.attrib['id']
-				ddic['type'] = device.attrib['type']
-				ddic['orden'] = device.attrib['orden']
-				for child in behavior:
-					if (child.tag == 'move-device-zone' and child.attrib['deviceId'] == device.attrib['id']):
-						# Si existe el key zone, aniado el dic a la lista
-						if ('zone' in ddic):
-							tmp = ddic['zone']
-							tmp.append({'orden': child.attrib['orden'], \
-								'zone': child.attrib['zoneId'].lower().replace(' ','')})
-							ddic['zone'] = tmp
-						# Creo la nueva lista
-						else:
-							ddic['zone'] = [{'orden': child.attrib['orden'], \
-							'zone': child.attrib['zoneId'].lower().replace(' ','')}]
-				dlist.append(ddic)
-
-		# Tengo devices con id, type y zona donde esta
-
-		# PENDIENTE: Con remove habria que sacar el device de la lista
-
-			for d in dlist:
-				for child in behavior:
-					if ('deviceId' in child.attrib and child.attrib['deviceId'] == d['device']):
-						if (child.tag != 'move-device-zone'):
-							# Si existe el key events, aniado el dic a la lista
-							if ('events' in d):
-								tmp = d['events']
-								# Si se aniade una propiedad, hago dic especial
-								if (child.tag == 'set-device-property'):
-									tmp.append({'orden': child.attrib['orden'], 'event': child.tag,
-												'property': child.attrib['property'], 'value': child.attrib['value']})
-								# Creo dic normal en otro caso
-								else:
-									tmp.append({'orden': child.attrib['orden'], 'event': child.tag})
-								d['events'] = tmp
-							# Creo lista de eventos
-							else:
-								# Si se aniade una propiedad, hago dic especial
-								if (child.tag == 'set-device-property'):
-									d['events'] = [{'orden': child.attrib['orden'], 'event': child.tag,
-													'property': child.attrib['property'], 'value': child.attrib['value']}]
-								# Creo dic normal en otro caso
-								else:
-									d['events'] = [{'orden': child.attrib['orden'], 'event': child.tag}]
-
-		# TENGO DEVICES CON TODOS LOS EVENTOS OCURRIDOS CON ELLOS, ADEMAS DE ZONAS, ORDEN, TIPOS E ID
-
-		if (people):
-			# Obtengo personas
-			for person in people:
-				pdic = {}
-				pdic['name'] = person.attrib['id']
-				pdic['type'] = person.attrib['type']
-				# Obtengo las zonas de cada uno
-				for child in behavior:
-					if (child.tag == 'move-person-zone' and child.attrib['personId'] == person.attrib['id']):
-						# Si existe el key zone, aniadimos la zona nueva al dic
-						if ('zone' in pdic):
-							tmp = pdic['zone']
-							tmp.append({'orden': child.attrib['orden'], \
-								'zone': child.attrib['zoneId'].lower().replace(' ','')})
-							pdic['zone'] = tmp
-						# Creo dic de zonas en otro caso
-						else:
-							pdic['zone'] = [{'orden': child.attrib['orden'], \
-							'zone': child.attrib['zoneId'].lower().replace(' ','')}]
-				plist.append(pdic)
-
-		# TENGO A LAS PERSONAS Y SUS ZONAS CORRESPONDIENTES
-
-		# Obtengo estructuras de tiempo
-		if (delay):
-			for d in delay:
-				tdict = {}
-				tdict['expr'] = d.tag
-				tdict['orden'] = d.attrib['orden']
-				tdict['value'] = d.attrib['value']
-				tdict['unit'] = d.attrib['unit']
-				tlist.append(tdict)
-
-		# TENGO TODOS LOS DELAY DESGLOSADOS, ES UN EVENT
-
-		if (zlist):
-			# Generando instancias de clases para zonas
-			for elem in zlist:
-				zclass.append(Zone(elem['orden'], elem['zone'], elem['vars']))
-
-			# Actualizando zonas en dict de devices
-			update_dict_zones(dlist, zclass)
-
-			# Actualizando zonas en dict de people
-			update_dict_zones(plist, zclass)
-
-		if (dlist):
-			# Generando instancias de clases para dispositivos
-			for elem in dlist:
-				try:
-					dclass.append(Device(elem['orden'], elem['device'], elem['type'], elem['events'], elem['zone']))
-				except:
-					dclass.append(Device(elem['orden'], elem['device'], elem['type'], [], elem['zone']))
-
-		if (plist):
-			# Generando instancias de clases para personas
-			for elem in plist:
-				pclass.append(Person(elem['name'], elem['type'], elem['zone'], AGGIR_CONST))
-
-		# Generando instancias de eventos
+	# Retorna la zona de nombre 'name'
+	def zone(self, name):
+		return self.zones[name]
 
-		# CASO 1: move-device-zone
+	# Retorna el device de id 'name'
+	def device(self, name):
+		return self.devices[name]
 
-		# No hay personas generadas
-		if (len(people) == 0):
-			pass
+	# Retorna la persona de id 'name'
+	def person(self, name):
+		return self.persons[name]
+
+	# Aniade 'entry' a la lista de zonas 'entries' de una entidad
+	def locate(self, entries, entry):
+		if (self.history or len(entries) < 2):
+			entries.append(entry)
 		else:
-			for child in behavior:
-				if (child.tag == 'move-device-zone'):
-					tmp = [c for c in behavior if c.attrib['orden'] < child.attrib['orden']]
-					if (tmp):
-						# Caso setup
-						if (tmp[len(tmp) - 1].tag == 'create-device'):
-							pass
-						# Caso movimiento de persona previo
-						elif (tmp[len(tmp) - 1].tag == 'move-person-zone'):
-							executer = [p for p in pclass if p.name == tmp[len(tmp) - 1].attrib['personId']][0]
-							eclass.append(Event(executer, child.attrib['orden'], child.tag))
+			entries[-1] = entry
+
+	# Consume la siguiente accion del script. 'seconds' es la duracion ya
+	# calculada de un delay, si se tiene
+	def feed(self, tag, attrib, seconds=None):
+		orden = self.position
+
+		# Entidades
+		if (tag == 'create-zone'):
+			zone = Zone(orden, normalizeZone(attrib['id']), {}, [])
+			self.zclass.append(zone)
+			self.zones.setdefault(zone.name, zone)
+		elif (tag == 'add-zone-variable' or tag == 'modify-zone-variable'):
+			zone = self.zones.get(normalizeZone(attrib['zoneId']))
+			if (zone is not None):
+				if (tag == 'add-zone-variable'):
+					zone.variables.setdefault(attrib['variable'], None)
+					if (self.history):
+						zone.related_events.append({'orden': orden, 'event': tag,
+							'variable': attrib['variable']})
+				else:
+					zone.variables[attrib['variable']] = attrib['value']
+					series = zone.series.get(attrib['variable'])
+					if (series is None):
+						series = zone.series[attrib['variable']] = VariableSeries()
+					series.append(orden, self.elapsed, decodeValue(attrib['value']))
+					if (self.history):
+						zone.related_events.append({'orden': orden, 'event': tag,
+							'variable': attrib['variable'], 'value': attrib['value']})
+		elif (tag == 'create-device'):
+			device = Device(orden, attrib['id'], attrib['type'], [], [])
+			self.dclass.append(device)
+			self.devices.setdefault(device.name, device)
+		elif (tag == 'create-person'):
+			# Cada persona con su propia copia de las variables AGGIR
+			person = Person(attrib['id'], attrib['type'], [], dict(AGGIR_CONST))
+			self.pclass.append(person)
+			self.persons.setdefault(person.name, person)
+		elif (tag == 'move-device-zone'):
+			name = normalizeZone(attrib['zoneId'])
+			device = self.devices.get(attrib['deviceId'])
+			if (device is not None):
+				self.locate(device.zones, {'orden': orden, 'zone': self.zones.get(name, name)})
+		elif (tag == 'move-person-zone'):
+			name = normalizeZone(attrib['zoneId'])
+			person = self.persons.get(attrib['personId'])
+			if (person is not None):
+				self.locate(person.zones, {'orden': orden, 'zone': self.zones.get(name, name)})
+		if (self.history and 'deviceId' in attrib and tag != 'move-device-zone'):
+			# Eventos relacionados a cada device
+			device = self.devices.get(attrib['deviceId'])
+			if (device is not None):
+				# Si se aniade una propiedad, hago dic especial
+				if (tag == 'set-device-property'):
+					device.related_events.append({'orden': orden, 'event': tag,
+						'property': attrib['property'], 'value': attrib['value']})
+				else:
+					device.related_events.append({'orden': orden, 'event': tag})
 
-		# CASO 2: modify-zone-variable
+		# Eventos
+		self.generateEvent(orden, tag, attrib, seconds)
 
-		if (len(people) == 0):
-			pass
-		else:
-			for child in behavior:
-				if (child.tag == 'modify-zone-variable'):
-					tmp = [c for c in behavior if c.attrib['orden'] < child.attrib['orden']]
-					if (tmp):
-						# Caso setup
-						if (tmp[len(tmp) - 1].tag == 'add-zone-variable'):
-							pass
-						# Casos de cambio por movimiento de persona
-						elif (tmp[len(tmp) - 1].tag == 'move-person-zone'):
-							executer = [p for p in pclass if p.name == tmp[len(tmp) - 1].attrib['personId']][0]
-							zone = [z for z in zclass if \
-									z.name == child.attrib['zoneId'].lower().replace(' ','')][0]
-							dictionary = {'variable': child.attrib['variable'], 'value': child.attrib['value'], \
-											'zone': zone}
-							eclass.append(VarChangingEvent(executer, child.attrib['orden'], child.tag, \
-								dictionary))
-						elif (tmp[len(tmp) - 1].tag == 'move-device-zone' \
-							and tmp[len(tmp) - 2].tag == 'move-person-zone'):
-							executer = [p for p in pclass if p.name == tmp[len(tmp) - 2].attrib['personId']][0]
-							zone = [z for z in zclass if \
-									z.name == child.attrib['zoneId'].lower().replace(' ','')][0]
-							dictionary = {'variable': child.attrib['variable'], 'value': child.attrib['value'], \
-											'zone': zone}
-							eclass.append(VarChangingEvent(executer, child.attrib['orden'], child.tag, \
-								dictionary))
-						# Casos de modificaciones por executer mas cercano en script
-						else:
-							last_move = [x for x in behavior if x.attrib['orden'] < child.attrib['orden'] and \
-											x.tag == 'move-person-zone' and \
-											x.attrib['zoneId'] == child.attrib['zoneId'].lower().replace(' ','')]
-							if (last_move):
-								zone = [z for z in zclass if \
-										z.name == child.attrib['zoneId'].lower().replace(' ','')][0]
-								dictionary = {'variable': child.attrib['variable'], 'value': child.attrib['value'], \
-												'zone': zone}
-								# Ultima persona que se movio a la zona
-								executer = last_move[len(last_move) - 1].attrib['personId']
-								executer = [p for p in pclass if p.name == executer][0]
-								eclass.append(VarChangingEvent(executer, child.attrib['orden'], child.tag, \
-									dictionary))
+		if (tag == 'move-person-zone'):
+			name = normalizeZone(attrib['zoneId'])
+			self.occupancy.move(attrib['personId'], name)
 
-		# CASO 3: set-device-property
+		self.prev2 = self.prev
+		self.prev = (tag, attrib.get('personId'))
+		self.position += 1
 
-		if (len(people) == 0):
-			pass
-		else:
-			for child in behavior:
-				if (child.tag == 'set-device-property'):
-					tmp = [x for x in behavior if x.attrib['orden'] < child.attrib['orden']]
-					if (tmp):
-						# caso setup inicial 1
-						if (tmp[len(tmp) - 1].tag == 'create-device'):
-							pass
-						elif (tmp[len(tmp) - 2].tag == 'create-device' and \
-							tmp[len(tmp) - 1].tag == 'move-device-zone'):
-							pass
-						# variaciones en simulacion
-						else:
-							device = [x for x in dclass if x.name == child.attrib['deviceId']][0]
-							changedAttr = child.attrib['property']
-							changedValue = child.attrib['value']
-							changes = {'property': changedAttr, 'value': changedValue}
-							# Si hay solo un user
-							if (len(people) == 1):
-								executer = pclass[0]
-								# Creo instancias
-								eclass.append(PropertyChangingEvent(executer, child.attrib['orden'], \
-									device, changes))
-							else:
-								# Buscamos zona del device, los mismo no suelen ser movibles
-								num_zones_dev = len(device.zones)
-								if (num_zones_dev == 1):
-									zone = device.zones[0]['zone']
-									# Llamo a la funcion adecuada
-									changePropertyEventGenerator(behavior, child, zone, device, changes, eclass)
-								else:
-									# Busco la zona en device cuyo orden sea el mas cercano al orden
-									# del set-device-property actual
-									nearest_zone = [x['zone'] for x in device.zones if \
-																x['orden'] < child.attrib['orden']][-1]
-									# Llamo a la funcion adecuada
-									changePropertyEventGenerator(behavior, child, nearest_zone, device, changes, eclass)
+	# Genera, si corresponde, el evento asociado a una accion
+	def generateEvent(self, orden, tag, attrib, seconds=None):
+		prev_tag, prev_person = self.prev
+		prev2_tag, prev2_person = self.prev2
+
+		# CASO 1: move-device-zone
+		if (tag == 'move-device-zone'):
+			# Caso movimiento de persona previo, se ignora el setup
+			if (prev_tag == 'move-person-zone'):
+				self.events.append(Event(self.person(prev_person), orden, tag))
+
+		# CASO 2: modify-zone-variable
+		elif (tag == 'modify-zone-variable'):
+			zone_name = normalizeZone(attrib['zoneId'])
+			# Caso setup
+			if (prev_tag == 'add-zone-variable'):
+				return
+			# Casos de cambio por movimiento de persona
+			elif (prev_tag == 'move-person-zone'):
+				executer = self.person(prev_person)
+			elif (prev_tag == 'move-device-zone' and prev2_tag == 'move-person-zone'):
+				executer = self.person(prev2_person)
+			# Casos de modificaciones por quien ocupa la zona
+			elif (self.occupancy.attribute(zone_name) is not None):
+				executer = self.person(self.occupancy.attribute(zone_name))
+			else:
+				return
+			dictionary = {'variable': attrib['variable'], 'value': attrib['value'], \
+							'zone': self.zone(zone_name)}
+			self.events.append(VarChangingEvent(executer, orden, tag, dictionary))
+
+		# CASO 3: set-device-property
+		elif (tag == 'set-device-property'):
+			# Casos de setup inicial
+			if (prev_tag is None or prev_tag == 'create-device'):
+				return
+			elif (prev2_tag == 'create-device' and prev_tag == 'move-device-zone'):
+				return
+			device = self.device(attrib['deviceId'])
+			changes = {'property': attrib['property'], 'value': attrib['value']}
+			event = PropertyChangingEvent(None, orden, device, changes)
+			# Quien ocupa la zona actual del device
+			occupant = None
+			if (device.zones):
+				zone = device.zones[-1]['zone']
+				zone_name = zone.name if isinstance(zone, Zone) else zone
+				occupant = self.occupancy.attribute(zone_name)
+			if (occupant is not None):
+				event.executer = self.person(occupant)
+			else:
+				# Se resuelve al terminar si hay un unico habitante
+				self.pending.append(len(self.events))
+			self.events.append(event)
 
 		# CASO 4: fault device
+		elif (tag == 'fault-device'):
+			device = self.devices.get(attrib['deviceId'])
+			# No hay movimiento a zona del device previo al fault del mismo
+			if (device is None or not device.zones or \
+				not isinstance(device.zones[0]['zone'], Zone)):
+				return
+			# Primera ubicacion del device
+			place = device.zones[0]['zone']
+			# Persona que interactuo con la ubicacion del device
+			if (place.name in self.occupancy.first_entrant):
+				executer = self.person(self.occupancy.first_entrant[place.name])
+				self.events.append(Event(executer, orden, tag))
+			else:
+				# Fault natural
+				self.events.append(Event(None, orden, tag))
 
-		if (len(people) == 0):
-			pass
+		# CASO 5: move-person-zone
+		elif (tag == 'move-person-zone'):
+			executer = self.person(attrib['personId'])
+			zone = self.zone(normalizeZone(attrib['zoneId']))
+			self.events.append(MoveEvent(executer, orden, tag, zone))
+
+		# CASO x: delay
+		elif (tag == 'delay'):
+			if (seconds is None):
+				value = delayValue(attrib['value'], attrib['unit'])
+			else:
+				value = datetime.timedelta(seconds=seconds)
+			delay = TimeEvent(None, orden, attrib['unit'], value, tag)
+			self.elapsed += delay.seconds
+			self.events.append(delay)
+
+	# Cierra la ingesta resolviendo lo que depende del script completo
+	def finish(self):
+		events = self.events
+		# Executer de los set-device-property
+		if (len(self.pclass) == 1):
+			for i in self.pending:
+				events.setExecuter(i, self.pclass[0])
+		self.pending = []
+		# No hay personas generadas, solo quedan los delays
+		if (len(self.pclass) == 0):
+			events.retain(EVENT_TIME)
+		# Los delays se asocian con el executer del primer evento del script
+		if (len(events)):
+			first = events.executer[0]
+			for i in range(1, len(events)):
+				if (events.kind[i] == EVENT_TIME):
+					events.executer[i] = first
+		return self
+
+# Procedimiento feedAction
+# Pasa una accion al ingestor, midiendo su fase si se esta perfilando
+# @args
+#    ingestor: Ingestor del script
+#    tag: etiqueta de la accion
+#    attrib: atributos de la accion
+#    seconds: duracion ya calculada de un delay, o None
+
+def feedAction(ingestor, tag, attrib, seconds=None):
+	if (PROFILER is not None):
+		name = INGEST_PHASES.get(tag, 'ingest: events')
+		PROFILER.start(name)
+		ingestor.feed(tag, attrib, seconds)
+		PROFILER.stop(name)
+	else:
+		ingestor.feed(tag, attrib, seconds)
+
+# Funcion ingestScript
+# Lee un script de simulacion de forma incremental con iterparse,
+# liberando cada accion una vez consumida. Los scripts compilados
+# (compileScript) se leen directamente, sin parsear xml
+# @args
+#    source: ruta o archivo del script .bhv o compilado
+# @returns
+#    Ingestor con zonas, devices, personas y eventos del script
+
+def ingestScript(source):
+	phaseStart('ingest')
+	ingestor = Ingestor()
+	compiled = openCompiled(source)
+	if (compiled is not None):
+		try:
+			ingestor.start(compiled.root())
+			for position, tag, attrib, seconds in compiled.actions():
+				ingestor.position = position
+				feedAction(ingestor, tag, attrib, seconds)
+		finally:
+			compiled.close()
+	else:
+		depth = 0
+		root = None
+		for event, elem in ET.iterparse(source, events=('start', 'end')):
+			if (event == 'start'):
+				depth += 1
+				if (depth == 1):
+					root = elem
+					ingestor.start(elem.attrib)
+			else:
+				depth -= 1
+				if (depth == 1):
+					feedAction(ingestor, elem.tag, elem.attrib)
+					# Liberamos la accion ya consumida
+					elem.clear()
+					root.clear()
+	phaseStart('ingest: finish')
+	ingestor.finish()
+	phaseStop('ingest: finish')
+	phaseStop('ingest')
+	return ingestor
+
+#################################
+# Scripts compilados            #
+#################################
+
+# Formato binario de un script compilado (little endian):
+#   cabecera: COMPILED_HEADER
+#   tabla de simbolos: por simbolo, largo (u32) y texto utf-8
+#   atributos de la raiz: pares (nombre, valor) de indices de simbolos
+#   acciones: registros de ancho fijo COMPILED_ACTION
+#   atributos: pares (nombre, valor) de ancho fijo COMPILED_ATTR
+COMPILED_MAGIC = b'ICSB'
+COMPILED_VERSION = 1
+# magic, version, simbolos, atributos de la raiz, acciones, atributos,
+# inicio de la tabla de simbolos, de la raiz, de las acciones y de los atributos
+COMPILED_HEADER = struct.Struct('<4sHxxIIIIQQQQ')
+# etiqueta, posicion, primer atributo, cantidad de atributos, segundos del delay
+COMPILED_ACTION = struct.Struct('<IIIIq')
+COMPILED_ATTR = struct.Struct('<II')
+
+# Procedimiento compileScript
+# Convierte un script .bhv al formato binario compilado, en una pasada
+# @args
+#    source: ruta o archivo del script .bhv
+#    target: ruta del archivo compilado
+
+def compileScript(source, target):
+	symbols = []
+	symbol_ids = {}
+
+	def intern(text):
+		index = symbol_ids.get(text)
+		if (index is None):
+			index = len(symbols)
+			symbol_ids[text] = index
+			symbols.append(text)
+		return index
+
+	root_attrs = []
+	actions = []
+	attrs = []
+	depth = 0
+	root = None
+	for event, elem in ET.iterparse(source, events=('start', 'end')):
+		if (event == 'start'):
+			depth += 1
+			if (depth == 1):
+				root = elem
+				root_attrs = [(intern(k), intern(v)) for k, v in elem.attrib.items()]
 		else:
-			for child in behavior:
-				if (child.tag == 'fault-device'):
-					dev = child.attrib['deviceId']
-					try:
-						# Ultima ubicacion del device
-						place = [x.attrib['zoneId'].lower().replace(' ','') for x in behavior if \
-						x.attrib['orden'] < child.attrib['orden'] and x.tag == 'move-device-zone' \
-						and x.attrib['deviceId'] == dev][0]
-						place = [x for x in zclass if x.name == place][0]
-						tmp = [x for x in behavior if x.attrib['orden'] < child.attrib['orden'] \
-						and x.tag == 'move-person-zone' and \
-						x.attrib['zoneId'].lower().replace(' ','') == place.name]
-						# Si hay eventos previos a la accion
-						if (tmp):
-							# Persona que interactuo mas recientemente con ubicacion device
-							min_distance = min([x.attrib['orden'] for x in tmp])
-							closest_event = [x for x in tmp if x.attrib['orden'] == min_distance][0]
-							executer = [x for x in pclass if x.name == closest_event.attrib['personId']][0]
-							eclass.append(Event(executer, child.attrib['orden'], child.tag))
-						else:
-							# Fault natural
-							eclass.append(Event(None, child.attrib['orden'], child.tag))
-					# No hay movimiento a zona del device previo al fault del mismo
-					except:
-						pass
+			depth -= 1
+			if (depth == 1):
+				seconds = 0
+				if (elem.tag == 'delay'):
+					value = delayValue(elem.attrib['value'], elem.attrib['unit'])
+					seconds = int(value.total_seconds())
+				actions.append((intern(elem.tag), len(actions), len(attrs), len(elem.attrib), seconds))
+				for k, v in elem.attrib.items():
+					attrs.append((intern(k), intern(v)))
+				elem.clear()
+				root.clear()
+
+	table = b''.join([struct.pack('<I', len(t)) + t for t in [x.encode('utf-8') for x in symbols]])
+	symbols_at = COMPILED_HEADER.size
+	root_at = symbols_at + len(table)
+	actions_at = root_at + len(root_attrs) * COMPILED_ATTR.size
+	attrs_at = actions_at + len(actions) * COMPILED_ACTION.size
+	with open(target, 'wb') as f:
+		f.write(COMPILED_HEADER.pack(COMPILED_MAGIC, COMPILED_VERSION, len(symbols), \
+			len(root_attrs), len(actions), len(attrs), symbols_at, root_at, actions_at, attrs_at))
+		f.write(table)
+		for pair in root_attrs:
+			f.write(COMPILED_ATTR.pack(*pair))
+		for action in actions:
+			f.write(COMPILED_ACTION.pack(*action))
+		for pair in attrs:
+			f.write(COMPILED_ATTR.pack(*pair))
+
+# Clase CompiledScript
+# Lector de un script compilado sobre un buffer (un mmap del archivo),
+# sin copiarlo: los registros se leen en su lugar con struct
+#
+# @attrs
+#    buffer: memoryview del contenido
+#    handle: mmap y archivo abiertos, None si el buffer no es propio
+#    symbols: tabla de simbolos decodificada
+#    header: campos de la cabecera
 
-		# CASO 5: move-person-zone
+class CompiledScript:
 
-		if (len(people) == 0):
-			pass
+	# Inicializador
+	def __init__(self, buffer, handle=None):
+		if (isinstance(buffer, memoryview)):
+			self.buffer = buffer
 		else:
-			for child in behavior:
-				if (child.tag == 'move-person-zone'):
-					executer = [x for x in pclass if x.name == child.attrib['personId']][0]
-					zone = [x for x in zclass if x.name == child.attrib['zoneId'].lower().replace(' ','')][0]
-					eclass.append(MoveEvent(executer, child.attrib['orden'], child.tag, zone))
-
-		# CASO x: delay - DEBE IR AL FINAL
-
-		# Si hay acciones en lista de events, aniado a la lista
-		if (eclass):
-			event_generator(tlist, eclass)
-		# Si no hay eventos creados aun
+			self.buffer = memoryview(buffer)
+		self.handle = handle
+		try:
+			header = COMPILED_HEADER.unpack_from(self.buffer, 0)
+			if (header[0] != COMPILED_MAGIC):
+				raise ValueError('not a compiled iCasa script')
+			if (header[1] != COMPILED_VERSION):
+				raise ValueError('compiled script version %d, expected %d' % (header[1], COMPILED_VERSION))
+			self.header = header
+			# Tabla de simbolos
+			self.symbols = []
+			offset = header[6]
+			for i in range(header[2]):
+				size = struct.unpack_from('<I', self.buffer, offset)[0]
+				self.symbols.append(str(self.buffer[offset + 4:offset + 4 + size], 'utf-8'))
+				offset += 4 + size
+		except Exception:
+			# Cabecera invalida o truncada: se libera el mmap y el archivo
+			self.close()
+			raise
+
+	# Atributos de la raiz (behavior)
+	def root(self):
+		symbols = self.symbols
+		start = self.header[7]
+		end = start + self.header[3] * COMPILED_ATTR.size
+		return {symbols[k]: symbols[v] for k, v in COMPILED_ATTR.iter_unpack(self.buffer[start:end])}
+
+	# Generador de tuplas (posicion, etiqueta, atributos, segundos) de las
+	# acciones, en orden. 'segundos' es None salvo para los delays
+	def actions(self):
+		symbols = self.symbols
+		start = self.header[8]
+		actions = self.buffer[start:start + self.header[4] * COMPILED_ACTION.size]
+		attrs_at = self.header[9]
+		for tag, position, first, count, seconds in COMPILED_ACTION.iter_unpack(actions):
+			attrib = {}
+			offset = attrs_at + first * COMPILED_ATTR.size
+			for i in range(count):
+				k, v = COMPILED_ATTR.unpack_from(self.buffer, offset)
+				attrib[symbols[k]] = symbols[v]
+				offset += COMPILED_ATTR.size
+			tag = symbols[tag]
+			yield (position, tag, attrib, seconds if tag == 'delay' else None)
+
+	# Libera el buffer y, si es propio, el mmap y el archivo
+	def close(self):
+		self.buffer.release()
+		if (self.handle is not None):
+			mapped, f = self.handle
+			mapped.close()
+			f.close()
+			self.handle = None
+
+# Funcion openCompiled
+# Abre un script compilado, mapeandolo en memoria si es un archivo
+# @args
+#    source: ruta, BytesIO o stream binario (openScript)
+# @returns
+#    CompiledScript, o None si 'source' no es un script compilado
+
+def openCompiled(source):
+	if (isinstance(source, io.BytesIO)):
+		if (source.getvalue()[:len(COMPILED_MAGIC)] == COMPILED_MAGIC):
+			return CompiledScript(source.getbuffer())
+		return None
+	if (not isinstance(source, str)):
+		# Stream descomprimido o miembro de un archivo: se lee a memoria
+		if (hasattr(source, 'peek') and \
+			source.peek(len(COMPILED_MAGIC))[:len(COMPILED_MAGIC)] == COMPILED_MAGIC):
+			return CompiledScript(source.read())
+		return None
+	f = open(source, 'rb')
+	try:
+		if (f.read(len(COMPILED_MAGIC)) != COMPILED_MAGIC):
+			f.close()
+			return None
+		mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+	except Exception:
+		f.close()
+		raise
+	return CompiledScript(mapped, (mapped, f))
+
+# Funcion compileMain
+# Punto de entrada del modo compile
+# @args
+#    argv: argumentos luego de 'compile'
+# @returns
+#    Int, codigo de salida
+
+def compileMain(argv):
+	parser = argparse.ArgumentParser(prog='analyzer.py compile', \
+		description='Convert iCasa scripts to the compiled binary format.')
+	parser.add_argument('input_files', nargs='+')
+	parser.add_argument('-o', '--output', default=None, \
+		help='output file (one input only); default: input with .bhvc extension')
+	args = parser.parse_args(argv)
+	if (args.output is not None and len(args.input_files) > 1):
+		parser.error('--output needs a single input file')
+	for path in args.input_files:
+		archive, member = splitMember(path)
+		name = path if member is None else os.path.basename(member)
+		if (compression(name) is not None):
+			name = os.path.splitext(name)[0]
+		target = args.output or os.path.splitext(name)[0] + '.bhvc'
+		if (isPlainScript(path)):
+			compileScript(path, target)
 		else:
-			# Creo primer evento delay
-			if (tlist[0]['unit'] == 's'):
-				value = int(tlist[0]['value'])
-				time_unit = datetime.timedelta(seconds=value)
-			elif (tlist[0]['unit'] == 'm'):
-				value = int(tlist[0]['value'])
-				time_unit = datetime.timedelta(minutes=value)
-			else:
-				value = int(tlist[0]['value'])
-				time_unit = datetime.timedelta(hours=value)
-			eclass.append(TimeEvent(None, tlist[0]['orden'], tlist[0]['unit'], \
-				time_unit, tlist[0]['expr']))
-			# Llamo al event_generator sin contar el primer elemento de la lista
-			if (len(tlist) > 1):
-				event_generator(tlist[1:], eclass)
-
-		# Ordenando segun posicion 
-		eclass.sort(key=positionOrdering)
-
-		# GENERANDO SITUACIONES
-
-		# Contador
-		counter = 0
-		# Aux sera lista de indices de eclass donde hay fin de actividad
-		aux = []
-		for elem in eclass:
-			if (isinstance(elem, TimeEvent)):
-				if (elem.value == datetime.timedelta(0) and elem.unit == 's'):
-					aux.append(counter)
-			counter = counter + 1
-
-		# Formo subconjuntos de eventos que seran situaciones
-		start = 0
-		for elem in aux:
-			slist.append(eclass[start:elem])
-			start = elem + 1
-
-		# Genero lista de instancias de situaciones
-		for elem in slist:
-			size = len(elem)
-			sclass.append(Situation(elem[0], elem[1:size - 1], elem[size - 1]))
-
-		# TENGO TODAS LAS SITUACIONES DEL SCRIPT DE SIMULACION
-
-		# Analizamos situaciones para hallar posibles problemas
-		for s in sclass:
-			eventos = [s.get_first_event()] + s.get_mid_events() + [s.get_last_event()]
-			for e in eventos:
-				if (isinstance(e, PropertyChangingEvent)):
-					# 1. Si hay inundacion
-					if (e.device.type_name == 'iCasa.FloodSensor' and \
-						e.changedProperty['value'] == 'true'):
-						elist.append({'position': e.position, 'executer': e.executer, \
-							'error': 'FloodSensor detected a problem'})
-					# 2. Luces siempre encendidas
-					# 2.1 Binary Lights
-					elif (e.device.type_name == 'iCasa.BinaryLight' and \
-						e.changedProperty['property'] == 'binaryLight.powerStatus' and \
-						e.changedProperty['value'] == 'true'):
-						# Determino si hay problemas con la funcion adecuada
-						deviceTimeOn(eventos, e, elist, time_sim)
-					# 2.2 Dimmer Lights
-					elif (e.device.type_name == 'iCasa.DimmerLight' and \
-						e.changedProperty['property'] == 'dimmerLight.powerLevel' and \
-						float(e.changedProperty['value']) >= 0):
-						# Determino si hay problemas con la funcion adecuada
-						deviceTimeOn(eventos, e, elist, time_sim)
-					# 3. Altas/bajas temperaturas
-					# 3.1 Heater
-					elif (e.device.type_name == 'iCasa.Heater' and \
-						e.changedProperty['property'] == 'heater.powerLevel' and \
-						float(e.changedProperty['value']) >= 0):
-						# Determino si hay problemas con la funcion adecuada
-						deviceTimeOn(eventos, e, elist)
-						# Reviso si el device esta activo con temperatura adecuada
-						temp_zone = float(e.device.zones[0]['zone'].variables['Temperature'])
-						if (temp_zone < MAX_TEMPERATURE):
-							elist.append({'position': e.position, 'executer': e.executer, \
-								'error': 'Heater on when no needed'})
-					elif (e.device.type_name == 'iCasa.Cooler' and \
-						e.changedProperty['property'] == 'cooler.powerLevel' and \
-						float(e.changedProperty['value']) >= 0):
-						# Determino si hay problema con la funcion adecuada
-						deviceTimeOn(eventos, e, elist)
-						# Reviso si el device esta activo con temperatura adecuada
-						temp_zone = float(e.device.zones[0]['zone'].variables['Temperature'])
-						if (temp_zone > MIN_TEMPERATURE):
-							elist.append({'position': e.position, 'executer': e.executer, \
-								'error': 'Cooler on when no needed'})
-					# 4. Altos niveles de CO/CO2
-					# 4.1 CO2
-					elif (e.device.type_name == 'iCasa.COGasSensor' and \
-						e.changedProperty['property'] == 'carbonMonoxydeSensor.currentConcentration' and \
-						float(e.changedProperty['value']) >= MAX_CO_CONCENTRATION):
-						elist.append({'position': e.position, 'executer': e.executer, \
-							'error': 'HIGH CO CONCENTRATION'})
-					# 4.2 CO
-					elif (e.device.type_name == 'iCasa.CO2GasSensor' and \
-						e.changedProperty['property'] == 'carbonDioxydeSensor.currentConcentration' and \
-						float(e.changedProperty['value']) >= MAX_CO2_CONCENTRATION):
-						elist.append({'position': e.position, 'executer': e.executer, \
-							'error': 'HIGH CO2 CONCENTRATION'})
-					# 5. Puerta principal abierta mucho tiempo
-					elif (e.device.type_name == 'iCasa.DoorWindowSensor' and \
-						e.changedProperty['value'] == 'true' and e.device.zones[0]['zone'].name == main_door_room):
-						# Contamos la salida
-						times_out.append(1)
-						# Revisamos si se cerro
-						closed_door = [x for x in eventos if isinstance(x, PropertyChangingEvent) and\
-										x.device.type_name == 'iCasa.DoorWindowSensor' and \
-										x.changedProperty['value'] == 'false' and \
-										e.device.name == x.device.name and e.position < x.position]
-						# Si la cerraron
-						if (closed_door):
-							# Revisamos tiempo entre open/close
-							time_bw_closing = [x.value for x in eventos if isinstance(x, TimeEvent) and \
-												x.position > e.position and x.position < closed_door[0].position]
-							if (time_bw_closing):
-								time_bw_closing = reduce((lambda x, y: x + y), time_bw_closing)
-								if (time_bw_closing > MAX_MAIN_DOOR_OPEN_TIME):
-									elist.append({'position': e.position, 'executer': e.executer, \
-										'error': 'Main door LET OPENED for much time'})
-						# Si no fue cerrada
-						else:
-							# Obtenemos tiempo transcurrido luego de apertura
-							time_opened = [x.value for x in eventos if isinstance(x, TimeEvent) and \
-											x.position > e.position]
-							if (time_opened):
-								time_opened = reduce((lambda x, y: x + y), time_opened)
-								if (time_opened > MAX_MAIN_DOOR_OPEN_TIME):
-									elist.append({'position': e.position, 'executer': e.executer, \
-										'error': 'Main door LET OPENED for much time'})
-					# 6. Sirena encendida
-					elif (e.device.type_name == 'iCasa.Siren' and \
-						e.changedProperty['value'] == 'true'):
-						elist.append({'position': e.position, 'executer': e.executer, \
-							'error': 'SIREN RINGING'})
-					# 7. Andando, por mucho tiempo, de madrugada
-					elif (e.device.type_name  == 'iCasa.PresenceSensor' and \
-						e.changedProperty['value'] == 'true'):
-						# Miramos si estuvo activo de madrugada
-						current_time = [x.value for x in eventos if isinstance(x, TimeEvent) and \
-										x.position < e.position]
-						if (current_time):
-							current_time = time_sim + reduce((lambda x, y: x + y), current_time)
-							# Hora exacta de encendido
-							current_time = (datetime.datetime.min + current_time).time()
-							# Revisamos la duracion del encendido
-							turn_off = [x for x in eventos if isinstance(x, PropertyChangingEvent) and \
-										x.position > e.position and \
-										x.device.name == e.device.name and \
-										x.changedProperty['value'] == 'false']
-							# Se apago
-							if (turn_off):
-								turn_off = turn_off[0]
-								time_on = [x.value for x in eventos if isinstance(x, TimeEvent) and \
-											x.position > e.position and x.position < turn_off.position]
-								if (time_on):
-									# Tiempo encendido hallado
-									time_on = reduce((lambda x, y: x + y), time_on)
-									if (time_on > datetime.timedelta(minutes=30) and \
-										NIGHTTIME_MAX > current_time and \
-										current_time > datetime.time(0, 0, 0)):
-										# Hay un problema
-										elist.append({'position': e.position, 'executer': e.executer, \
-											'error': 'Wandering around at wrong time'})
-							# No se apago
-							else:
-								# Hallamos el tiempo desde el encendido hasta el final de la sim
-								time_on = [x.value for x in eventos if isinstance(x, TimeEvent) and \
-											x.position > e.position]
-								if (time_on):
-									# Tiempo encendido hallado
-									time_on = reduce((lambda x, y: x + y), time_on)
-									if (time_on > datetime.timedelta(minutes=30) and \
-										NIGHTTIME_MAX > current_time and \
-										current_time > datetime.time(0, 0, 0)):
-										# Hay un problema
-										elist.append({'position': e.position, 'executer': e.executer, \
-											'error': 'Wandering around at wrong time'})
-				# Problemas relacionados a movimientos
-				elif (isinstance(e, MoveEvent)):
-					# 8. Sedentarismo
-					e_zone = e.zone.name
-					if (e.event == 'move-person-zone' and e_zone == 'bedroom'):
-						# Obtenemos proximos moves a zones del mismo executer
-						next_moves = [x for x in eventos if isinstance(x, MoveEvent) and \
-									x.position > e.position and x.event == 'move-person-zone' and \
-									x.executer == e.executer]
-						# Sino hay mas
-						if (len(next_moves) == 0):
-							# Tiempo transcurrido al momento del move al bedroom
-							delays = [x.value for x in eventos if isinstance(x, TimeEvent) and \
-							x.position < e.position]
-							if (delays):
-								# Si hay algun delay
-								time_before_move = reduce((lambda x, y: x + y), delays)
-								current_time = time_sim + time_before_move
-								# Detectamos problemas con funcion adecuada
-								possibleSedentarism(eventos, e, current_time, elist)
-							else:
-								# Detectamos problemas con funcion adecuada y tiempo adecuado
-								possibleSedentarism(eventos, e, time_sim, elist)
-						# Si hay
-						else:
-							# Tiempo transcurrido al momento del move al bedroom
-							delays = [x.value for x in eventos if isinstance(x, TimeEvent) and \
-							x.position < e.position]
-							if (delays):
-								# Si hay algun delay
-								time_before_move = reduce((lambda x, y: x + y), delays)
-								current_time = time_sim + time_before_move
-								# Uso funcion adecuada
-								possibleSedentarismBM(eventos, e, current_time, next_moves, elist)
-							else:
-								# El move es el primer evento, uso funcion adecuada
-								possibleSedentarismBM(eventos, e, time_sim, next_moves, elist)
-					# 9. Accidentes
-					# NO DETECTA DELAYS LUEGO DE MOVE-PERSON DE SETUP
-					# Los 'accidentes' en bedroom quedan atrapados por el analisis de sedentarismo
-					if (e.event == 'move-person-zone' and e_zone != 'bedroom'):
-						# Obtenemos siguiente move a cualquier zona del mismo executer
-						next_moves = [x for x in eventos if isinstance(x, MoveEvent) and \
-									x.position > e.position and x.event == 'move-person-zone' and \
-									x.executer == e.executer]
-						# Si hay movimientos futuros
-						if (next_moves):
-							# Se debe ubicar tiempo inicial y tiempo entre movimientos
-							delays = [x.value for x in eventos if isinstance(x, TimeEvent) and \
-							x.position < e.position]
-							if (delays):
-								# Determinamos tiempo inicial
-								time_before_move = reduce((lambda x, y: x + y), delays)
-								current_time = time_sim + time_before_move
-								# Llamo la funcion adecuada
-								possibleAccidentBM(eventos, e, e_zone, next_moves, elist)
-							else:
-								# El move es el primer evento
-								possibleAccidentBM(eventos, e, e_zone, next_moves, elist)
-						# En otro caso
-						else:
-							# Se debe ubicar tiempo inicial y tiempo entre movimientos
-							delays = [x.value for x in eventos if isinstance(x, TimeEvent) and \
-							x.position < e.position]
-							if (delays):
-								# Determinamos tiempo inicial
-								time_before_move = reduce((lambda x, y: x + y), delays)
-								current_time = time_sim + time_before_move
-								# Llamo la funcion adecuada
-								possibleAccident(eventos, e, e_zone, elist)
-							else:
-								# El move es el primer evento
-								possibleAccident(eventos, e, e_zone, elist)
-				# Problemas relacionados con cambios de variables zonales
-				elif (isinstance(e, VarChangingEvent)):
-					e_zone = e.change['zone'].name
-					# 7. Ubicacion al cocinar
-					# Al detectar variacion de calor en la cocina, asumimos cooking
-					if (e.change['variable'] == 'Temperature' and e_zone == 'kitchen'):
-						prev_event = [x for x in behavior if x.attrib['orden'] == e.position - 1][0]
-						# Ignoramos setup
-						if (prev_event.tag == 'add-zone-variable'):
-							pass
-						elif (prev_event.tag != 'add-zone-variable'):
-							# Caso en el que se apaga y luego se prende no merece analisis
-							temp_eg_than_me = [x for x in eventos if isinstance(x, VarChangingEvent) and \
-												x.position > e.position and \
-												x.change['variable'] == 'Temperature' and \
-												x.change['zone'].name == 'kitchen' and \
-												x.change['value'] > e.change['value']]
-							if (temp_eg_than_me):
-								pass
-
-							else:
-								# Miramos si el calor disminuye en el futuro gracias al mismo que encendio
-								temp_going_down = [x for x in eventos if isinstance(x, VarChangingEvent) and \
-												x.position > e.position and \
-												x.change['variable'] == 'Temperature' and \
-												x.change['zone'].name == 'kitchen' and \
-												x.change['value'] < e.change['value'] and \
-												x.executer == e.executer]
-								if (temp_going_down):
-									temp_going_down = temp_going_down[0]
-									# Debemos identificar si hay un move a otra zona en este espacio de tiempo
-									next_zone_move = [x for x in eventos if isinstance(x, MoveEvent) and \
-														x.position > e.position and \
-														x.position < temp_going_down.position and \
-														x.zone.name != 'kitchen' and x.executer == e.executer]
-									if (next_zone_move):
-										next_zone_move = next_zone_move[0]
-										# Hallamos momento de retorno a la cocina
-										returning_kitchen = [x for x in eventos if isinstance(x, MoveEvent) and \
-															x.position > next_zone_move.position and \
-															x.position < temp_going_down.position and \
-															x.zone.name == 'kitchen' and x.executer == e.executer]
-										if (returning_kitchen):
-											returning_kitchen = returning_kitchen[0]
-											# Calculamos tiempo entre ida y vuelta
-											returning_kitchen_t = [x.value for x in eventos if isinstance(x, TimeEvent) and \
-																		x.position > next_zone_move.position and \
-																		x.position < returning_kitchen.position]
-											if (returning_kitchen_t):
-												returning_kitchen_t = reduce((lambda x, y: x + y), returning_kitchen_t)
-												# Miramos si el tiempo fue superior al estipulado
-												if (returning_kitchen_t > MAX_TIME_OUT_COOKING):
-													# Hay problema
-													elist.append({'position': e.position, 'executer': e.executer, \
-														'error': 'Abandoning kitchen while cooking'})
-								# Puede ser que alguien mas apago la llama o nadie mas
-								else:
-									# 1. Vemos si la apago alguien mas
-									temp_going_down = [x for x in eventos if isinstance(x, VarChangingEvent) and \
-														x.position > e.position and \
-														x.change['variable'] == 'Temperature' and \
-														x.change['zone'].name == 'kitchen' and \
-														x.change['value'] < e.change['value']]
-									if (temp_going_down):
-										temp_going_down = temp_going_down[0]
-										# El que prendio la llama se fue
-										next_zone_move = [x for x in eventos if isinstance(x, MoveEvent) and \
-															x.position > e.position and \
-															x.position < temp_going_down.position and \
-															x.zone.name != 'kitchen' and x.executer == e.executer]
-										if (next_zone_move):
-											next_zone_move = next_zone_move[0]
-											# Calculamos tiempo que duro encendida la cocina hasta que alguien mas la apago
-											someone_else_t = [x.value for x in eventos if isinstance(x, TimeEvent) and \
-																	x.position > next_zone_move.position and \
-																	x.position < temp_going_down.position]
-											if (someone_else_t):
-												someone_else_t = reduce((lambda x, y: x + y), someone_else_t)
-												if (someone_else_t > MAX_TIME_OUT_COOKING):
-													# Hay un problema con el que dejo eso encendido
-													elist.append({'position': e.position, 'executer': e.executer, \
-														'error': 'Abandoning kitchen while cooking'})
-									# 2. No lo apago nadie
-									else:
-										# El que prendio la llama se fue
-										next_zone_move = [x for x in eventos if isinstance(x, MoveEvent) and \
-															x.position > e.position and \
-															x.zone.name != 'kitchen' and x.executer == e.executer]
-										if (next_zone_move):
-											next_zone_move = next_zone_move[0]
-											# Pude regresar y no apagarla
-											returning_kitchen = [x for x in eventos if isinstance(x, MoveEvent) and \
-																x.position > next_zone_move.position and \
-																x.zone.name == 'kitchen' and \
-																x.executer == e.executer]
-											if (returning_kitchen):
-												returning_kitchen = returning_kitchen[0]
-												# Veo si me fui sin apagar
-												leaving_again = [x for x in eventos if isinstance(x, MoveEvent) and \
-																x.position > returning_kitchen.position and \
-																x.zone.name != 'kitchen' and \
-																x.executer == e.executer]
-												if (leaving_again):
-													leaving_again = leaving_again[0]
-													# Calculo el tiempo hasta el final
-													time_till_finish = [x.value for x in eventos if isinstance(x, TimeEvent) and \
-																		x.position > leaving_again.position]
-													if (time_till_finish):
-														time_till_finish = reduce((lambda x, y: x + y), time_till_finish)
-														if (time_till_finish > MAX_TIME_OUT_COOKING):
-															# Hay problema con el que encendio la cocina
-															elist.append({'position': e.position, 'executer': e.executer, \
-																'error': 'Abandoning kitchen while cooking'})
-											# Nunca regrese
-											else:
-												# Vemos si la temperatura es alta
-												test_high_temp = [x for x in eventos if isinstance(x, VarChangingEvent) and \
-																	x.position < e.position and x.executer == e.executer and \
-																	x.change['variable'] == 'Temperature']
-												if  (test_high_temp):
-													test_high_temp = test_high_temp[len(test_high_temp) - 1]
-													if (e.change['value'] < test_high_temp.change['value']):
-														pass
-													else:
-														# Vemos el tiempo hasta el final de forma que sepamos si hay data suficiente
-														# para evaluar
-														time_till_finish = [x.value for x in eventos if isinstance(x, TimeEvent) and \
-																			x.position > e.position]
-														if (time_till_finish):
-															time_till_finish = reduce((lambda x, y: x + y), time_till_finish)
-															if (time_till_finish > MAX_TIME_OUT_COOKING):
-																# Hay problema con el que encendio la cocina
-																elist.append({'position': e.position, 'executer': e.executer, \
-																	'error': 'Abandoning kitchen while cooking'})
-										# No hay movimiento despues de mi, no puedo hacer inferencia sobre este issue
-										else:
-											pass
-			# 10. Idas al banio, per situation
-			# Hallamos la totalidad del tiempo por cada situacion
-			situation_time = [x.value for x in eventos if isinstance(x, TimeEvent)]
-			situation_time = reduce((lambda x, y: x + y), situation_time)
-			total_time.append(situation_time)
-			# Si el tiempo de una situacion es mayor a 4 horas, se debio ir, idealmente
-			# al menos una vez a banio
-			if (situation_time > IDEAL_TIME_BW_MICTURITION):
-				# Revisamos si fuimos al menos una vez al banio en ese periodo
-				went_to_bathroom = [x for x in eventos if isinstance(x, MoveEvent) and \
-									x.event == 'move-person-zone' and x.zone.name == 'bathroom']
-				# Suponiendo una unica persona, si hay eventos, los contamos
-				times_bathroom = len(went_to_bathroom)
-				if (times_bathroom > 0):
-					pass
-					#print('No apparent micturating problem')
+			with openScript(path) as stream:
+				compileScript(stream, target)
+		print('%s -> %s' % (path, target))
+	return 0
+
+#################################
+# Scripts comprimidos y archivos#
+#################################
+
+# Descompresion segun la extension del script
+COMPRESSED_OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
+# Extensiones de archivos tar y zip. Un miembro se nombra 'archivo!miembro'
+ARCHIVE_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz', '.zip')
+ARCHIVE_SEPARATOR = '!'
+
+# Scripts que se buscan al recorrer un directorio
+DIRECTORY_PATTERNS = ['*.bhv', '*.bhv.gz', '*.bhv.bz2', '*.bhv.xz']
+
+# Funcion isArchive
+# @args
+#    path: ruta
+# @returns
+#    Boolean, si la ruta es un archivo tar o zip
+
+def isArchive(path):
+	return path.lower().endswith(ARCHIVE_SUFFIXES)
+
+# Funcion splitMember
+# Separa una ruta 'archivo!miembro' en sus partes
+# @args
+#    path: ruta de un script, o de un miembro de un archivo
+# @returns
+#    Tupla (ruta, miembro), con miembro None si no es de un archivo
+
+def splitMember(path):
+	index = path.find(ARCHIVE_SEPARATOR)
+	while (index >= 0):
+		if (isArchive(path[:index])):
+			return (path[:index], path[index + 1:])
+		index = path.find(ARCHIVE_SEPARATOR, index + 1)
+	return (path, None)
+
+# Funcion compression
+# @args
+#    name: nombre del script
+# @returns
+#    Extension de compresion del nombre ('.gz', '.bz2', '.xz'), o None
+
+def compression(name):
+	suffix = os.path.splitext(name)[1].lower()
+	return suffix if suffix in COMPRESSED_OPENERS else None
+
+# Funcion isScriptName
+# @args
+#    name: nombre de un archivo o miembro
+# @returns
+#    Boolean, si es un script (.bhv o .bhvc, comprimido o no)
+
+def isScriptName(name):
+	if (compression(name) is not None):
+		name = os.path.splitext(name)[0]
+	return name.lower().endswith(('.bhv', '.bhvc'))
+
+# Funcion isPlainScript
+# @args
+#    path: ruta del script
+# @returns
+#    Boolean, si el script es un archivo sin comprimir fuera de un archivo
+
+def isPlainScript(path):
+	return splitMember(path)[1] is None and compression(path) is None
+
+# Funcion openZip
+# ZipFile abierto de un archivo, compartido por las lecturas de sus miembros
+# en un mismo proceso para no releer su directorio central en cada una. La
+# fecha y el tamanio son parte de la clave: un archivo modificado se reabre
+# @args
+#    path: ruta del zip
+#    mtime: fecha de modificacion (ns)
+#    size: tamanio en bytes
+# @returns
+#    zipfile.ZipFile, no cerrarlo
+
+@functools.lru_cache(maxsize=8)
+def openZip(path, mtime, size):
+	return zipfile.ZipFile(path)
+
+# Funcion openScript
+# Abre un script como stream binario, descomprimiendolo y leyendo su
+# miembro de un tar o zip sin extraerlo a disco. Uso: 'with openScript(path)'
+# @args
+#    path: ruta del script, o 'archivo!miembro'
+# @returns
+#    Context manager del stream binario
+
+@contextmanager
+def openScript(path):
+	archive, member = splitMember(path)
+	with ExitStack() as stack:
+		if (member is None):
+			if (isArchive(path)):
+				raise ValueError('%s is an archive, name a script as archive%smember' \
+					% (path, ARCHIVE_SEPARATOR))
+			stream = stack.enter_context(open(path, 'rb'))
+		elif (archive.lower().endswith('.zip')):
+			st = os.stat(archive)
+			bundle = openZip(archive, st.st_mtime_ns, st.st_size)
+			stream = stack.enter_context(bundle.open(member))
+		else:
+			bundle = stack.enter_context(tarfile.open(archive))
+			stream = bundle.extractfile(member)
+			if (stream is None):
+				raise ValueError('%s is not a file in %s' % (member, archive))
+			stack.enter_context(stream)
+		opener = COMPRESSED_OPENERS.get(compression(member or path))
+		if (opener is not None):
+			stream = stack.enter_context(opener(stream))
+		yield stream
+
+# Funcion readScript
+# Contenido descomprimido de un script
+# @args
+#    path: ruta del script, o 'archivo!miembro'
+#    data: contenido ya leido del archivo (posiblemente comprimido), o None
+# @returns
+#    Bytes
+
+def readScript(path, data=None):
+	if (data is None):
+		with openScript(path) as stream:
+			return stream.read()
+	opener = COMPRESSED_OPENERS.get(compression(splitMember(path)[1] or path))
+	if (opener is not None):
+		with opener(io.BytesIO(data)) as stream:
+			return stream.read()
+	return data
+
+# Funcion loadScript
+# Ingiere un script de cualquier fuente: los archivos sin comprimir se
+# leen por ruta (y se mapean si son compilados), el resto por stream
+# @args
+#    path: ruta del script, o 'archivo!miembro'
+# @returns
+#    Ingestor del script
+
+def loadScript(path):
+	if (isPlainScript(path)):
+		return ingestScript(path)
+	with openScript(path) as stream:
+		return ingestScript(stream)
+
+# Funcion archiveMembers
+# Recorre los scripts de un tar o zip a medida que se piden. Los zip se
+# listan por su directorio central y cada worker lee su miembro (ver
+# openZip); los tar
+# se leen en una sola pasada secuencial, pasando el contenido de cada miembro
+# @args
+#    path: ruta del archivo
+# @returns
+#    Generador de tuplas (ruta 'archivo!miembro', contenido o None)
+
+def archiveMembers(path):
+	if (path.lower().endswith('.zip')):
+		with zipfile.ZipFile(path) as bundle:
+			for info in bundle.infolist():
+				if (not info.is_dir() and isScriptName(info.filename)):
+					yield (path + ARCHIVE_SEPARATOR + info.filename, None)
+	else:
+		with tarfile.open(path, 'r|*') as bundle:
+			for member in bundle:
+				if (member.isfile() and isScriptName(member.name)):
+					data = bundle.extractfile(member).read()
+					yield (path + ARCHIVE_SEPARATOR + member.name, data)
+
+#################################
+# Reglas                        #
+#################################
+
+# Clase SituationContext
+# Lo que una regla necesita saber de la situacion que se analiza
+#
+# @attrs
+#    situation: Situation que se analiza
+#    events: eventos de la situacion, en orden
+#    clock: timeline acotado a la situacion
+#    errors: lista de errores al cual aniadir nuevos
+#    main_door_room: puertas exteriores (zonas o ids, ver parseDoors)
+#    doors: frozenset de nombres de main_door_room
+
+class SituationContext:
+
+	# Inicializador
+	def __init__(self, situation, clock, errors, main_door_room):
+		self.situation = situation
+		self.events = situation.events
+		self.clock = clock
+		self.errors = errors
+		self.main_door_room = main_door_room
+		self.doors = parseDoors(main_door_room)
+		self.intervals = None
+		self.door_intervals = None
+
+	# Retorna el intervalo de encendido que inicia el evento 'e', None si
+	# 'e' no enciende un device. Los intervalos se arman la primera vez
+	def interval(self, e):
+		if (self.intervals is None):
+			self.intervals = deviceIntervals(self.situation.of_type(PropertyChangingEvent), self.clock)
+		return self.intervals.get(e.position)
+
+	# Intervalos de apertura de las puertas exteriores, en orden de apertura.
+	# Se arman la primera vez
+	def doorIntervals(self):
+		if (self.door_intervals is None):
+			self.door_intervals = doorIntervals(self.situation.of_type(PropertyChangingEvent), \
+				self.clock, self.doors)
+		return self.door_intervals
+
+	# Retorna el intervalo de apertura que inicia el evento 'e', None si
+	# 'e' no abre una puerta exterior
+	def door(self, e):
+		return self.doorIntervals().get(e.position)
+
+	# Aniade el error 'error' causado por el evento 'e'
+	def report(self, e, error):
+		self.errors.append({'position': e.position, 'executer': e.executer, 'error': error})
+
+# Registro de reglas sobre PropertyChangingEvent:
+# dict tipo de device -> dict propiedad (None para cualquiera) -> lista de reglas
+RULES = {}
+
+# Reglas que solo miran el evento mismo, el analisis en linea las aplica
+# apenas llega el evento en vez de esperar el fin de la situacion
+IMMEDIATE_RULES = set()
+
+# Procedimiento registerRule
+# Registra una regla para los cambios de 'prop' en devices de tipo 'type_name'.
+# Una regla es una funcion rule(ctx, e) que recibe un SituationContext y el
+# PropertyChangingEvent, y reporta los errores que encuentre
+# @args
+#    type_name: tipo de device (ej. 'iCasa.BinaryLight')
+#    prop: propiedad modificada, None para cualquier propiedad
+#    rule: funcion de la regla
+#    immediate: True si la regla no usa el resto de la situacion ni el reloj
+
+def registerRule(type_name, prop, rule, immediate=False):
+	RULES.setdefault(type_name, {}).setdefault(prop, []).append(rule)
+	if (immediate):
+		IMMEDIATE_RULES.add(rule)
+
+# Procedimiento dispatchRules
+# Aplica al evento 'e' solo las reglas registradas para su tipo y propiedad
+# @args
+#    ctx: SituationContext de la situacion
+#    e: PropertyChangingEvent
+#    immediate: None para todas las reglas, True/False para solo las
+#               inmediatas o solo las que esperan el fin de la situacion
+
+def dispatchRules(ctx, e, immediate=None):
+	by_prop = RULES.get(e.device.type_name)
+	if (by_prop):
+		for rule in by_prop.get(e.changedProperty['property'], ()):
+			if (immediate is None or (rule in IMMEDIATE_RULES) == immediate):
+				rule(ctx, e)
+		for rule in by_prop.get(None, ()):
+			if (immediate is None or (rule in IMMEDIATE_RULES) == immediate):
+				rule(ctx, e)
+
+# 1. Si hay inundacion
+def floodRule(ctx, e):
+	if (e.changedProperty['value'] == 'true'):
+		ctx.report(e, 'FloodSensor detected a problem')
+
+# 2. Luces siempre encendidas (binary y dimmer lights)
+def lightRule(ctx, e):
+	interval = ctx.interval(e)
+	if (interval is not None):
+		# Determino si hay problemas con la funcion adecuada
+		deviceTimeOn(interval, ctx.errors, ctx.clock)
+
+# 3. Altas/bajas temperaturas
+# 3.1 Heater
+def heaterRule(ctx, e):
+	interval = ctx.interval(e)
+	if (interval is not None):
+		# Determino si hay problemas con la funcion adecuada
+		deviceTimeOn(interval, ctx.errors, ctx.clock)
+		# Reviso si el device esta activo con temperatura adecuada, la de la
+		# zona al momento del encendido
+		temp_zone = e.device.zones[0]['zone'].valueAt('Temperature', e.position)
+		if (temp_zone is not None and temp_zone < MAX_TEMPERATURE):
+			ctx.report(e, 'Heater on when no needed')
+
+# 3.2 Cooler
+def coolerRule(ctx, e):
+	interval = ctx.interval(e)
+	if (interval is not None):
+		# Determino si hay problema con la funcion adecuada
+		deviceTimeOn(interval, ctx.errors, ctx.clock)
+		# Reviso si el device esta activo con temperatura adecuada, la de la
+		# zona al momento del encendido
+		temp_zone = e.device.zones[0]['zone'].valueAt('Temperature', e.position)
+		if (temp_zone is not None and temp_zone > MIN_TEMPERATURE):
+			ctx.report(e, 'Cooler on when no needed')
+
+# 4. Altos niveles de CO/CO2
+# 4.1 CO
+def coRule(ctx, e):
+	if (e.number >= MAX_CO_CONCENTRATION):
+		ctx.report(e, 'HIGH CO CONCENTRATION')
+
+# 4.2 CO2
+def co2Rule(ctx, e):
+	if (e.number >= MAX_CO2_CONCENTRATION):
+		ctx.report(e, 'HIGH CO2 CONCENTRATION')
+
+# 5. Puerta principal abierta mucho tiempo
+def mainDoorRule(ctx, e):
+	interval = ctx.door(e)
+	if (interval is None):
+		return
+	# Tiempo hasta el cierre o, si no se cerro, hasta el final de la situacion
+	if (ctx.clock.count(interval.on_position, interval.off_position) and \
+		interval.duration > MAX_MAIN_DOOR_OPEN_TIME):
+		ctx.report(e, 'Main door LET OPENED for much time')
+
+# 6. Sirena encendida
+def sirenRule(ctx, e):
+	if (e.changedProperty['value'] == 'true'):
+		ctx.report(e, 'SIREN RINGING')
+
+# 7. Andando, por mucho tiempo, de madrugada
+def wanderingRule(ctx, e):
+	# Miramos si estuvo activo de madrugada
+	if (e.changedProperty['value'] != 'true' or not ctx.clock.count(None, e.position)):
+		return
+	# Hora exacta de encendido
+	current_time = ctx.clock.time_of_day(e.position)
+	# Revisamos la duracion del encendido
+	turn_off = [x for x in ctx.situation.of_device(e.device.name) if \
+				x.position > e.position and \
+				x.changedProperty['value'] == 'false']
+	# Se apago: tiempo hasta el apagado. Si no, hasta el final de la situacion
+	end = turn_off[0].position if turn_off else None
+	if (ctx.clock.count(e.position, end)):
+		# Tiempo encendido hallado
+		time_on = ctx.clock.elapsed(e.position, end)
+		if (time_on > datetime.timedelta(minutes=30) and \
+			NIGHTTIME_MAX > current_time and \
+			current_time > datetime.time(0, 0, 0)):
+			# Hay un problema
+			ctx.report(e, 'Wandering around at wrong time')
+
+registerRule('iCasa.FloodSensor', None, floodRule, immediate=True)
+registerRule('iCasa.BinaryLight', 'binaryLight.powerStatus', lightRule)
+registerRule('iCasa.DimmerLight', 'dimmerLight.powerLevel', lightRule)
+registerRule('iCasa.Heater', 'heater.powerLevel', heaterRule)
+registerRule('iCasa.Cooler', 'cooler.powerLevel', coolerRule)
+registerRule('iCasa.COGasSensor', 'carbonMonoxydeSensor.currentConcentration', coRule, immediate=True)
+registerRule('iCasa.CO2GasSensor', 'carbonDioxydeSensor.currentConcentration', co2Rule, immediate=True)
+registerRule('iCasa.DoorWindowSensor', None, mainDoorRule)
+registerRule('iCasa.Siren', None, sirenRule, immediate=True)
+registerRule('iCasa.PresenceSensor', None, wanderingRule)
+
+# Registro del mapeo de errores a constantes AGGIR:
+# dict error -> lista de variables AGGIR que el error pone en False
+AGGIR_RULES = {}
+
+# Procedimiento registerAggir
+# Registra las variables AGGIR afectadas por el error 'error'
+# @args
+#    error: string del error
+#    variables: lista de variables AGGIR que pasan a False
+
+def registerAggir(error, variables):
+	AGGIR_RULES.setdefault(error, []).extend(variables)
+
+registerAggir('FloodSensor detected a problem', ['HOUSEKEEPING', 'TRANSFERS', 'IN_MOVEMENTS', 'COHERENCE'])
+registerAggir('DimmerLight exceeded MAX time ON', ['HOUSEKEEPING', 'LOCATION', 'COHERENCE'])
+registerAggir('BinaryLight exceeded MAX time ON', ['HOUSEKEEPING', 'LOCATION', 'COHERENCE'])
+registerAggir('Heater exceeded MAX time ON', ['HOUSEKEEPING', 'LOCATION', 'COHERENCE'])
+registerAggir('Cooler exceeded MAX time ON', ['HOUSEKEEPING', 'LOCATION', 'COHERENCE'])
+registerAggir('Not getting out of room for much time', ['LOCATION', 'HOUSEKEEPING', 'ELIMINATION', 'LEISURE_ACTS', 'ALIMENTATION', 'COHERENCE'])
+registerAggir('Possible accident in BATHROOM', ['LOCATION', 'COHERENCE', 'TRANSFERS', 'HOUSEKEEPING'])
+registerAggir('Possible accident in LIVING ROOM', ['LOCATION', 'COHERENCE', 'TRANSFERS', 'HOUSEKEEPING'])
+registerAggir('Possible accident in KITCHEN', ['LOCATION', 'COHERENCE', 'TRANSFERS', 'HOUSEKEEPING'])
+registerAggir('Possible accident in HALLWAY', ['LOCATION', 'COHERENCE', 'TRANSFERS', 'HOUSEKEEPING'])
+registerAggir('Heater on when no needed', ['HOUSEKEEPING', 'LOCATION', 'COHERENCE'])
+registerAggir('Cooler on when no needed', ['HOUSEKEEPING', 'LOCATION', 'COHERENCE'])
+registerAggir('HIGH CO CONCENTRATION', ['HOUSEKEEPING'])
+registerAggir('HIGH CO2 CONCENTRATION', ['HOUSEKEEPING'])
+registerAggir('Main door LET OPENED for much time', ['LOCATION', 'COHERENCE', 'HOUSEKEEPING'])
+registerAggir('SIREN RINGING', ['HOUSEKEEPING'])
+registerAggir('Irregular micturating time', ['ELIMINATION', 'TOILETING', 'ALIMENTATION', 'TRANSFERS'])
+registerAggir('Never going out', ['TRANSFERS', 'COHERENCE', 'HOUSEKEEPING', 'PURCHASES', 'LEISURE_ACTS'])
+registerAggir('Not changing clothes', ['DRESSING', 'COHERENCE', 'TOILETING'])
+registerAggir('Lights on at wrong time', ['HOUSEKEEPING', 'LOCATION', 'COHERENCE'])
+registerAggir('Wandering around at wrong time', ['LOCATION', 'COHERENCE'])
+registerAggir('Abandoning kitchen while cooking', ['LOCATION', 'COHERENCE', 'HOUSEKEEPING'])
+
+#################################
+# Analisis                      #
+#################################
+
+# Procedimiento analyzeSituation
+# Aplica las reglas a los eventos de una situacion
+# @args
+#    ctx: SituationContext de la situacion
+#    pclass: lista de instancias de personas
+#    immediate: False si las reglas inmediatas ya se aplicaron
+
+def analyzeSituation(ctx, pclass, immediate=None):
+	eventos = ctx.events
+	sclock = ctx.clock
+	elist = ctx.errors
+	# Movimientos y cambios de variables de la situacion
+	situation = ctx.situation
+	# Cambios de temperatura de la cocina abandonados, al primero que aparezca
+	abandoned = None
+	for e in eventos:
+		if (isinstance(e, PropertyChangingEvent)):
+			# Reglas registradas para el tipo de device y la propiedad
+			dispatchRules(ctx, e, immediate)
+		# Problemas relacionados a movimientos
+		elif (isinstance(e, MoveEvent)):
+			# Solo los movimientos de quien se mueve
+			own_moves = situation.of_person(MoveEvent, e.executer)
+			# 8. Sedentarismo
+			e_zone = e.zone.name
+			if (e.event == 'move-person-zone' and e_zone == 'bedroom'):
+				# Obtenemos proximos moves a zones del mismo executer
+				next_moves = [x for x in own_moves if \
+							x.position > e.position and x.event == 'move-person-zone']
+				# Sino hay mas
+				if (len(next_moves) == 0):
+					# Detectamos problemas con funcion adecuada
+					possibleSedentarism(sclock, e, elist)
+				# Si hay
 				else:
-					# Hay problema
-					executer = [x for x in pclass][0]
-					elist.append({'position': None, 'executer': executer.name, \
-						'error': 'Irregular micturating time'})
+					# Uso funcion adecuada
+					possibleSedentarismBM(sclock, e, next_moves, elist)
+			# 9. Accidentes
+			# NO DETECTA DELAYS LUEGO DE MOVE-PERSON DE SETUP
+			# Los 'accidentes' en bedroom quedan atrapados por el analisis de sedentarismo
+			if (e.event == 'move-person-zone' and e_zone != 'bedroom'):
+				# Obtenemos siguiente move a cualquier zona del mismo executer
+				next_moves = [x for x in own_moves if \
+							x.position > e.position and x.event == 'move-person-zone']
+				# Si hay movimientos futuros
+				if (next_moves):
+					# Llamo la funcion adecuada
+					possibleAccidentBM(sclock, e, e_zone, next_moves, elist)
+				# En otro caso
+				else:
+					# Llamo la funcion adecuada
+					possibleAccident(sclock, e, e_zone, elist)
+		# Problemas relacionados con cambios de variables zonales
+		elif (isinstance(e, VarChangingEvent)):
+			e_zone = e.change['zone'].name
+			# 7. Ubicacion al cocinar
+			# Al detectar variacion de calor en la cocina, asumimos cooking
+			if (e.change['variable'] == 'Temperature' and e_zone == 'kitchen'):
+				# El setup (add-zone-variable) no genera VarChangingEvent
+				if (abandoned is None):
+					abandoned = abandonedCooking(eventos, sclock)
+				if (e.position in abandoned):
+					elist.append({'position': e.position, 'executer': e.executer, \
+						'error': 'Abandoning kitchen while cooking'})
+
+	# 10. Idas al banio, per situation
+	# Si el tiempo de una situacion es mayor a 4 horas, se debio ir, idealmente
+	# al menos una vez a banio
+	if (sclock.elapsed() > IDEAL_TIME_BW_MICTURITION):
+		for p in pclass:
+			# Revisamos si cada habitante fue al menos una vez al banio en ese periodo
+			went_to_bathroom = [x for x in situation.of_person(MoveEvent, p) if \
+								x.event == 'move-person-zone' and x.zone.name == 'bathroom']
+			times_bathroom = len(went_to_bathroom)
+			if (times_bathroom > 0):
+				pass
+				#print('No apparent micturating problem')
+			else:
+				# Hay problema
+				elist.append({'position': None, 'executer': p, \
+					'error': 'Irregular micturating time'})
+
+# Clase SimulationTotals
+# Acumula, situacion por situacion y por habitante, lo necesario para los
+# chequeos sobre la simulacion completa: idas al banio, vestido y salidas
+# de casa, contadas por dia en 'days'
+#
+# @attrs
+#    total_time: tiempo total de las situaciones
+#    days: DayBuckets con los contadores 'bathroom', 'closet' y 'out'
+#    wd_opened: si se abrio alguna vez una puerta del cuarto o el closet
+
+class SimulationTotals:
 
+	# Inicializador
+	def __init__(self, days=None):
+		self.total_time = datetime.timedelta(0)
+		self.days = days if days is not None else DayBuckets()
+		self.wd_opened = False
+
+	# Suma una situacion ya analizada, en una pasada por sus eventos
+	def addSituation(self, ctx):
+		doors = ctx.doorIntervals()
+		eventos = ctx.situation.events
+		last = len(eventos) - 1
+		# Segundos simulados hasta el evento en curso
+		seconds = int(self.total_time.total_seconds())
+		for i in range(len(eventos)):
+			e = eventos[i]
+			if (isinstance(e, TimeEvent)):
+				seconds += e.seconds
+			# Solo los eventos intermedios, sin el inicial ni el final
+			elif (isinstance(e, MoveEvent)):
+				if (0 < i < last and e.event == 'move-person-zone' and e.zone.name == 'bathroom'):
+					self.days.add('bathroom', e.executer, seconds)
+			elif (isinstance(e, PropertyChangingEvent)):
+				# 11. Salidas de casa: una por apertura de una puerta exterior
+				if (e.position in doors):
+					self.days.add('out', e.executer, seconds)
+				# 12. Dressing, veremos si el closet fue abierto alguna vez durante el
+				# o los dias
+				if (0 < i < last and e.device.type_name == 'iCasa.DoorWindowSensor' and \
+					e.changedProperty['value'] == 'true' and e.device.zones[0]['zone'].name == 'bedroom'):
+					self.wd_opened = True
+					prev_event = eventos[i - 1] if i > 1 else None
+					if (isinstance(prev_event, MoveEvent) and prev_event.position == e.position - 1):
+						# Abriendo puerta de cuarto y no closet, posible problema
+						pass
+					else:
+						# Abri el closet
+						self.days.add('closet', e.executer, seconds)
+		self.total_time += ctx.clock.elapsed()
+
+	# Suma los totales de una situacion dados por situationTotals
+	def addPart(self, part):
+		# Segundos simulados al inicio de la situacion
+		seconds = int(self.total_time.total_seconds())
+		for counter, person, times in part['counts']:
+			for t in times:
+				self.days.add(counter, person, seconds + t)
+		self.wd_opened = self.wd_opened or part['wd_opened']
+		self.total_time += datetime.timedelta(seconds=part['seconds'])
+
+	# Chequeos sobre la simulacion completa, por habitante
+	def check(self, pclass, elist):
+		total_time = self.total_time
 		# 10. Idas al banio, whole simulation
-		total_time = reduce((lambda x, y: x + y), total_time)
 		if (total_time > datetime.timedelta(hours=24)):
 			# Obtengo numero de dias a partir del todo
 			number_days = total_time.days
@@ -1486,245 +2474,1886 @@ def main(argv):
 			# Rango de cantidad de idas al banio
 			micturation_range = range(average_micturation_times - deviation, \
 										average_micturation_times + deviation + 1)
-			for s in sclass:
-				eventos = s.get_mid_events()
-				went_to_bathroom = [x for x in eventos if isinstance(x, MoveEvent) and \
-									x.event == 'move-person-zone' and x.zone.name == 'bathroom']
-				bathroom_times.append(len(went_to_bathroom))
 
-				# 12. Dressing, veremos si el closet fue abierto alguna vez durante el
-				# o los dias
-				for e in eventos:
-					if (isinstance(e, PropertyChangingEvent)):
-						if (e.device.type_name == 'iCasa.DoorWindowSensor' and \
-							e.changedProperty['value'] == 'true' and e.device.zones[0]['zone'].name == 'bedroom'):
-							prev_event = [x for x in eventos if x.position == e.position - 1][0]
-							if (isinstance(prev_event, MoveEvent)):
-								# Abriendo puerta de cuarto y no closet, posible problema
-								times_wd_opened.append(0)
-							else:
-								# Abri el closet
-								executer = e.executer
-								times_wd_opened.append(1)
-
-			if (times_wd_opened):
-				times_wd_opened = reduce((lambda x, y: x + y), times_wd_opened)
-				if (times_wd_opened >= number_days):
-					# Abri el closet al menos una vez al dia
+			for p in pclass:
+				# 12. Dressing
+				if (self.wd_opened):
+					if (self.days.total('closet', p) >= number_days):
+						# Abrio el closet al menos una vez al dia
+						pass
+					else:
+						# No se ha cambiado
+						elist.append({'position': None, 'executer': p, \
+							'error': 'Not changing clothes'})
+
+				# Siguiendo con 10
+				# Comprobamos si la cantidad de veces en la sim esta ok
+				if (self.days.total('bathroom', p) in micturation_range):
+					# Estoy dentro del rango
 					pass
 				else:
-					# No se ha cambiado
-					elist.append({'position': None, 'executer': executer, 'error': 'Not changing clothes'})
-
-			# Siguiendo con 10
-			bathroom_times = reduce((lambda x, y: x + y), bathroom_times)
-			# Comprobamos si la cantidad de veces en la sim esta ok
-			if (bathroom_times in micturation_range):
-				# Estoy dentro del rango
-				pass
-			else:				# Suponiendo existencia de solo una persona
-				executer = [x for x in pclass][0]
-				elist.append({'position': None, 'executer': executer.name, \
-					'error': 'Irregular micturating time'})						
+					elist.append({'position': None, 'executer': p, \
+						'error': 'Irregular micturating time'})
 
 		# 11. Salir al menos una vez de casa
-		# Se revisan las veces que salimos
-		if (times_out):
+		# Se revisan las veces que salio cada habitante
+		if (total_time > datetime.timedelta(hours=24)):
+			for p in pclass:
+				if (not self.days.total('out', p)):
+					# Hay un problema
+					elist.append({'position': None, 'executer': p, 'error': 'Never going out'})
+
+# Funcion situationTotals
+# Lo que una situacion ya analizada suma a SimulationTotals, con los tiempos
+# contados desde su inicio, para guardarlo y sumarlo luego con addPart
+# @args
+#    ctx: SituationContext de la situacion
+# @returns
+#    Dict con seconds (duracion), counts (lista de [contador, persona,
+#    segundos de cada ocurrencia]) y wd_opened
+
+def situationTotals(ctx):
+	part = SimulationTotals()
+	part.addSituation(ctx)
+	return {'seconds': int(part.total_time.total_seconds()), \
+		'counts': [[counter, person, times] for (counter, person), times in part.days.times.items()], \
+		'wd_opened': part.wd_opened}
+
+# Procedimiento mapAggir
+# Pone en False las constantes AGGIR afectadas por cada error de un habitante
+# @args
+#    pclass: lista de instancias de personas
+#    elist: lista de errores detectados
+
+def mapAggir(pclass, elist):
+	# Asocio errores con su executer, si es un habitante
+	persons = set(pclass)
+	for e in elist:
+		if (e['executer'] in persons):
+			for var in AGGIR_RULES.get(e['error'], ()):
+				e['executer'].aggir_const[var] = False
+
+# Funcion splitSituations
+# Rangos de indices del almacen de cada situacion, entre delays de cero
+# segundos
+# @args
+#    store: EventStore del script
+# @returns
+#    Lista de tuplas (inicio, fin) con fin exclusivo
+
+def splitSituations(store):
+	sranges = []
+	start = 0
+	for i in range(len(store)):
+		if (store.closes(i)):
+			if (i > start):
+				sranges.append((start, i))
+			start = i + 1
+	return sranges
+
+# Funcion situationsOf
+# Arma, una a una, las situaciones de un script con su reloj acotado
+# @args
+#    store: EventStore del script
+#    clock: timeline de todo el script
+#    sranges: rangos de splitSituations
+# @returns
+#    Generador de tuplas (Situation, timeline acotado a la situacion)
+
+def situationsOf(store, clock, sranges):
+	for start, end in sranges:
+		s = Situation(store.views(start, end))
+		yield (s, clock.window(s.get_first_event().position, s.get_last_event().position))
+
+# Funcion evaluate
+# Aplica las reglas a las situaciones de un script, los chequeos sobre la
+# simulacion completa y el mapeo a las constantes AGGIR de cada persona
+# @args
+#    situations: iterable de tuplas (Situation, timeline acotado)
+#    pclass: lista de instancias de personas
+#    main_door_room: puertas exteriores (zonas o ids, ver parseDoors)
+#    days: DayBuckets con la fecha y hora de inicio, o None
+#    reuse: SituationCache con las situaciones ya analizadas, o None para
+#           analizarlas todas. Si se da, 'situations' son los rangos del
+#           almacen (splitSituations) y solo se arman las que cambiaron
+# @returns
+#    Lista de errores detectados
+
+def evaluate(situations, pclass, main_door_room, days=None, reuse=None):
+	elist = []
+
+	# Totales de la simulacion completa
+	totals = SimulationTotals(days)
+
+	# Analizamos situaciones para hallar posibles problemas
+	phaseStart('situation rules')
+	if (reuse is None):
+		for s, sclock in situations:
+			ctx = SituationContext(s, sclock, elist, main_door_room)
+			analyzeSituation(ctx, pclass)
+			totals.addSituation(ctx)
+	else:
+		reuse.evaluate(situations, pclass, main_door_room, elist, totals)
+	phaseStop('situation rules')
+
+	# Idas al banio, dressing y salidas sobre la simulacion completa
+	phaseStart('bathroom/dressing/going out')
+	totals.check(pclass, elist)
+	phaseStop('bathroom/dressing/going out')
+
+	# MAPEO DE ERRORES EN SIMULACION CON LAS CONSTANTES AGGIR
+	phaseStart('aggir mapping')
+	mapAggir(pclass, elist)
+	phaseStop('aggir mapping')
+
+	return elist
+
+# Funcion analyze
+# Detecta los problemas presentes en un script ya ingerido y los mapea
+# a las constantes AGGIR de cada persona
+# @args
+#    script: Ingestor con zonas, devices, personas y eventos del script
+#    main_door_room: puertas exteriores (zonas o ids, ver parseDoors), si el
+#                    script no da las suyas (atributo exteriorDoors)
+#    time_sim: hora de inicio de la simulacion
+#    cache: ResultCache incremental donde buscar y guardar los errores de
+#           cada situacion, o None
+# @returns
+#    Lista de errores detectados
+
+def analyze(script, main_door_room, time_sim, cache=None):
+	store = script.events
+
+	# Reloj simulado de todo el script
+	phaseStart('timeline')
+	clock = store.timeline(time_sim)
+	phaseStop('timeline')
+
+	# GENERANDO SITUACIONES
+	phaseStart('situations')
+	sranges = splitSituations(store)
+	phaseStop('situations')
+
+	# Las puertas exteriores del script tienen prioridad
+	if (script.exterior_doors is not None):
+		main_door_room = script.exterior_doors
+
+	days = DayBuckets(parseStartDay(script.date_sim), time_sim)
+	if (cache is not None and cache.incremental):
+		return evaluate(sranges, script.pclass, main_door_room, days, \
+			SituationCache(cache, script, clock, main_door_room))
+
+	# Los eventos de cada situacion se arman una sola vez, al analizarla
+	return evaluate(situationsOf(store, clock, sranges), script.pclass, main_door_room, days)
+
+# Procedimiento printReport
+# Imprime, por cada habitante, los problemas detectados y el valor de
+# sus constantes AGGIR
+# @args
+#    pclass: lista de instancias de personas
+#    elist: lista de errores detectados
+
+def printReport(pclass, elist):
+	printSummary(summarize(pclass, elist))
+
+# Procedimiento printSummary
+# Imprime un resumen de summarize (o de OnlineAnalyzer)
+# @args
+#    summary: lista de dicts por habitante
+
+def printSummary(summary):
+	for p in summary:
+		print('Inhabitant: %s\n' % (p['inhabitant']))
+		# Miramos si hay errores asociados al usuario
+		print('Detected problems: %s\n' % (p['problems']))
+		if (p['problems']):
+			for e in p['errors']:
+				print('  - %s' % e)
+			print('')
+		print('AGGIR variables value according to the analysis:\n')
+		for var in p['aggir']:
+			print('%s: %s' % (var, p['aggir'][var]))
+
+# Funcion summarize
+# Resume el resultado de un analisis por habitante
+# @args
+#    pclass: lista de instancias de personas
+#    elist: lista de errores detectados
+# @returns
+#    Lista de dicts con nombre, cantidad de problemas, errores sin
+#    repeticion y variables AGGIR de cada habitante
+
+def summarize(pclass, elist):
+	summary = []
+	for p in pclass:
+		errors_p = [x['error'] for x in elist if x['executer'] == p]
+		summary.append({'inhabitant': p.name, 'problems': len(errors_p), \
+			'errors': sorted(set(errors_p)), 'aggir': dict(p.aggir_const)})
+	return summary
+
+# Funcion executerName
+# Nombre de quien causo un error, tal como se reporta hacia afuera
+# @args
+#    executer: persona, nombre de la persona o None
+# @returns
+#    String o None
+
+def executerName(executer):
+	if (isinstance(executer, Person)):
+		return executer.name
+	return executer
+
+# Funcion errorRecords
+# Convierte la lista de errores a dicts serializables
+# @args
+#    elist: lista de errores detectados
+# @returns
+#    Lista de dicts con position, executer (nombre) y error
+
+def errorRecords(elist):
+	return [{'position': e['position'], 'executer': executerName(e['executer']), \
+		'error': e['error']} for e in elist]
+
+# Clase NdjsonWriter
+# Escribe resultados como NDJSON, un registro por linea, a medida que
+# se producen
+#
+# @attrs
+#    stream: archivo de salida
+#    errors: si se escribe ademas un registro por error
+
+class NdjsonWriter:
+
+	# Inicializador
+	def __init__(self, stream, errors=False):
+		self.stream = stream
+		self.errors = errors
+
+	# Escribe un registro
+	def write(self, record):
+		self.stream.write(json.dumps(record) + '\n')
+		self.stream.flush()
+
+	# Escribe los registros del analisis de un script
+	def writeResult(self, result):
+		if (result.get('failure') is not None):
+			self.write({'record': 'failure', 'script': result['script'], \
+				'failure': result['failure'], 'seconds': result['seconds']})
+			return
+		for i in result['inhabitants']:
+			record = {'record': 'inhabitant', 'script': result['script']}
+			record.update(i)
+			self.write(record)
+		if (self.errors):
+			for e in result['errors']:
+				record = {'record': 'error', 'script': result['script']}
+				record.update(e)
+				self.write(record)
+
+# Esquema de la base de resultados: una fila por analisis (runs), por
+# habitante, por error detectado y por variable AGGIR de cada habitante
+RESULTS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+	id INTEGER PRIMARY KEY,
+	script TEXT NOT NULL,
+	main_door_room TEXT,
+	analyzed_at TEXT NOT NULL,
+	seconds REAL,
+	version TEXT NOT NULL,
+	cached INTEGER,
+	failure TEXT
+);
+CREATE TABLE IF NOT EXISTS inhabitants (
+	run_id INTEGER NOT NULL REFERENCES runs(id),
+	number INTEGER NOT NULL,
+	name TEXT NOT NULL,
+	problems INTEGER NOT NULL,
+	PRIMARY KEY (run_id, number)
+);
+CREATE TABLE IF NOT EXISTS errors (
+	run_id INTEGER NOT NULL REFERENCES runs(id),
+	position INTEGER,
+	executer TEXT,
+	error TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS aggir_flags (
+	run_id INTEGER NOT NULL,
+	number INTEGER NOT NULL,
+	variable TEXT NOT NULL,
+	value INTEGER NOT NULL,
+	FOREIGN KEY (run_id, number) REFERENCES inhabitants(run_id, number)
+);
+CREATE INDEX IF NOT EXISTS runs_script ON runs(script);
+CREATE INDEX IF NOT EXISTS inhabitants_name ON inhabitants(name);
+CREATE INDEX IF NOT EXISTS errors_error ON errors(error);
+CREATE INDEX IF NOT EXISTS errors_executer ON errors(executer);
+CREATE INDEX IF NOT EXISTS errors_run ON errors(run_id);
+CREATE INDEX IF NOT EXISTS aggir_flags_inhabitant ON aggir_flags(run_id, number);
+'''
+
+# Clase SqliteWriter
+# Guarda resultados en una base SQLite, con la misma interfaz que
+# NdjsonWriter. La base usa WAL, asi los lectores no bloquean a quien
+# escribe, y cada analisis se escribe en una sola transaccion que toma el
+# lock de escritura al empezar (BEGIN IMMEDIATE), esperando hasta 'timeout'
+# segundos si otro proceso esta escribiendo
+#
+# @attrs
+#    connection: conexion a la base
+
+class SqliteWriter:
+
+	# Inicializador
+	def __init__(self, path, timeout=DEFAULT_DB_TIMEOUT):
+		# Sin transacciones implicitas, se abren a mano en writeResult
+		self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+		self.connection.execute('PRAGMA journal_mode=WAL')
+		self.connection.execute('PRAGMA synchronous=NORMAL')
+		self.connection.executescript(RESULTS_SCHEMA)
+
+	# Escribe el analisis de un script: el run, sus habitantes con sus
+	# variables AGGIR y sus errores
+	def writeResult(self, result):
+		cursor = self.connection.cursor()
+		cursor.execute('BEGIN IMMEDIATE')
+		try:
+			cursor.execute('INSERT INTO runs (script, main_door_room, analyzed_at, seconds, version, ' \
+				'cached, failure) VALUES (?, ?, ?, ?, ?, ?, ?)', (result['script'], \
+				result.get('main_door_room'), datetime.datetime.now(datetime.timezone.utc).isoformat(), \
+				result.get('seconds'), ANALYZER_VERSION, result.get('cached'), result.get('failure')))
+			run = cursor.lastrowid
+			inhabitants = result.get('inhabitants', [])
+			cursor.executemany('INSERT INTO inhabitants (run_id, number, name, problems) ' \
+				'VALUES (?, ?, ?, ?)', [(run, i, inhabitants[i]['inhabitant'], \
+				inhabitants[i]['problems']) for i in range(len(inhabitants))])
+			cursor.executemany('INSERT INTO aggir_flags (run_id, number, variable, value) ' \
+				'VALUES (?, ?, ?, ?)', [(run, i, var, int(bool(inhabitants[i]['aggir'][var]))) \
+				for i in range(len(inhabitants)) for var in inhabitants[i]['aggir']])
+			cursor.executemany('INSERT INTO errors (run_id, position, executer, error) ' \
+				'VALUES (?, ?, ?, ?)', [(run, e['position'], e['executer'], e['error']) \
+				for e in result.get('errors', [])])
+			cursor.execute('COMMIT')
+		except BaseException:
+			cursor.execute('ROLLBACK')
+			raise
+
+	# Cierra la conexion
+	def close(self):
+		self.connection.close()
+
+#################################
+# Cache de resultados           #
+#################################
+
+# Funcion analyzerFingerprint
+# Hash de lo que determina el resultado de un analisis ademas del script:
+# version y codigo del analizador, umbrales, constantes AGGIR y reglas
+# registradas
+# @returns
+#    Bytes
+
+def analyzerFingerprint():
+	h = hashlib.sha256()
+	h.update(ANALYZER_VERSION.encode())
+	with open(os.path.abspath(__file__), 'rb') as f:
+		h.update(f.read())
+	settings = [(name, globals()[name]) for name in THRESHOLDS]
+	settings.append(('AGGIR_CONST', AGGIR_CONST))
+	settings.append(('AGGIR_RULES', sorted(AGGIR_RULES.items())))
+	settings.append(('RULES', sorted([(t, str(p), [r.__module__ + '.' + r.__name__ for r in rules]) \
+		for t in RULES for p, rules in RULES[t].items()])))
+	h.update(repr(settings).encode())
+	return h.digest()
+
+# Clase ResultCache
+# Cache en disco de resultados de analisis, direccionada por contenido:
+# la clave es el hash del script, la zona con la puerta principal y
+# analyzerFingerprint, asi que cambiar cualquiera de ellos la invalida.
+# Cada entrada es un .json; la fecha de modificacion marca el ultimo uso
+# y las menos usadas se eliminan al superar el tamanio maximo (LRU). El
+# tamanio se lleva en memoria desde el ultimo recorrido de la carpeta, que
+# solo se vuelve a recorrer al superar el maximo
+#
+# @attrs
+#    directory: carpeta de la cache
+#    max_bytes: tamanio maximo de la cache en bytes
+#    size: tamanio estimado en bytes, None hasta recorrer la carpeta
+#    defer_evict: si la eviccion se deja para el final de la corrida, con
+#                 una llamada a evict (modo batch)
+#    fingerprint: analyzerFingerprint, calculado la primera vez
+#    incremental: si tambien se guardan y reusan los errores de cada
+#                 situacion (ver SituationCache)
+
+class ResultCache:
+
+	# Inicializador
+	def __init__(self, directory, max_bytes=DEFAULT_CACHE_SIZE * 1024 * 1024, incremental=False):
+		self.directory = directory
+		self.max_bytes = max_bytes
+		self.size = None
+		self.defer_evict = False
+		self.fingerprint = None
+		self.incremental = incremental
+
+	# Clave de un script dado su contenido
+	def key(self, data, main_door_room):
+		if (self.fingerprint is None):
+			self.fingerprint = analyzerFingerprint()
+		h = hashlib.sha256(self.fingerprint)
+		h.update(str(main_door_room).encode() + b'\0')
+		h.update(data)
+		return h.hexdigest()
+
+	# Ruta de la entrada de clave 'key'
+	def path(self, key):
+		return os.path.join(self.directory, key[:2], key + '.json')
+
+	# Retorna el resultado guardado con clave 'key', None si no esta
+	def get(self, key):
+		path = self.path(key)
+		try:
+			with open(path) as f:
+				result = json.load(f)
+			# Marcamos el uso para la eviccion LRU
+			os.utime(path)
+			return result
+		except (OSError, ValueError):
+			return None
+
+	# Guarda 'result' con clave 'key' y, salvo que 'evict' sea False,
+	# elimina las entradas menos usadas si la cache excede su tamanio
+	def put(self, key, result, evict=True):
+		path = self.path(key)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		# Escritura atomica, otros procesos pueden estar leyendo
+		tmp = '%s.%d.tmp' % (path, os.getpid())
+		with open(tmp, 'w') as f:
+			json.dump(result, f)
+		added = os.path.getsize(tmp)
+		try:
+			added -= os.path.getsize(path)
+		except OSError:
 			pass
-			#times_out = reduce((lambda x, y: x + y), times_out)
-			#print('Got out of house %d time(s)' % (times_out))
-		else:
-			if (total_time > datetime.timedelta(hours=24)):
-				# Hay un problema
-				executer = [x for x in pclass][0]
-				elist.append({'position': None, 'executer': executer.name, 'error': 'Never going out'})
+		os.replace(tmp, path)
+		if (self.size is not None):
+			self.size += added
+		if (evict):
+			self.trim()
+
+	# Elimina las entradas menos usadas si la cache excede su tamanio, o si
+	# aun no se recorrio la carpeta, salvo que se deje para el final
+	def trim(self):
+		if (self.defer_evict):
+			return
+		if (self.size is None or self.size > self.max_bytes):
+			self.evict()
+
+	# Lista de tuplas (ultimo uso, tamanio, ruta) de las entradas
+	def entries(self):
+		found = []
+		if (not os.path.isdir(self.directory)):
+			return found
+		for sub in os.scandir(self.directory):
+			if (not sub.is_dir()):
+				continue
+			for entry in os.scandir(sub.path):
+				if (entry.name.endswith('.json')):
+					try:
+						st = entry.stat()
+					except OSError:
+						continue
+					found.append((st.st_mtime, st.st_size, entry.path))
+		return found
+
+	# Recorre la carpeta y, si excede el tamanio maximo, elimina las entradas
+	# menos usadas hasta quedar en CACHE_EVICT_TO del maximo
+	def evict(self):
+		found = self.entries()
+		total = sum([x[1] for x in found])
+		self.size = total
+		if (total <= self.max_bytes):
+			return
+		found.sort()
+		target = self.max_bytes * CACHE_EVICT_TO
+		for mtime, size, path in found:
+			if (total <= target):
+				break
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+			total -= size
+		self.size = total
+
+	# Invalida la cache completa
+	# @returns
+	#    Cantidad de entradas eliminadas
+	def clear(self):
+		found = self.entries()
+		for mtime, size, path in found:
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+		self.size = 0
+		return len(found)
+
+# Clase SituationCache
+# Resultados de cada situacion guardados en una ResultCache, para que al
+# volver a analizar un script editado solo se armen y analicen las
+# situaciones que cambiaron. Por situacion se guardan sus errores y lo que
+# suma a los totales de la simulacion completa (situationTotals), con
+# posiciones y tiempos relativos a su inicio; los chequeos sobre la
+# simulacion completa se rehacen siempre. La clave de una situacion es el
+# hash de sus columnas del almacen, con posiciones relativas al primer
+# evento y los nombres de las personas, devices, zonas y textos que usa,
+# del valor de cada variable de zona al empezar y sus cambios durante la
+# situacion (aunque no generen eventos) y de lo comun a todo el script: analyzerFingerprint, hora de inicio, puertas exteriores,
+# habitantes y devices con su tipo y zona. Una situacion igual en otro
+# script (por ejemplo, una variante del mismo escenario) tambien se reusa.
+# Los habitantes se guardan como indice en pclass, el resto por nombre
+#
+# @attrs
+#    cache: ResultCache donde se guardan
+#    store: EventStore del script
+#    clock: timeline de todo el script
+#    zones: zonas del script
+#    pclass: habitantes del script
+#    persons: dict habitante -> indice en pclass
+#    context: hash de lo comun a todas las situaciones del script
+#    hits: situaciones reusadas
+#    misses: situaciones analizadas
+
+class SituationCache:
 
-		# MAPEO DE ERRORES EN SIMULACION CON LAS CONSTANTES AGGIR
+	# Inicializador
+	def __init__(self, cache, script, clock, main_door_room):
+		self.cache = cache
+		self.store = script.events
+		self.clock = clock
+		self.zones = script.zclass
+		self.pclass = script.pclass
+		self.persons = {}
+		for i in range(len(self.pclass)):
+			self.persons[self.pclass[i]] = i
+		# Los umbrales pueden cambiar entre analisis (modo serve)
+		h = hashlib.sha256(analyzerFingerprint())
+		h.update(repr(clock.start).encode())
+		h.update(repr(sorted(parseDoors(main_door_room))).encode())
+		h.update(repr([(p.name, p.type_name) for p in self.pclass]).encode())
+		h.update(repr([(d.name, d.type_name, d.zones[0]['zone'].name if d.zones else None) \
+			for d in script.dclass]).encode())
+		self.context = h.digest()
+		self.hits = 0
+		self.misses = 0
+
+	# Clave de la situacion de indices [start, end) del almacen
+	def key(self, start, end):
+		store = self.store
+		base = store.position[start]
+		last = store.position[end - 1]
+		h = hashlib.sha256(self.context)
+		# Valor de cada variable de zona al empezar y sus cambios durante la
+		# situacion, aunque no generen eventos (zonas sin nadie)
+		for z in self.zones:
+			for var in sorted(z.series):
+				series = z.series[var]
+				i = series.index(base) + 1
+				j = series.index(last) + 1
+				h.update(repr((z.name, var, series.at(base), [p - base for p in series.positions[i:j]], \
+					series.values[i:j].tobytes())).encode())
+		h.update(array.array('q', [p - base for p in store.position[start:end]]).tobytes())
+		for column in (store.kind, store.value, store.seconds):
+			h.update(column[start:end].tobytes())
+		# Los indices a refs y symbols dependen del script, se agregan sus nombres
+		for column in (store.executer, store.device, store.zone):
+			used = column[start:end]
+			h.update(used.tobytes())
+			h.update(repr([(i, type(store.refs[i]).__name__, store.refs[i].name) \
+				for i in sorted(set(used)) if i >= 0]).encode())
+		used = store.symbol[start:end]
+		h.update(used.tobytes())
+		h.update(repr([(i, store.symbols[i]) for i in sorted(set(used))]).encode())
+		return h.hexdigest()
+
+	# Quien causo un error o una ocurrencia, tal como se guarda
+	def dump(self, executer):
+		return self.persons.get(executer, executerName(executer))
+
+	# Quien causo un error o una ocurrencia, a partir de lo guardado
+	def load(self, executer):
+		return self.pclass[executer] if isinstance(executer, int) else executer
+
+	# Analiza la situacion de indices [start, end) del almacen
+	# @returns
+	#    Dict con errors (lista de [posicion relativa, executer, error]) y
+	#    totals (situationTotals)
+	def analyze(self, start, end, pclass, main_door_room, elist):
+		s = Situation(self.store.views(start, end))
+		base = s.get_first_event().position
+		ctx = SituationContext(s, self.clock.window(base, s.get_last_event().position), \
+			[], main_door_room)
+		analyzeSituation(ctx, pclass)
+		elist.extend(ctx.errors)
+		totals = situationTotals(ctx)
+		for c in totals['counts']:
+			c[1] = self.dump(c[1])
+		return {'errors': [[None if e['position'] is None else e['position'] - base, \
+			self.dump(e['executer']), e['error']] for e in ctx.errors], 'totals': totals}
+
+	# Aplica las reglas a las situaciones de rangos 'sranges', reusando las
+	# guardadas, y suma cada una a 'totals'
+	# @args
+	#    sranges: rangos de splitSituations
+	#    pclass: lista de instancias de personas
+	#    main_door_room: puertas exteriores (zonas o ids, ver parseDoors)
+	#    elist: lista de errores al cual aniadir los de cada situacion
+	#    totals: SimulationTotals de la simulacion completa
+	def evaluate(self, sranges, pclass, main_door_room, elist, totals):
+		for start, end in sranges:
+			key = self.key(start, end)
+			found = self.cache.get(key)
+			if (found is None):
+				self.misses += 1
+				found = self.analyze(start, end, pclass, main_door_room, elist)
+				self.cache.put(key, found, evict=False)
+			else:
+				self.hits += 1
+				base = self.store.position[start]
+				for position, executer, error in found['errors']:
+					elist.append({'position': None if position is None else base + position, \
+						'executer': self.load(executer), 'error': error})
+			part = found['totals']
+			part['counts'] = [[counter, self.load(person), times] for counter, person, times in part['counts']]
+			totals.addPart(part)
+		# Se eliminan las entradas menos usadas una vez por script
+		if (self.misses):
+			self.cache.trim()
+
+# Funcion analyzeScript
+# Analiza un script, consultando antes la cache si se da una
+# @args
+#    path: ruta del script, o 'archivo!miembro'
+#    main_door_room: puertas exteriores (zonas o ids, ver parseDoors)
+#    cache: ResultCache o None
+#    data: contenido ya leido del script (posiblemente comprimido), o None
+# @returns
+#    Dict con inhabitants (summarize), errors (errorRecords), timed
+#    (si el script da hora de inicio) y cached (si vino de la cache)
+
+def analyzeScript(path, main_door_room, cache=None, data=None):
+	if (data is not None or cache is not None):
+		# La clave es el contenido descomprimido
+		data = readScript(path, data)
+	if (cache is not None):
+		key = cache.key(data, main_door_room)
+		result = cache.get(key)
+		if (result is not None):
+			result['cached'] = True
+			return result
+
+	if (data is not None):
+		script = ingestScript(io.BytesIO(data))
+	else:
+		script = loadScript(path)
+	time_sim = script.time_sim
+	if (time_sim is None):
+		time_sim = datetime.timedelta(0)
+	elist = analyze(script, main_door_room, time_sim, cache)
+	result = {'inhabitants': summarize(script.pclass, elist), 'errors': errorRecords(elist), \
+		'timed': script.time_sim is not None}
+	if (cache is not None):
+		cache.put(key, result)
+	result['cached'] = False
+	return result
 
-		for e in elist:
-			for p in pclass:
-				# Asocio errores con su executer
-				if (e['executer'] == p):
-					if (e['error'] == 'FloodSensor detected a problem'):
-						# Bad housekeeping
-						p.aggir_const['HOUSEKEEPING'] = False
-						# Dificultad de movimiento
-						p.aggir_const['TRANSFERS'] = False
-						# Problemas con movimientos dentro de casa
-						p.aggir_const['IN_MOVEMENTS'] = False
-						# Bad coherence
-						p.aggir_const['COHERENCE'] = False
-					elif (e['error'] == 'DimmerLight exceeded MAX time ON'):
-						# Mal housekeeping
-						p.aggir_const['HOUSEKEEPING'] = False
-						# Location
-						p.aggir_const['LOCATION'] = False
-						# Bad coherence
-						p.aggir_const['COHERENCE'] = False
-					elif (e['error'] == 'BinaryLight exceeded MAX time ON'):
-						# Mal housekeeping
-						p.aggir_const['HOUSEKEEPING'] = False
-						# Location
-						p.aggir_const['LOCATION'] = False
-						# Bad coherence
-						p.aggir_const['COHERENCE'] = False
-					elif (e['error'] == 'Heater exceeded MAX time ON'):
-						# Bad housekeeping
-						p.aggir_const['HOUSEKEEPING'] = False
-						# Bad location
-						p.aggir_const['LOCATION'] = False
-						# Bad coherence
-						p.aggir_const['COHERENCE'] = False
-					elif (e['error'] == 'Cooler exceeded MAX time ON'):
-						# Bad housekeeping
-						p.aggir_const['HOUSEKEEPING'] = False
-						# Bad location
-						p.aggir_const['LOCATION'] = False
-						# Bad coherence
-						p.aggir_const['COHERENCE'] = False
-					elif (e['error'] == 'Not getting out of room for much time'):
-						# Bad location
-						p.aggir_const['LOCATION'] = False
-						# Bad housekeeping
-						p.aggir_const['HOUSEKEEPING'] = False
-						# Bad elimination
-						p.aggir_const['ELIMINATION'] = False
-						# Bad leisure
-						p.aggir_const['LEISURE_ACTS'] = False
-						# Bad alimentation
-						p.aggir_const['ALIMENTATION'] = False
-						# Bad coherence
-						p.aggir_const['COHERENCE'] = False
-					elif (e['error'] == 'Possible accident in BATHROOM'):
-						# Bad location
-						p.aggir_const['LOCATION'] = False
-						# Bad coherence
-						p.aggir_const['COHERENCE'] = False
-						# Bad transfers
-						p.aggir_const['TRANSFERS'] = False
-						# Bad houseleeping
-						p.aggir_const['HOUSEKEEPING'] = False
-					elif (e['error'] == 'Possible accident in LIVING ROOM'):
-						# Bad location
-						p.aggir_const['LOCATION'] = False
-						# Bad coherence
-						p.aggir_const['COHERENCE'] = False
-						# Bad transfers
-						p.aggir_const['TRANSFERS'] = False
-						# Bad houseleeping
-						p.aggir_const['HOUSEKEEPING'] = False
-					elif (e['error'] == 'Possible accident in KITCHEN'):
-						# Bad location
-						p.aggir_const['LOCATION'] = False
-						# Bad coherence
-						p.aggir_const['COHERENCE'] = False
-						# Bad transfers
-						p.aggir_const['TRANSFERS'] = False
-						# Bad houseleeping
-						p.aggir_const['HOUSEKEEPING'] = False
-					elif (e['error'] == 'Possible accident in HALLWAY'):
-						# Bad location
-						p.aggir_const['LOCATION'] = False
-						# Bad coherence
-						p.aggir_const['COHERENCE'] = False
-						# Bad transfers
-						p.aggir_const['TRANSFERS'] = False
-						# Bad houseleeping
-						p.aggir_const['HOUSEKEEPING'] = False
-					elif (e['error'] == 'Heater on when no needed'):
-						# Bad housekeeping
-						p.aggir_const['HOUSEKEEPING'] = False
-						# Bad location
-						p.aggir_const['LOCATION'] = False
-						# Bad coherence
-						p.aggir_const['COHERENCE'] = False
-					elif (e['error'] == 'Cooler on when no needed'):
-						# Bad housekeeping
-						p.aggir_const['HOUSEKEEPING'] = False
-						# Bad location
-						p.aggir_const['LOCATION'] = False
-						# Bad coherence
-						p.aggir_const['COHERENCE'] = False
-					elif (e['error'] == 'HIGH CO CONCENTRATION'):
-						# Bad housekeeping
-						p.aggir_const['HOUSEKEEPING'] = False
-					elif (e['error'] == 'HIGH CO2 CONCENTRATION'):
-						# Bad housekeeping
-						p.aggir_const['HOUSEKEEPING'] = False
-					elif (e['error'] == 'Main door LET OPENED for much time'):
-						# Bad location
-						p.aggir_const['LOCATION'] = False
-						# Bad coherence
-						p.aggir_const['COHERENCE'] = False
-						# Bad housekeeping
-						p.aggir_const['HOUSEKEEPING'] = False
-					elif (e['error'] == 'SIREN RINGING'):
-						# Bad housekeeping
-						p.aggir_const['HOUSEKEEPING'] = False
-					elif (e['error'] == 'Irregular micturating time'):
-						# Bad elimination
-						p.aggir_const['ELIMINATION'] = False
-						# Bad toileting
-						p.aggir_const['TOILETING'] = False
-						# Bad alimentation
-						p.aggir_const['ALIMENTATION'] = False
-						# Bad transfers
-						p.aggir_const['TRANSFERS'] = False
-					elif (e['error'] == 'Never going out of house'):
-						# Bad transfers
-						p.aggir_const['TRANSFERS'] = False
-						# Bad coherence
-						p.aggir_const['COHERENCE'] = False
-						# Bad housekeeping
-						p.aggir_const['HOUSEKEEPING'] = False
-						# Bad shopping
-						p.aggir_const['PURCHASES'] = False
-						# Bad leisure
-						p.aggir_const['LEISURE_ACTS'] = False
-					elif (e['error'] == 'Not changing clothes'):
-						# Bad dressing
-						p.aggir_const['DRESSING'] = False
-						# Bad coherence
-						p.aggir_const['COHERENCE'] = False
-						# Bad toileting
-						p.aggir_const['TOILETING'] = False
-					elif (e['error'] == 'Lights on at wrong time'):
-						# Bad housekeeping
-						p.aggir_const['HOUSEKEEPING'] = False
-						# Bad location
-						p.aggir_const['LOCATION'] = False
-						# Bad coherence
-						p.aggir_const['COHERENCE'] = False
-					elif (e['error'] == 'Wandering around at wrong time'):
-						# Bad location
-						p.aggir_const['LOCATION'] = False
-						# Bad coherence
-						p.aggir_const['COHERENCE'] = False
-					elif (e['error'] == 'Abandoning kitchen while cooking'):
-						# Bad location
-						p.aggir_const['LOCATION'] = False
-						# Bad coherence
-						p.aggir_const['COHERENCE'] = False
-						# Bad houseleeping
-						p.aggir_const['HOUSEKEEPING'] = False
+#################################
+# Barrido de umbrales           #
+#################################
 
-		# Devolvemos respuesta
+# Funcion parseThreshold
+# Convierte el valor dado para un umbral al tipo de su valor actual
+# @args
+#    name: nombre del umbral (uno de THRESHOLDS)
+#    value: valor leido del archivo de configuracion. Para tiempos,
+#           'H:MM:SS' o un numero con unidad 's', 'm' u 'h' ('90m');
+#           para horas del dia, 'HH:MM:SS'
+# @returns
+#    Valor del umbral
+
+def parseThreshold(name, value):
+	if (name not in THRESHOLDS):
+		raise ValueError('unknown threshold %s' % name)
+	current = globals()[name]
+	if (isinstance(current, datetime.timedelta)):
+		if (isinstance(value, (int, float))):
+			return datetime.timedelta(seconds=value)
+		if (':' in value):
+			h, m, sec = value.split(':')
+			return datetime.timedelta(hours=int(h), minutes=int(m), seconds=int(sec))
+		return delayValue(value[:-1], value[-1])
+	elif (isinstance(current, datetime.time)):
+		h, m, sec = value.split(':')
+		return datetime.time(int(h), int(m), int(sec))
+	elif (isinstance(current, (int, float))):
+		return type(current)(value)
+	return value
+
+# Funcion loadGrid
+# Lee la grilla de umbrales de un archivo JSON: un dict umbral -> lista de
+# valores (se prueban todas las combinaciones) o una lista de dicts
+# umbral -> valor (se prueba cada uno)
+# @args
+#    path: ruta del archivo
+# @returns
+#    Lista de dicts umbral -> valor ya convertido
+
+def loadGrid(path):
+	with open(path) as f:
+		config = json.load(f)
+	if (isinstance(config, dict)):
+		grid = [{}]
+		for name in config:
+			values = config[name] if isinstance(config[name], list) else [config[name]]
+			grid = [dict(g, **{name: v}) for g in grid for v in values]
+	else:
+		grid = config
+	return [{name: parseThreshold(name, g[name]) for name in g} for g in grid]
+
+# Funcion applyThresholds
+# Cambia los umbrales del modulo
+# @args
+#    settings: dict umbral -> valor
+# @returns
+#    Dict umbral -> valor anterior, para restaurarlos
+
+def applyThresholds(settings):
+	previous = {}
+	for name in settings:
+		previous[name] = globals()[name]
+		globals()[name] = settings[name]
+	return previous
+
+# Funcion sweep
+# Analiza un script ya ingerido con cada juego de umbrales de la grilla.
+# El reloj y las situaciones se arman una sola vez y se reusan
+# @args
+#    script: Ingestor con zonas, devices, personas y eventos del script
+#    main_door_room: puertas exteriores (zonas o ids, ver parseDoors), si el
+#                    script no da las suyas (atributo exteriorDoors)
+#    time_sim: hora de inicio de la simulacion
+#    grid: lista de dicts umbral -> valor, de loadGrid
+# @returns
+#    Lista de dicts con setting y, por habitante, cantidad de cada error y
+#    variables AGGIR
+
+def sweep(script, main_door_room, time_sim, grid):
+	store = script.events
+	pclass = script.pclass
+	clock = store.timeline(time_sim)
+	if (script.exterior_doors is not None):
+		main_door_room = script.exterior_doors
+	situations = list(situationsOf(store, clock, splitSituations(store)))
+
+	results = []
+	for settings in grid:
+		# Cada juego parte de las constantes AGGIR iniciales
 		for p in pclass:
-			print('Inhabitant: %s\n' % (p))
-			# Miramos si hay errores asociados al usuario
-			errors_p = [x for x in elist if x['executer'] == p]
-			if (errors_p):
-				print('Detected problems: %s\n' % (len(errors_p)))
-				no_repetition_elist = [x['error'] for x in errors_p]
-				no_repetition_elist = list(set(no_repetition_elist))
-				for e in no_repetition_elist:
-					print('  - %s' % e)
-				print('')
+			p.aggir_const = dict(AGGIR_CONST)
+		previous = applyThresholds(settings)
+		try:
+			elist = evaluate(situations, pclass, main_door_room, \
+				DayBuckets(parseStartDay(script.date_sim), time_sim))
+		finally:
+			applyThresholds(previous)
+		inhabitants = []
+		for p in pclass:
+			counts = {}
+			for e in elist:
+				if (e['executer'] == p):
+					counts[e['error']] = counts.get(e['error'], 0) + 1
+			inhabitants.append({'inhabitant': p.name, 'errors': counts, 'aggir': dict(p.aggir_const)})
+		results.append({'setting': settings, 'inhabitants': inhabitants})
+	return results
+
+# Procedimiento printSweep
+# Imprime los resultados de un barrido como tabla: por habitante, una fila
+# por error con su cantidad en cada juego de umbrales, y una por variable
+# AGGIR que queda en False en alguno
+# @args
+#    results: resultados de sweep
+
+def printSweep(results):
+	print('Settings:\n')
+	for i in range(len(results)):
+		setting = results[i]['setting']
+		print('%4d: %s' % (i + 1, ' '.join(['%s=%s' % (k, setting[k]) for k in setting])))
+	print('')
+	if (not results):
+		return
+	for n in range(len(results[0]['inhabitants'])):
+		rows = [r['inhabitants'][n] for r in results]
+		print('Inhabitant: %s\n' % rows[0]['inhabitant'])
+		errors = sorted(set([e for r in rows for e in r['errors']]))
+		aggir = [v for v in rows[0]['aggir'] if [r for r in rows if not r['aggir'][v]]]
+		labels = errors + ['AGGIR %s' % v for v in aggir]
+		width = max([len(l) for l in labels] + [10])
+		print('%s %s' % (' ' * width, ' '.join(['%4d' % (i + 1) for i in range(len(rows))])))
+		for e in errors:
+			print('%s %s' % (e.ljust(width), ' '.join(['%4d' % r['errors'].get(e, 0) for r in rows])))
+		for v in aggir:
+			print('%s %s' % (('AGGIR %s' % v).ljust(width), \
+				' '.join(['%4s' % ('T' if r['aggir'][v] else 'F') for r in rows])))
+		print('')
+
+# Funcion sweepMain
+# Punto de entrada del modo sweep
+# @args
+#    argv: argumentos luego de 'sweep'
+# @returns
+#    Int, codigo de salida
+
+def sweepMain(argv):
+	parser = argparse.ArgumentParser(prog='analyzer.py sweep', \
+		description='Analyze one iCasa script with each set of thresholds of a grid.')
+	parser.add_argument('input_file')
+	parser.add_argument('main_door_room')
+	parser.add_argument('grid', help="JSON file: {threshold: [values]} or [{threshold: value}]")
+	parser.add_argument('--format', choices=['text', 'ndjson'], default='text')
+	parser.add_argument('--output', default=None, help='write to this file instead of stdout')
+	args = parser.parse_args(argv)
+
+	try:
+		grid = loadGrid(args.grid)
+	except (OSError, ValueError, KeyError) as exc:
+		parser.error('bad grid %s: %s' % (args.grid, exc))
+
+	script = loadScript(args.input_file)
+	time_sim = script.time_sim
+	if (time_sim is None):
+		time_sim = datetime.timedelta(0)
+	results = sweep(script, args.main_door_room, time_sim, grid)
+
+	out = open(args.output, 'w') if args.output else sys.stdout
+	try:
+		if (args.format == 'ndjson'):
+			writer = NdjsonWriter(out)
+			for i in range(len(results)):
+				setting = results[i]['setting']
+				for inhabitant in results[i]['inhabitants']:
+					record = {'record': 'sweep', 'script': args.input_file, 'setting': i + 1, \
+						'thresholds': {k: str(setting[k]) for k in setting}}
+					record.update(inhabitant)
+					writer.write(record)
+		else:
+			with redirect_stdout(out):
+				printSweep(results)
+	finally:
+		if (out is not sys.stdout):
+			out.close()
+	return 0
+
+#################################
+# Analisis en linea             #
+#################################
+
+# Funcion streamActions
+# Lee un script de forma incremental, linea a linea, a medida que se
+# escribe. La primera tupla es la raiz (behavior), el resto las acciones
+# @args
+#    stream: archivo de texto abierto (puede ser sys.stdin)
+#    follow: si al llegar al final del archivo se espera a que crezca
+#            hasta que se cierre la raiz
+#    interval: segundos de espera entre lecturas en modo follow
+# @returns
+#    Generador de tuplas (tag, attrib)
+
+def streamActions(stream, follow=False, interval=0.5):
+	parser = ET.XMLPullParser(events=('start', 'end'))
+	depth = 0
+	root = None
+	while (True):
+		line = stream.readline()
+		if (not line):
+			if (follow and (root is None or depth > 0)):
+				time.sleep(interval)
+				continue
+			break
+		parser.feed(line)
+		for event, elem in parser.read_events():
+			if (event == 'start'):
+				depth += 1
+				if (depth == 1):
+					root = elem
+					yield (elem.tag, dict(elem.attrib))
+			else:
+				depth -= 1
+				if (depth == 1):
+					yield (elem.tag, dict(elem.attrib))
+					# Liberamos la accion ya consumida
+					elem.clear()
+					root.clear()
+		if (root is not None and depth == 0):
+			break
+	parser.close()
+
+# Clase OnlineAnalyzer
+# Analiza un script a medida que llegan sus acciones. Las reglas
+# inmediatas (IMMEDIATE_RULES) se aplican apenas llega su evento, el
+# resto cuando un delay de cero segundos cierra la situacion. Solo se
+# guardan los eventos de la situacion en curso y, de cada variable de
+# zona, su valor vigente y los cambios de la situacion en curso. Los
+# eventos sin ocupante se atribuyen con las personas de ese momento (ver
+# resolve), no con las del script completo
+#
+# @attrs
+#    ingestor: Ingestor sin historial que construye entidades y eventos
+#    main_door_room: puertas exteriores (zonas o ids, ver parseDoors)
+#    emit: funcion llamada con cada error apenas se detecta
+#    time_sim: hora de inicio de la simulacion
+#    current: eventos de la situacion en curso
+#    checked: posiciones de los eventos de la situacion en curso a los que
+#             ya se aplicaron las reglas inmediatas
+#    first: primer evento del script
+#    totals: totales de la simulacion completa
+#    found: lista de errores detectados por persona, en orden de pclass
+
+class OnlineAnalyzer:
+
+	# Inicializador
+	def __init__(self, main_door_room, emit):
+		self.ingestor = Ingestor(history=False)
+		self.main_door_room = main_door_room
+		self.emit = emit
+		self.time_sim = datetime.timedelta(0)
+		self.current = []
+		self.checked = set()
+		self.first = None
+		self.totals = SimulationTotals()
+		self.found = []
+
+	# Lee los atributos de la raiz (behavior) del script
+	def start(self, attrib):
+		self.ingestor.start(attrib)
+		if (self.ingestor.time_sim is not None):
+			self.time_sim = self.ingestor.time_sim
+		self.totals.days = DayBuckets(parseStartDay(self.ingestor.date_sim), self.time_sim)
+		if (self.ingestor.exterior_doors is not None):
+			self.main_door_room = self.ingestor.exterior_doors
+
+	# Consume la siguiente accion del script
+	def feed(self, tag, attrib):
+		self.ingestor.feed(tag, attrib)
+		events = self.ingestor.events.views()
+		self.ingestor.events.clear()
+		# Sus indices ya no son validos, se resuelven al cerrar la situacion
+		self.ingestor.pending = []
+		for e in events:
+			if (self.first is None):
+				self.first = e
+			if (isinstance(e, TimeEvent) and e.seconds == 0 and e.unit == 's'):
+				self.closeSituation()
+			else:
+				self.current.append(e)
+				if (isinstance(e, PropertyChangingEvent) and self.ingestor.pclass):
+					self.resolve(e)
+					ctx = SituationContext(Situation([e]), None, [], self.main_door_room)
+					dispatchRules(ctx, e, True)
+					self.checked.add(e.position)
+					self.report(ctx.errors)
+
+	# Consume un iterador de tuplas (tag, attrib) cuya primera tupla es
+	# la raiz, como los de streamActions, y retorna el resumen final
+	def consume(self, actions):
+		for tag, attrib in actions:
+			self.start(attrib)
+			break
+		for tag, attrib in actions:
+			self.feed(tag, attrib)
+		return self.finish()
+
+	# Asigna el unico habitante a un evento sin ocupante en su zona. A
+	# diferencia de Ingestor.finish, que usa la cantidad final de personas,
+	# se usa la de ese momento: no se sabe si el script creara otra, y los
+	# errores ya emitidos no se pueden reasignar
+	def resolve(self, e):
+		if (e.executer is None and len(self.ingestor.pclass) == 1):
+			e.executer = self.ingestor.pclass[0]
+
+	# Analiza la situacion en curso con las reglas que no son inmediatas, y
+	# con las inmediatas los eventos que llegaron antes de haber personas
+	def closeSituation(self):
+		pclass = self.ingestor.pclass
+		events = self.current
+		checked = self.checked
+		self.current = []
+		self.checked = set()
+		# Sin personas solo quedan los delays
+		if (not pclass):
+			events = [e for e in events if isinstance(e, TimeEvent)]
+		for e in events:
+			if (isinstance(e, PropertyChangingEvent)):
+				self.resolve(e)
+		if (not events):
+			self.forgetSeries()
+			return
+		# Los delays se asocian con el executer del primer evento del script
+		for e in events:
+			if (isinstance(e, TimeEvent) and e.position > self.first.position):
+				e.executer = self.first.executer
+
+		s = Situation(events)
+		# Reloj de la situacion, equivalente a la ventana del analisis completo
+		sclock = Timeline(events, self.time_sim)
+		ctx = SituationContext(s, sclock, [], self.main_door_room)
+		for e in events:
+			if (isinstance(e, PropertyChangingEvent) and e.position not in checked):
+				dispatchRules(ctx, e, True)
+		analyzeSituation(ctx, pclass, False)
+		self.totals.addSituation(ctx)
+		self.forgetSeries()
+		self.report(ctx.errors)
+
+	# Deja en la serie de cada variable de zona solo su valor vigente: las
+	# situaciones siguientes no consultan posiciones anteriores
+	def forgetSeries(self):
+		for z in self.ingestor.zclass:
+			for series in z.series.values():
+				series.keepLast()
+
+	# Mapea a AGGIR, acumula y emite los errores 'elist'
+	def report(self, elist):
+		pclass = self.ingestor.pclass
+		while (len(self.found) < len(pclass)):
+			self.found.append([])
+		for error in elist:
+			mapAggir(pclass, [error])
+			for i in range(len(pclass)):
+				if (error['executer'] == pclass[i]):
+					self.found[i].append(error['error'])
+			self.emit(error)
+
+	# Resumen por habitante de lo detectado hasta ahora, como summarize
+	def summary(self):
+		pclass = self.ingestor.pclass
+		self.report([])
+		return [{'inhabitant': pclass[i].name, 'problems': len(self.found[i]), \
+			'errors': sorted(set(self.found[i])), 'aggir': dict(pclass[i].aggir_const)} \
+			for i in range(len(pclass))]
+
+	# Cierra el analisis con los chequeos sobre la simulacion completa.
+	# Las acciones luego del ultimo delay de cero segundos se descartan,
+	# como en el analisis completo
+	# @returns
+	#    Resumen por habitante
+	def finish(self):
+		elist = []
+		self.totals.check(self.ingestor.pclass, elist)
+		self.report(elist)
+		return self.summary()
+
+# Funcion watchMain
+# Punto de entrada del modo watch: analiza un script a medida que se
+# escribe, reportando cada problema al detectarlo
+# @args
+#    argv: argumentos luego de 'watch'
+# @returns
+#    Int, codigo de salida
+
+def watchMain(argv):
+	parser = argparse.ArgumentParser(prog='analyzer.py watch', \
+		description='Analyze an iCasa script while it is being written.')
+	parser.add_argument('input_file', help="script, or '-' for stdin")
+	parser.add_argument('main_door_room')
+	parser.add_argument('--follow', action='store_true', \
+		help='at end of file, wait for more actions until the script is closed')
+	parser.add_argument('--format', choices=['text', 'ndjson'], default='text')
+	args = parser.parse_args(argv)
+
+	streams = ExitStack()
+	if (args.input_file == '-'):
+		stream = sys.stdin
+	else:
+		stream = streams.enter_context(openScript(args.input_file))
+	writer = NdjsonWriter(sys.stdout) if args.format == 'ndjson' else None
+
+	# Cada problema se reporta apenas se detecta
+	def emit(error):
+		record = errorRecords([error])[0]
+		if (writer is not None):
+			record.update({'record': 'error', 'script': args.input_file})
+			record = {k: record[k] for k in ['record', 'script', 'position', 'executer', 'error']}
+			writer.write(record)
+		else:
+			print('Problem at action %s (%s): %s' % (record['position'], \
+				record['executer'], record['error']))
+			sys.stdout.flush()
+
+	online = OnlineAnalyzer(args.main_door_room, emit)
+	try:
+		actions = streamActions(stream, args.follow)
+		for tag, attrib in actions:
+			online.start(attrib)
+			if (online.ingestor.time_sim is None):
+				notice = sys.stderr if writer is not None else sys.stdout
+				print('No starting time given. Setting default: 00:00:00', file=notice)
+			break
+		for tag, attrib in actions:
+			online.feed(tag, attrib)
+		summary = online.finish()
+	finally:
+		streams.close()
+
+	if (writer is not None):
+		writer.writeResult({'script': args.input_file, 'inhabitants': summary, 'errors': []})
+	else:
+		print('')
+		printSummary(summary)
+	return 0
+
+#################################
+# Lotes                         #
+#################################
+
+# Funcion analyzeFile
+# Analiza un script dentro de un worker del modo batch. Nunca lanza
+# excepciones, las fallas quedan registradas en el resultado
+# @args
+#    job: tupla (ruta del script, zona con la puerta principal), con el
+#         contenido del script como tercer elemento si ya se leyo
+#    cache: ResultCache o None
+# @returns
+#    Dict con script, zona, tiempo de analisis, resumen, si vino de la
+#    cache (None si fallo) y error
+
+def analyzeFile(job, cache=None):
+	path, main_door_room = job[0], job[1]
+	data = job[2] if len(job) > 2 else None
+	result = {'script': path, 'main_door_room': main_door_room, \
+		'seconds': 0.0, 'inhabitants': [], 'errors': [], 'cached': None, 'failure': None}
+	started = time.perf_counter()
+	try:
+		analysis = analyzeScript(path, main_door_room, cache, data)
+		result['inhabitants'] = analysis['inhabitants']
+		result['errors'] = analysis['errors']
+		result['cached'] = analysis['cached']
+	except Exception as exc:
+		result['failure'] = '%s: %s' % (type(exc).__name__, exc)
+	result['seconds'] = time.perf_counter() - started
+	return result
+
+# Funcion analyzeChunk
+# Analiza en un worker un grupo de trabajos del modo batch
+# @args
+#    chunk: lista de trabajos (ver analyzeFile)
+#    cache: ResultCache o None
+# @returns
+#    Lista de resultados de analyzeFile
+
+def analyzeChunk(chunk, cache=None):
+	return [analyzeFile(job, cache) for job in chunk]
+
+# Funcion readManifest
+# Lee un manifiesto del modo batch
+# @args
+#    manifest: ruta a un archivo con lineas 'script zona'
+#    main_door_room: zona por defecto con la puerta principal
+# @returns
+#    Lista de tuplas (ruta del script, zona con la puerta principal)
+
+def readManifest(manifest, main_door_room):
+	entries = []
+	base = os.path.dirname(manifest)
+	with open(manifest) as f:
+		for line in f:
+			line = line.split('#')[0].strip()
+			if (not line):
+				continue
+			fields = line.split()
+			room = fields[1] if len(fields) > 1 else main_door_room
+			entries.append((os.path.join(base, fields[0]), room))
+	return entries
+
+# Funcion collectJobs
+# Genera los trabajos del modo batch a partir de rutas, globs, directorios
+# (sus scripts, comprimidos o no), archivos tar y zip (sus scripts, a medida
+# que se piden) y las entradas de un manifiesto
+# @args
+#    paths: lista de rutas, globs o directorios
+#    main_door_room: zona por defecto con la puerta principal
+#    entries: lista de tuplas (ruta, zona) de readManifest
+# @returns
+#    Generador de trabajos (ver analyzeFile)
+
+def collectJobs(paths, main_door_room, entries=()):
+	found = []
+	for path in paths:
+		if (os.path.isdir(path)):
+			scripts = []
+			for pattern in DIRECTORY_PATTERNS:
+				scripts += glob.glob(os.path.join(path, '**', pattern), recursive=True)
+			found += [(f, main_door_room) for f in sorted(scripts)]
+		else:
+			found += [(f, main_door_room) for f in sorted(glob.glob(path)) or [path]]
+	for path, room in itertools.chain(found, entries):
+		if (isArchive(path) and os.path.isfile(path)):
+			for member, data in archiveMembers(path):
+				if (data is None):
+					yield (member, room)
+				else:
+					yield (member, room, data)
+		else:
+			yield (path, room)
+
+# Funcion runBatch
+# Reparte los trabajos en un pool de procesos. Los trabajos se piden a
+# medida que hay lugar, con a lo sumo dos grupos por worker en curso
+# @args
+#    jobs: iterable de trabajos (ver analyzeFile)
+#    workers: cantidad de procesos (None para usar todos los cpus)
+#    chunksize: trabajos enviados a un worker de una vez
+#    cache: ResultCache compartida por los workers, o None
+# @returns
+#    Generador de resultados de analyzeFile, en el orden de jobs
+
+def runBatch(jobs, workers=None, chunksize=8, cache=None):
+	if (workers == 1):
+		for job in jobs:
+			yield analyzeFile(job, cache)
+		return
+	work = functools.partial(analyzeChunk, cache=cache)
+	jobs = iter(jobs)
+	limit = 2 * (workers or os.cpu_count() or 1)
+	pending = collections.deque()
+	with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+		while (True):
+			while (len(pending) < limit):
+				chunk = list(itertools.islice(jobs, chunksize))
+				if (not chunk):
+					break
+				pending.append(executor.submit(work, chunk))
+			if (not pending):
+				break
+			for result in pending.popleft().result():
+				yield result
+
+# Funcion newTotals
+# Totales vacios de un lote
+# @returns
+#    Dict con totales de scripts, fallas, tiempo, errores y flags AGGIR
+
+def newTotals():
+	return {'scripts': 0, 'failures': 0, 'inhabitants': 0, \
+		'seconds': 0.0, 'errors': {}, 'aggir': {}}
+
+# Procedimiento mergeResult
+# Agrega el resultado de un script a los totales del lote
+# @args
+#    totals: totales de newTotals
+#    r: resultado de analyzeFile
+
+def mergeResult(totals, r):
+	totals['scripts'] += 1
+	totals['seconds'] += r['seconds']
+	if (r['failure'] is not None):
+		totals['failures'] += 1
+		return
+	for i in r['inhabitants']:
+		totals['inhabitants'] += 1
+		for error in i['errors']:
+			totals['errors'][error] = totals['errors'].get(error, 0) + 1
+		for var in i['aggir']:
+			if (not i['aggir'][var]):
+				totals['aggir'][var] = totals['aggir'].get(var, 0) + 1
+
+# Procedimiento printBatchResult
+# Imprime el resultado de un script del lote
+# @args
+#    r: resultado de analyzeFile
+
+def printBatchResult(r):
+	if (r['failure'] is not None):
+		print('%s: FAILED (%s) [%.3fs]' % (r['script'], r['failure'], r['seconds']))
+	else:
+		problems = sum([i['problems'] for i in r['inhabitants']])
+		print('%s: %d inhabitant(s), %d problem(s) [%.3fs]' % \
+			(r['script'], len(r['inhabitants']), problems, r['seconds']))
+
+# Procedimiento printBatchTotals
+# Imprime los totales del lote
+# @args
+#    totals: totales de newTotals/mergeResult
+
+def printBatchTotals(totals):
+	print('')
+	print('Scripts: %d (%d failed)' % (totals['scripts'], totals['failures']))
+	print('Inhabitants: %d' % totals['inhabitants'])
+	print('Analysis time: %.3fs\n' % totals['seconds'])
+	print('Inhabitants per detected problem:\n')
+	for error in sorted(totals['errors']):
+		print('  - %s: %d' % (error, totals['errors'][error]))
+	print('')
+	print('Inhabitants per AGGIR variable set to False:\n')
+	for var in AGGIR_CONST:
+		if (var in totals['aggir']):
+			print('%s: %d' % (var, totals['aggir'][var]))
+
+# Procedimiento addCacheOptions
+# Aniade a un parser las opciones de la cache de resultados
+# @args
+#    parser: argparse.ArgumentParser
+
+def addCacheOptions(parser):
+	parser.add_argument('--cache', default=None, metavar='DIR', \
+		help='reuse results of scripts already analyzed, stored in DIR')
+	parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE, metavar='MB', \
+		help='evict least recently used results above this size (default %(default)s)')
+	parser.add_argument('--clear-cache', action='store_true', \
+		help='empty the cache before analyzing')
+	parser.add_argument('--incremental', action='store_true', \
+		help='with --cache, reanalyze only the situations of a script that changed')
+
+# Funcion openCache
+# ResultCache segun las opciones de addCacheOptions
+# @args
+#    args: argumentos ya parseados
+#    parser: ArgumentParser, para reportar opciones invalidas
+# @returns
+#    ResultCache o None
+
+def openCache(args, parser):
+	if (args.cache is None):
+		if (args.incremental):
+			parser.error('--incremental requires --cache')
+		return None
+	cache = ResultCache(args.cache, args.cache_size * 1024 * 1024, args.incremental)
+	if (args.clear_cache):
+		cache.clear()
+	return cache
+
+# Funcion batchMain
+# Punto de entrada del modo batch
+# @args
+#    argv: argumentos luego de 'batch'
+# @returns
+#    Int, codigo de salida (1 si algun script fallo)
+
+def batchMain(argv):
+	parser = argparse.ArgumentParser(prog='analyzer.py batch', \
+		description='Analyze many iCasa scripts with a pool of processes.')
+	parser.add_argument('paths', nargs='*', help='scripts, globs, directories or tar/zip archives')
+	parser.add_argument('--room', default=None, help='default main door room')
+	parser.add_argument('--manifest', default=None, \
+		help="file with one 'script main_door_room' pair per line")
+	parser.add_argument('--workers', type=int, default=None)
+	parser.add_argument('--chunksize', type=int, default=8)
+	parser.add_argument('--format', choices=['text', 'ndjson'], default='text')
+	parser.add_argument('--errors', action='store_true', \
+		help='with ndjson, also write one record per detected problem')
+	parser.add_argument('--output', default=None, help='write to this file instead of stdout')
+	parser.add_argument('--db', default=None, metavar='FILE', \
+		help='also store the results in this SQLite database')
+	addCacheOptions(parser)
+	args = parser.parse_args(argv)
+
+	entries = readManifest(args.manifest, args.room) if args.manifest else []
+	if ((args.paths and args.room is None) or [e for e in entries if e[1] is None]):
+		parser.error('--room is required for scripts without a manifest room')
+	jobs = collectJobs(args.paths, args.room, entries)
+	first = next(jobs, None)
+	if (first is None):
+		parser.error('no scripts given')
+	jobs = itertools.chain([first], jobs)
+
+	out = open(args.output, 'w') if args.output else sys.stdout
+	writer = NdjsonWriter(out, args.errors) if args.format == 'ndjson' else None
+	# Solo el proceso principal escribe en la base, a medida que llegan los
+	# resultados de los workers
+	db = SqliteWriter(args.db) if args.db else None
+	# Los workers no recorren la cache, se eviccionan al final una sola vez
+	cache = openCache(args, parser)
+	if (cache is not None):
+		cache.defer_evict = True
+	totals = newTotals()
+	try:
+		for r in runBatch(jobs, args.workers, args.chunksize, cache):
+			mergeResult(totals, r)
+			if (db is not None):
+				db.writeResult(r)
+			if (writer is not None):
+				writer.writeResult(r)
+			else:
+				with redirect_stdout(out):
+					printBatchResult(r)
+		if (writer is not None):
+			record = {'record': 'totals'}
+			record.update(totals)
+			writer.write(record)
+		else:
+			with redirect_stdout(out):
+				printBatchTotals(totals)
+	finally:
+		if (cache is not None):
+			cache.evict()
+		if (db is not None):
+			db.close()
+		if (out is not sys.stdout):
+			out.close()
+	return 1 if totals['failures'] else 0
+
+#################################
+# Servidor                      #
+#################################
+
+# Funcion loadSettings
+# Lee un archivo de umbrales para el servidor: un dict JSON umbral -> valor
+# @args
+#    path: ruta del archivo, o None para los valores por defecto
+# @returns
+#    Dict umbral -> valor ya convertido
+
+def loadSettings(path):
+	if (path is None):
+		return {}
+	grid = loadGrid(path)
+	if (len(grid) != 1):
+		raise ValueError('expected one value per threshold')
+	return grid[0]
+
+# Funcion serveJob
+# Analiza un pedido dentro de un worker del servidor con los umbrales
+# vigentes al recibirlo, dejando luego los del modulo como estaban
+# @args
+#    job: trabajo (ver analyzeFile)
+#    settings: dict umbral -> valor
+#    cache: ResultCache o None
+# @returns
+#    Dict resultado de analyzeFile
+
+def serveJob(job, settings, cache=None):
+	previous = applyThresholds(settings)
+	try:
+		return analyzeFile(job, cache)
+	finally:
+		applyThresholds(previous)
+
+# Funcion requestJob
+# Arma el trabajo de un pedido de analisis. El pedido es un JSON con
+# main_door_room y path (ruta local) o script (contenido), o bien el
+# contenido del script como cuerpo con main_door_room (y opcionalmente
+# name) en la query
+# @args
+#    query: query string de la url
+#    content_type: tipo del cuerpo
+#    body: cuerpo del pedido (bytes)
+# @returns
+#    Trabajo (ver analyzeFile)
+
+def requestJob(query, content_type, body):
+	if (content_type.startswith('application/json')):
+		request = json.loads(body.decode('utf-8'))
+		if (not isinstance(request, dict)):
+			raise ValueError('expected a JSON object')
+	else:
+		request = {k: v[-1] for k, v in urllib.parse.parse_qs(query).items()}
+		if (body):
+			request['script'] = body
+	room = request.get('main_door_room')
+	if (not room):
+		raise ValueError('main_door_room is required')
+	if (request.get('script')):
+		data = request['script']
+		if (isinstance(data, str)):
+			data = data.encode('utf-8')
+		return (request.get('name', '<request>'), room, data)
+	if (request.get('path')):
+		return (request['path'], room)
+	raise ValueError('give a script path or its content')
+
+# Procedimiento serveWorker
+# Ciclo de un worker del servidor: recibe trabajos por 'conn' y devuelve
+# sus resultados, hasta recibir None o que se cierre la conexion
+# @args
+#    conn: extremo del worker de un multiprocessing.Pipe
+
+def serveWorker(conn):
+	# Las seniales las atiende el proceso principal, que detiene los workers
+	if (hasattr(signal, 'SIGHUP')):
+		signal.signal(signal.SIGHUP, signal.SIG_IGN)
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	signal.signal(signal.SIGTERM, signal.SIG_DFL)
+	while (True):
+		try:
+			task = conn.recv()
+		except EOFError:
+			return
+		if (task is None):
+			return
+		job, settings, cache = task
+		conn.send(serveJob(job, settings, cache))
+
+# Clase ServeWorker
+# Proceso del servidor que analiza un trabajo a la vez. A diferencia de un
+# pool, se puede detener si un trabajo excede el tiempo maximo
+#
+# @attrs
+#    process: multiprocessing.Process del worker
+#    conn: extremo del proceso principal del Pipe con el worker
+
+class ServeWorker:
+
+	# Inicializador, inicia el proceso. Con forkserver el worker no hereda
+	# los Pipe de los demas, y termina si el proceso principal muere
+	def __init__(self):
+		method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else None
+		context = multiprocessing.get_context(method)
+		self.conn, child = context.Pipe()
+		self.process = context.Process(target=serveWorker, args=(child,), daemon=True)
+		self.process.start()
+		child.close()
+
+	# Analiza un trabajo. Lanza concurrent.futures.TimeoutError si no termina
+	# en 'timeout' segundos y EOFError si el worker murio
+	def run(self, job, settings, cache, timeout):
+		self.conn.send((job, settings, cache))
+		if (not self.conn.poll(timeout)):
+			raise concurrent.futures.TimeoutError()
+		return self.conn.recv()
+
+	# Detiene el worker aunque este analizando
+	def kill(self):
+		self.process.terminate()
+		self.process.join()
+		self.conn.close()
+
+	# Detiene el worker una vez libre
+	def close(self):
+		try:
+			self.conn.send(None)
+		except OSError:
+			pass
+		self.conn.close()
+		self.process.join()
+
+# Clase AnalysisService
+# Workers ya iniciados que atienden pedidos de analisis, con un limite de
+# pedidos en curso, un tiempo maximo por pedido y umbrales que se recargan
+# sin detener los workers. Un pedido ocupa su lugar hasta que su trabajo
+# termina; si excede el tiempo maximo, su worker se detiene y se reemplaza
+#
+# @attrs
+#    workers: cantidad de procesos
+#    timeout: segundos maximos de espera por pedido, incluida la espera
+#             de un worker libre
+#    thresholds: ruta del archivo de umbrales, o None
+#    cache: ResultCache o None
+#    settings: umbrales vigentes
+#    generation: cantidad de cargas de umbrales
+#    slots: semaforo de pedidos en curso
+#    idle: cola de ServeWorker libres
+
+class AnalysisService:
+
+	# Inicializador
+	def __init__(self, workers=None, max_pending=None, timeout=DEFAULT_SERVE_TIMEOUT, \
+		thresholds=None, cache=None):
+		self.workers = workers or os.cpu_count() or 1
+		self.max_pending = max_pending or 4 * self.workers
+		self.timeout = timeout
+		self.thresholds = thresholds
+		self.cache = cache
+		self.settings = {}
+		self.generation = 0
+		self.served = 0
+		self.lock = threading.Lock()
+		self.slots = threading.BoundedSemaphore(self.max_pending)
+		self.reload()
+		# Iniciamos los workers antes del primer pedido
+		self.idle = queue.Queue()
+		for i in range(self.workers):
+			self.idle.put(ServeWorker())
+
+	# Relee el archivo de umbrales. Los pedidos en curso terminan con los
+	# anteriores; si el archivo es invalido se mantienen los vigentes
+	def reload(self):
+		settings = loadSettings(self.thresholds)
+		with self.lock:
+			self.settings = settings
+			self.generation += 1
+
+	# Analiza un trabajo. Retorna None si ya hay max_pending pedidos en
+	# curso; lanza concurrent.futures.TimeoutError si excede el tiempo y
+	# ChildProcessError si su worker murio
+	def analyze(self, job):
+		if (not self.slots.acquire(blocking=False)):
+			return None
+		try:
+			with self.lock:
+				settings = self.settings
+			deadline = time.monotonic() + self.timeout
+			try:
+				worker = self.idle.get(timeout=self.timeout)
+			except queue.Empty:
+				raise concurrent.futures.TimeoutError()
+			try:
+				result = worker.run(job, settings, self.cache, max(0.0, deadline - time.monotonic()))
+			except concurrent.futures.TimeoutError:
+				# El trabajo sigue corriendo: se detiene su worker y se reemplaza
+				worker.kill()
+				worker = ServeWorker()
+				raise
+			except (EOFError, OSError) as exc:
+				worker.kill()
+				worker = ServeWorker()
+				raise ChildProcessError('worker died: %s' % exc)
+			finally:
+				self.idle.put(worker)
+			with self.lock:
+				self.served += 1
+			return result
+		finally:
+			self.slots.release()
+
+	# Estado del servicio
+	def status(self):
+		with self.lock:
+			return {'status': 'ok', 'version': ANALYZER_VERSION, 'workers': self.workers, \
+				'max_pending': self.max_pending, 'timeout': self.timeout, 'served': self.served, \
+				'generation': self.generation, 'thresholds': {k: str(self.settings[k]) for k in self.settings}}
+
+	# Detiene los workers, esperando los pedidos en curso
+	def close(self):
+		for i in range(self.workers):
+			self.idle.get().close()
+
+# Clase AnalysisHandler
+# Atiende los pedidos HTTP del servidor:
+#   POST /analyze  analiza un script (ver requestJob)
+#   POST /reload   relee el archivo de umbrales
+#   GET  /health   estado del servicio
+# Las respuestas son JSON; /analyze responde el resultado de analyzeFile
+
+class AnalysisHandler(http.server.BaseHTTPRequestHandler):
+
+	# Conexiones persistentes, para muchos pedidos chicos
+	protocol_version = 'HTTP/1.1'
+
+	def do_GET(self):
+		if (urllib.parse.urlsplit(self.path).path == '/health'):
+			self.reply(200, self.server.service.status())
+		else:
+			self.reply(404, {'failure': 'unknown endpoint %s' % self.path})
+
+	def do_POST(self):
+		url = urllib.parse.urlsplit(self.path)
+		body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+		service = self.server.service
+		if (url.path == '/reload'):
+			try:
+				service.reload()
+			except (OSError, ValueError, KeyError) as exc:
+				self.reply(400, {'failure': '%s: %s' % (type(exc).__name__, exc)})
+				return
+			self.reply(200, service.status())
+		elif (url.path == '/analyze'):
+			try:
+				job = requestJob(url.query, self.headers.get('Content-Type', ''), body)
+			except (ValueError, UnicodeDecodeError) as exc:
+				self.reply(400, {'failure': '%s: %s' % (type(exc).__name__, exc)})
+				return
+			try:
+				result = service.analyze(job)
+			except concurrent.futures.TimeoutError:
+				self.reply(504, {'failure': 'timed out after %ss' % service.timeout})
+				return
+			except ChildProcessError as exc:
+				self.reply(500, {'failure': '%s: %s' % (type(exc).__name__, exc)})
+				return
+			if (result is None):
+				self.reply(503, {'failure': 'too many pending requests'})
 			else:
-				print('Detected problems: %s\n' % (len(errors_p)))
-			print('AGGIR variables value according to the analysis:\n')
-			for var in p.aggir_const:
-				print('%s: %s' % (var, p.aggir_const[var]))
+				self.reply(200 if result['failure'] is None else 422, result)
+		else:
+			self.reply(404, {'failure': 'unknown endpoint %s' % self.path})
+
+	# Envia una respuesta JSON
+	def reply(self, status, record):
+		data = (json.dumps(record) + '\n').encode('utf-8')
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def address_string(self):
+		# Los clientes de un socket Unix no tienen direccion
+		return self.client_address[0] if self.client_address else 'unix'
+
+	def log_message(self, format, *args):
+		if (self.server.verbose):
+			http.server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+# Clase TCPAnalysisServer
+# Servidor HTTP en localhost, un hilo por conexion
+class TCPAnalysisServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+	daemon_threads = True
+
+# Clase UnixAnalysisServer
+# Servidor HTTP en un socket Unix, un hilo por conexion
+class UnixAnalysisServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+
+# Funcion serveMain
+# Punto de entrada del modo serve
+# @args
+#    argv: argumentos luego de 'serve'
+# @returns
+#    Int, codigo de salida
+
+def serveMain(argv):
+	parser = argparse.ArgumentParser(prog='analyzer.py serve', \
+		description='Serve analyses over localhost HTTP or a Unix socket with a warm pool of workers.')
+	parser.add_argument('--socket', default=None, metavar='PATH', \
+		help='listen on this Unix socket instead of TCP')
+	parser.add_argument('--host', default='127.0.0.1')
+	parser.add_argument('--port', type=int, default=DEFAULT_SERVE_PORT)
+	parser.add_argument('--workers', type=int, default=None)
+	parser.add_argument('--max-pending', type=int, default=None, \
+		help='requests in progress before answering 503 (default 4 per worker)')
+	parser.add_argument('--timeout', type=float, default=DEFAULT_SERVE_TIMEOUT, \
+		help='seconds before answering 504 (default %(default)s)')
+	parser.add_argument('--thresholds', default=None, metavar='FILE', \
+		help='JSON file {threshold: value}, reread on SIGHUP or POST /reload')
+	parser.add_argument('--verbose', action='store_true', help='log every request to stderr')
+	addCacheOptions(parser)
+	args = parser.parse_args(argv)
+
+	try:
+		service = AnalysisService(args.workers, args.max_pending, args.timeout, \
+			args.thresholds, openCache(args, parser))
+	except (OSError, ValueError, KeyError) as exc:
+		parser.error('bad thresholds %s: %s' % (args.thresholds, exc))
+	if (args.socket is not None):
+		if (os.path.exists(args.socket)):
+			os.remove(args.socket)
+		server = UnixAnalysisServer(args.socket, AnalysisHandler)
+		where = args.socket
+	else:
+		server = TCPAnalysisServer((args.host, args.port), AnalysisHandler)
+		where = 'http://%s:%d' % server.server_address[:2]
+	server.service = service
+	server.verbose = args.verbose
+
+	# SIGHUP recarga los umbrales, SIGTERM detiene el servidor
+	def reloadSignal(signum, frame):
+		try:
+			service.reload()
+		except (OSError, ValueError, KeyError) as exc:
+			print('Keeping thresholds, bad %s: %s' % (args.thresholds, exc), file=sys.stderr)
+
+	def stopSignal(signum, frame):
+		raise KeyboardInterrupt()
+
+	if (hasattr(signal, 'SIGHUP')):
+		signal.signal(signal.SIGHUP, reloadSignal)
+	signal.signal(signal.SIGTERM, stopSignal)
+
+	print('Listening on %s with %d workers' % (where, service.workers), file=sys.stderr)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		service.close()
+		if (args.socket is not None and os.path.exists(args.socket)):
+			os.remove(args.socket)
+	return 0
+
+#################################
+# Codigo                        #
+#################################
+
+# Funcion principal
+def main(argv):
+	# Modo batch
+	if (len(argv) > 1 and argv[1] == 'batch'):
+		sys.exit(batchMain(argv[2:]))
+	# Modo watch
+	if (len(argv) > 1 and argv[1] == 'watch'):
+		sys.exit(watchMain(argv[2:]))
+	# Barrido de umbrales
+	if (len(argv) > 1 and argv[1] == 'sweep'):
+		sys.exit(sweepMain(argv[2:]))
+	# Compilacion a formato binario
+	if (len(argv) > 1 and argv[1] == 'compile'):
+		sys.exit(compileMain(argv[2:]))
+	# Servidor de analisis
+	if (len(argv) > 1 and argv[1] == 'serve'):
+		sys.exit(serveMain(argv[2:]))
+	parser = argparse.ArgumentParser(prog='analyzer.py', \
+		usage='analyzer.py [options] input_file.bhv main_door_room')
+	parser.add_argument('input_file')
+	parser.add_argument('main_door_room')
+	parser.add_argument('--format', choices=['text', 'ndjson'], default='text')
+	parser.add_argument('--errors', action='store_true', \
+		help='with ndjson, also write one record per detected problem')
+	parser.add_argument('--output', default=None, help='write to this file instead of stdout')
+	parser.add_argument('--db', default=None, metavar='FILE', \
+		help='also store the result in this SQLite database')
+	parser.add_argument('--profile', action='store_true', \
+		help='report time, calls and peak memory of each phase on stderr')
+	parser.add_argument('--profile-dump', default=None, metavar='FILE', \
+		help='also write cProfile stats (pstats format) to FILE')
+	addCacheOptions(parser)
+	args = parser.parse_args(argv[1:])
+
+	global PROFILER
+	if (args.profile):
+		PROFILER = Profiler()
+	cprofile = None
+	if (args.profile_dump):
+		cprofile = cProfile.Profile()
+		cprofile.enable()
+
+	out = open(args.output, 'w') if args.output else sys.stdout
+	try:
+		# Ingesta y analisis del script, o su resultado guardado
+		result = analyzeScript(args.input_file, args.main_door_room, openCache(args, parser))
+
+		if (not result['timed']):
+			# En ndjson, stdout solo lleva registros
+			notice = sys.stderr if args.format == 'ndjson' else out
+			print('No starting time given. Setting default: 00:00:00', file=notice)
+
+		# Devolvemos respuesta
+		phaseStart('report')
+		if (args.format == 'ndjson'):
+			writer = NdjsonWriter(out, args.errors)
+			writer.writeResult({'script': args.input_file, \
+				'inhabitants': result['inhabitants'], 'errors': result['errors']})
+		else:
+			with redirect_stdout(out):
+				printSummary(result['inhabitants'])
+		if (args.db is not None):
+			db = SqliteWriter(args.db)
+			try:
+				db.writeResult({'script': args.input_file, 'main_door_room': args.main_door_room, \
+					'inhabitants': result['inhabitants'], 'errors': result['errors'], \
+					'cached': result['cached']})
+			finally:
+				db.close()
+		phaseStop('report')
+	finally:
+		if (out is not sys.stdout):
+			out.close()
+		if (cprofile is not None):
+			cprofile.disable()
+			cprofile.dump_stats(args.profile_dump)
+		if (PROFILER is not None):
+			PROFILER.close()
+			PROFILER.report(sys.stderr)
+			PROFILER = None
 
 # Llamado a funcion principal
 if (__name__ == '__main__'):
@@ -0,0 +1,325 @@
+# Benchmark de escalabilidad del analizador de scripts iCasa
+#
+# Genera scripts sinteticos de tamanio creciente, mide el tiempo y la
+# memoria pico de cada fase del analizador y ajusta el exponente de
+# escalamiento para detectar regresiones cuadraticas
+#
+
+#################################
+# Imports                       #
+#################################
+
+# Manejo herramientas del sistema
+import sys
+import os
+import argparse
+import tempfile
+
+# Medicion
+import time
+import tracemalloc
+import math
+import random
+
+# Analizador
+import analyzer
+
+#################################
+# Constantes                    #
+#################################
+
+# Zonas conocidas por las reglas del analizador
+BASE_ZONES = ['kitchen', 'livingroom', 'bedroom', 'bathroom', 'hallway']
+
+# Tipos de device con la propiedad que cambian y sus posibles valores
+DEVICE_TYPES = [
+	('iCasa.BinaryLight', 'binaryLight.powerStatus', ['true', 'false']),
+	('iCasa.DimmerLight', 'dimmerLight.powerLevel', ['0.0', '0.5', '1.0']),
+	('iCasa.PresenceSensor', 'presenceSensor.sensedPresence', ['true', 'false']),
+	('iCasa.DoorWindowSensor', 'doorWindowSensor.opened', ['true', 'false']),
+	('iCasa.Heater', 'heater.powerLevel', ['0.0', '0.5']),
+	('iCasa.Cooler', 'cooler.powerLevel', ['0.0', '0.5']),
+	('iCasa.ToggleSwitch', 'powerSwitch.currentStatus', ['true', 'false']),
+	('iCasa.FloodSensor', 'flood.alarm', ['false', 'false', 'true']),
+	('iCasa.COGasSensor', 'carbonMonoxydeSensor.currentConcentration', ['2.0', '50.0']),
+	('iCasa.CO2GasSensor', 'carbonDioxydeSensor.currentConcentration', ['400.0', '9500.0']),
+	('iCasa.Siren', 'siren.status', ['false', 'false', 'true']),
+]
+
+# Tamanios por defecto (cantidad de acciones)
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+# Fases internas que no llegan a este tiempo en el mayor tamanio se
+# reportan pero no cuentan para --max-exponent: su ajuste es puro ruido
+NOISE_SECONDS = 0.01
+
+#################################
+# Generador                     #
+#################################
+
+# Procedimiento generateScript
+# Escribe un script .bhv sintetico con las mismas etiquetas que entiende
+# el analizador: setup de zonas, devices y personas, seguido de
+# situaciones separadas por delays de cero segundos
+# @args
+#    stream: archivo de salida (texto)
+#    actions: cantidad aproximada de acciones a generar
+#    zones: cantidad de zonas
+#    devices: cantidad de devices
+#    people: cantidad de personas
+#    situation_size: acciones por situacion
+#    seed: semilla del generador aleatorio
+
+def generateScript(stream, actions, zones=5, devices=22, people=1, situation_size=200, seed=0):
+	rng = random.Random(seed)
+	zone_names = BASE_ZONES[:zones] + ['room%d' % i for i in range(zones - len(BASE_ZONES))]
+	count = 0
+
+	stream.write('<?xml version="1.0" encoding="UTF-8" standalone="no" ?>\n')
+	stream.write('<behavior startdate="25/09/2019-00:00:00" factor="1">\n')
+
+	# Zonas
+	for z in zone_names:
+		stream.write('\t<create-zone id="%s" leftX="0" topY="0" bottomZ="0" '
+			'X-Length="100" Y-Length="100" Z-Length="100"/>\n' % z)
+		for variable, value in [('Temperature', '293.15'), ('Illuminance', '200.0')]:
+			stream.write('\t<add-zone-variable zoneId="%s" variable="%s" />\n' % (z, variable))
+			stream.write('\t<modify-zone-variable zoneId="%s" variable="%s" value="%s" />\n' \
+				% (z, variable, value))
+		count += 5
+
+	# Devices, repartidos en las zonas
+	device_list = []
+	for i in range(devices):
+		type_name, prop, values = DEVICE_TYPES[i % len(DEVICE_TYPES)]
+		name = '%s-%d' % (type_name.split('.')[1], i)
+		zone = zone_names[i % len(zone_names)]
+		stream.write('\t<create-device id="%s" type="%s" />\n' % (name, type_name))
+		stream.write('\t<move-device-zone deviceId="%s" zoneId="%s" />\n' % (name, zone))
+		device_list.append((name, zone, prop, values))
+		count += 2
+
+	# Personas
+	location = {}
+	for i in range(people):
+		name = 'Person%d' % i
+		location[name] = rng.choice(zone_names)
+		stream.write('\t<create-person id="%s" type="Girl" />\n' % name)
+		stream.write('\t<move-person-zone personId="%s" zoneId="%s" />\n' % (name, location[name]))
+		count += 2
+
+	# Simulacion
+	in_situation = 0
+	while (count < actions):
+		step = rng.random()
+		person = rng.choice(list(location))
+		if (step < 0.15):
+			# Movimiento a otra zona
+			location[person] = rng.choice(zone_names)
+			stream.write('\t<move-person-zone personId="%s" zoneId="%s" />\n' \
+				% (person, location[person]))
+		elif (step < 0.55):
+			# Cambio de propiedad de un device
+			name, zone, prop, values = rng.choice(device_list)
+			stream.write('\t<set-device-property deviceId="%s" property="%s" value="%s"/>\n' \
+				% (name, prop, rng.choice(values)))
+		elif (step < 0.7):
+			# Cambio de variable zonal (coccion en la cocina)
+			zone = location[person]
+			if (zone == 'kitchen'):
+				value = '%.2f' % rng.choice([293.15, 353.15, 373.15])
+				variable = 'Temperature'
+			else:
+				value = '%.1f' % rng.choice([200.0, 400.0])
+				variable = 'Illuminance'
+			stream.write('\t<modify-zone-variable zoneId="%s" variable="%s" value="%s" />\n' \
+				% (zone, variable, value))
+		else:
+			# Paso del tiempo
+			unit = rng.choice(['s', 'm', 'm', 'h'])
+			value = rng.randint(1, 59) if unit != 'h' else rng.randint(1, 3)
+			stream.write('\t<delay value="%d" unit="%s" />\n' % (value, unit))
+		count += 1
+		in_situation += 1
+		# Fin de situacion
+		if (in_situation >= situation_size):
+			stream.write('\t<delay value="0" unit="s" />\n')
+			count += 1
+			in_situation = 0
+	stream.write('\t<delay value="0" unit="s" />\n')
+	stream.write('</behavior>\n')
+
+#################################
+# Medicion                      #
+#################################
+
+# Funcion runPhases
+# Corre el analizador sobre un script midiendo cada fase, con el
+# perfilador del analizador activo (sin medir memoria) para obtener
+# tambien el detalle por fase interna
+# @args
+#    path: ruta del script
+#    main_door_room: zona con la puerta principal
+# @returns
+#    Tupla (dict fase -> segundos, Profiler con las fases internas)
+
+def runPhases(path, main_door_room):
+	timings = {}
+	profiler = analyzer.Profiler(memory=False)
+	analyzer.PROFILER = profiler
+	try:
+		started = time.perf_counter()
+		script = analyzer.ingestScript(path)
+		timings['ingest'] = time.perf_counter() - started
+
+		time_sim = script.time_sim
+		if (time_sim is None):
+			time_sim = analyzer.datetime.timedelta(0)
+		started = time.perf_counter()
+		elist = analyzer.analyze(script, main_door_room, time_sim)
+		timings['analyze'] = time.perf_counter() - started
+
+		started = time.perf_counter()
+		analyzer.summarize(script.pclass, elist)
+		timings['summarize'] = time.perf_counter() - started
+	finally:
+		analyzer.PROFILER = None
+	return timings, profiler
+
+# Funcion peakMemory
+# Memoria pico (bytes) de un analisis completo segun tracemalloc
+# @args
+#    path: ruta del script
+#    main_door_room: zona con la puerta principal
+# @returns
+#    Int
+
+def peakMemory(path, main_door_room):
+	tracemalloc.start()
+	try:
+		runPhases(path, main_door_room)
+		return tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+
+# Funcion scalingExponent
+# Pendiente del ajuste por minimos cuadrados de log(y) contra log(x)
+# @args
+#    xs: tamanios
+#    ys: mediciones
+# @returns
+#    Float, o None si hay menos de dos puntos utilizables
+
+def scalingExponent(xs, ys):
+	points = [(math.log(x), math.log(y)) for x, y in zip(xs, ys) if x > 0 and y > 0]
+	if (len(points) < 2):
+		return None
+	mean_x = sum([p[0] for p in points]) / len(points)
+	mean_y = sum([p[1] for p in points]) / len(points)
+	num = sum([(p[0] - mean_x) * (p[1] - mean_y) for p in points])
+	den = sum([(p[0] - mean_x) ** 2 for p in points])
+	if (den == 0):
+		return None
+	return num / den
+
+#################################
+# Codigo                        #
+#################################
+
+# Funcion benchMain
+# Genera scripts de cada tamanio, los analiza y reporta
+# @args
+#    args: argumentos ya parseados
+# @returns
+#    Int, codigo de salida (1 si algun exponente supera el maximo)
+
+def benchMain(args):
+	rows = []
+	workdir = args.keep or tempfile.mkdtemp(prefix='icasa-bench-')
+	for size in args.sizes:
+		path = os.path.join(workdir, 'synthetic-%d.bhv' % size)
+		with open(path, 'w') as f:
+			generateScript(f, size, args.zones, args.devices, args.people, \
+				args.situation_size, args.seed)
+		best = None
+		for i in range(args.repeat):
+			timings, profiler = runPhases(path, args.room)
+			if (best is None or sum(timings.values()) < sum(best.values())):
+				best, best_profiler = timings, profiler
+		peak = peakMemory(path, args.room)
+		phases = dict([(name, best_profiler.phases[name][0]) for name in best_profiler.phases])
+		rows.append((size, best, peak, phases))
+		print('%9d actions: %s total=%.3fs peak=%.1fMB' % (size, \
+			' '.join(['%s=%.3fs' % (k, best[k]) for k in best]), \
+			sum(best.values()), peak / 1e6))
+		if (args.phases):
+			best_profiler.report(sys.stdout)
+			print('')
+		sys.stdout.flush()
+		if (not args.keep):
+			os.remove(path)
+	if (not args.keep):
+		os.rmdir(workdir)
+
+	# Exponentes de escalamiento
+	status = 0
+	sizes = [r[0] for r in rows]
+	print('')
+	print('Scaling exponents (1.0 = linear):\n')
+	series = [(phase, [r[1][phase] for r in rows]) for phase in rows[0][1]]
+	series.append(('total', [sum(r[1].values()) for r in rows]))
+	series.append(('peak memory', [r[2] for r in rows]))
+	# Fases internas del perfilador, en el orden en que aparecieron; una
+	# fase ausente en algun tamanio no entra en el ajuste de ese punto
+	names = []
+	for r in rows:
+		names.extend([name for name in r[3] if name not in names])
+	series.extend([('phase ' + name, [r[3].get(name, 0.0) for r in rows]) for name in names])
+	for name, values in series:
+		exponent = scalingExponent(sizes, values)
+		if (exponent is None):
+			print('%s: n/a' % name)
+			continue
+		flag = ''
+		if (name.startswith('phase ') and values[-1] < NOISE_SECONDS):
+			flag = '  (too short to check)'
+		elif (args.max_exponent is not None and exponent > args.max_exponent):
+			flag = '  <-- above %.2f' % args.max_exponent
+			status = 1
+		print('%s: %.2f%s' % (name, exponent, flag))
+	return status
+
+# Funcion principal
+def main(argv):
+	parser = argparse.ArgumentParser(prog='benchmark.py', \
+		description='Scaling benchmark for analyzer.py on synthetic iCasa scripts.')
+	parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, \
+		help='number of actions of each generated script')
+	parser.add_argument('--zones', type=int, default=5)
+	parser.add_argument('--devices', type=int, default=22)
+	parser.add_argument('--people', type=int, default=1)
+	parser.add_argument('--situation-size', type=int, default=200, \
+		help='actions between zero-second delays')
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--room', default='livingroom', help='main door room')
+	parser.add_argument('--repeat', type=int, default=1, help='keep the best of N runs')
+	parser.add_argument('--max-exponent', type=float, default=None, \
+		help='exit with status 1 if a phase scales worse than this')
+	parser.add_argument('--phases', action='store_true', \
+		help='print the per-phase profiler table of each size')
+	parser.add_argument('--keep', default=None, \
+		help='directory where generated scripts are kept')
+	parser.add_argument('--generate', default=None, metavar='FILE', \
+		help='only write a script of the first size to FILE')
+	args = parser.parse_args(argv[1:])
+
+	if (args.generate is not None):
+		with open(args.generate, 'w') as f:
+			generateScript(f, args.sizes[0], args.zones, args.devices, args.people, \
+				args.situation_size, args.seed)
+		return 0
+	return benchMain(args)
+
+# Llamado a funcion principal
+if (__name__ == '__main__'):
+	sys.exit(main(sys.argv))
@@ -0,0 +1,74 @@
+# Pruebas del mapeo de errores a constantes AGGIR
+#
+# Cada error registrado con registerAggir debe ser un error que el
+# analizador realmente reporta; si no, sus constantes nunca se apagan
+#
+
+#################################
+# Imports                       #
+#################################
+
+import os
+import re
+import sys
+import datetime
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import analyzer
+
+#################################
+# Funciones auxiliares          #
+#################################
+
+# Funcion producedErrors
+# Errores que reporta el analizador, tomados de su codigo: los literales
+# de 'error': ... y ctx.report(e, ...), con '%s' reemplazado por el nombre
+# corto de cada tipo de device con reglas registradas
+# @returns
+#    Set de strings
+
+def producedErrors():
+	with open(os.path.join(ROOT, 'analyzer.py')) as f:
+		source = f.read()
+	literals = re.findall(r"'error': '([^']*)'", source) + \
+		re.findall(r"\.report\(e, '([^']*)'\)", source)
+	types = [t.split('.')[1] for t in analyzer.RULES]
+	errors = set()
+	for literal in literals:
+		if ('%s' in literal):
+			errors.update([literal % t for t in types])
+		else:
+			errors.add(literal)
+	return errors
+
+#################################
+# Pruebas                       #
+#################################
+
+class AggirTest(unittest.TestCase):
+
+	# Todas las claves de AGGIR_RULES corresponden a un error reportado
+	def test_registered_errors_are_produced(self):
+		produced = producedErrors()
+		missing = sorted([error for error in analyzer.AGGIR_RULES if error not in produced])
+		self.assertEqual(missing, [])
+
+	# 'Never going out' de los chequeos de la simulacion completa apaga sus
+	# constantes AGGIR
+	def test_never_going_out_maps_aggir(self):
+		person = analyzer.Person('Ana', 'Grandmother', [], dict(analyzer.AGGIR_CONST))
+		totals = analyzer.SimulationTotals()
+		totals.total_time = datetime.timedelta(hours=30)
+		elist = []
+		totals.check([person], elist)
+		self.assertIn('Never going out', [e['error'] for e in elist])
+		analyzer.mapAggir([person], [e for e in elist if e['error'] == 'Never going out'])
+		for var in ['TRANSFERS', 'COHERENCE', 'HOUSEKEEPING', 'PURCHASES', 'LEISURE_ACTS']:
+			self.assertFalse(person.aggir_const[var], var)
+		self.assertTrue(person.aggir_const['DRESSING'])
+
+if (__name__ == '__main__'):
+	unittest.main()
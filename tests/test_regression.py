@@ -0,0 +1,164 @@
+# Pruebas de regresion sobre los scripts de ejemplo
+#
+# Cada script del repositorio y de tests/scripts se analiza por todos los
+# caminos del analizador (completo, watch, cache incremental, compilado y
+# comprimido) y se compara con el resultado esperado guardado en tests/expected.
+# Para regenerarlo luego de un cambio de veredicto acordado:
+#    python tests/test_regression.py --regenerate
+#
+
+#################################
+# Imports                       #
+#################################
+
+import os
+import sys
+import gzip
+import json
+import glob
+import shutil
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import analyzer
+
+#################################
+# Constantes                    #
+#################################
+
+# Scripts de ejemplo, mas los de tests/scripts, y habitaciones con la
+# puerta principal a probar
+SCRIPTS = sorted(glob.glob(os.path.join(ROOT, '*.bhv'))) + \
+	sorted(glob.glob(os.path.join(ROOT, 'tests', 'scripts', '*.bhv')))
+ROOMS = ['livingroom', 'kitchen', 'bedroom']
+
+# Carpeta de resultados esperados, uno por script
+EXPECTED = os.path.join(ROOT, 'tests', 'expected')
+
+#################################
+# Funciones auxiliares          #
+#################################
+
+# Funcion expectedPath
+# @args
+#    script: ruta del script de ejemplo
+# @returns
+#    Ruta del resultado esperado del script
+
+def expectedPath(script):
+	return os.path.join(EXPECTED, os.path.basename(script) + '.json')
+
+# Funcion sortedErrors
+# Errores en un orden independiente del camino que los detecto
+# @args
+#    errors: lista de dicts de errorRecords
+# @returns
+#    Lista ordenada
+
+def sortedErrors(errors):
+	return sorted(errors, key=lambda e: (-1 if e['position'] is None else e['position'], \
+		e['executer'] or '', e['error']))
+
+# Funcion fullResult
+# Resultado del analisis completo de un script, como se guarda en
+# tests/expected
+# @args
+#    path: ruta del script
+#    room: habitacion con la puerta principal
+#    cache: ResultCache o None
+# @returns
+#    Dict con inhabitants y errors
+
+def fullResult(path, room, cache=None):
+	result = analyzer.analyzeScript(path, room, cache)
+	return {'inhabitants': result['inhabitants'], 'errors': sortedErrors(result['errors'])}
+
+#################################
+# Pruebas                       #
+#################################
+
+class RegressionTest(unittest.TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		cls.workdir = tempfile.mkdtemp(prefix='icasa-test-')
+		cls.expected = {}
+		for script in SCRIPTS:
+			with open(expectedPath(script)) as f:
+				cls.expected[script] = json.load(f)
+
+	@classmethod
+	def tearDownClass(cls):
+		shutil.rmtree(cls.workdir)
+
+	# Analisis completo desde el .bhv
+	def test_full(self):
+		for script in SCRIPTS:
+			for room in ROOMS:
+				with self.subTest(script=os.path.basename(script), room=room):
+					self.assertEqual(fullResult(script, room), self.expected[script][room])
+
+	# Modo watch: mismo resumen y mismos errores que el analisis completo
+	def test_watch(self):
+		for script in SCRIPTS:
+			for room in ROOMS:
+				with self.subTest(script=os.path.basename(script), room=room):
+					found = []
+					online = analyzer.OnlineAnalyzer(room, found.append)
+					with open(script) as f:
+						summary = online.consume(analyzer.streamActions(f))
+					self.assertEqual(summary, self.expected[script][room]['inhabitants'])
+					self.assertEqual(sortedErrors(analyzer.errorRecords(found)), \
+						self.expected[script][room]['errors'])
+
+	# Cache incremental: sin entradas, con el resultado del script completo
+	# y, sin este, reusando el de cada situacion
+	def test_incremental(self):
+		cache = analyzer.ResultCache(os.path.join(self.workdir, 'cache'), incremental=True)
+		for script in SCRIPTS:
+			for room in ROOMS:
+				with self.subTest(script=os.path.basename(script), room=room):
+					cache.clear()
+					self.assertEqual(fullResult(script, room, cache), self.expected[script][room])
+					self.assertEqual(fullResult(script, room, cache), self.expected[script][room])
+					os.remove(cache.path(cache.key(analyzer.readScript(script), room)))
+					self.assertEqual(fullResult(script, room, cache), self.expected[script][room])
+
+	# Script compilado, leido por mmap
+	def test_compiled(self):
+		for script in SCRIPTS:
+			target = os.path.join(self.workdir, os.path.basename(script) + 'c')
+			analyzer.compileScript(script, target)
+			for room in ROOMS:
+				with self.subTest(script=os.path.basename(script), room=room):
+					self.assertEqual(fullResult(target, room), self.expected[script][room])
+
+	# Script comprimido con gzip
+	def test_compressed(self):
+		for script in SCRIPTS:
+			target = os.path.join(self.workdir, os.path.basename(script) + '.gz')
+			with open(script, 'rb') as f, gzip.open(target, 'wb') as g:
+				shutil.copyfileobj(f, g)
+			for room in ROOMS:
+				with self.subTest(script=os.path.basename(script), room=room):
+					self.assertEqual(fullResult(target, room), self.expected[script][room])
+
+# Procedimiento regenerate
+# Escribe los resultados esperados con el analisis completo actual
+
+def regenerate():
+	if (not os.path.isdir(EXPECTED)):
+		os.makedirs(EXPECTED)
+	for script in SCRIPTS:
+		with open(expectedPath(script), 'w') as f:
+			json.dump({room: fullResult(script, room) for room in ROOMS}, f, indent=1, sort_keys=True)
+			f.write('\n')
+
+if (__name__ == '__main__'):
+	if ('--regenerate' in sys.argv):
+		regenerate()
+	else:
+		unittest.main()